@@ -0,0 +1,74 @@
+# coding: utf-8
+"""Compares size and speed of the JSON and the binary (``fsm.codec``)
+dumps of a machine with some history and of the charts alone. Full dumps
+are loaded with a new registry every time, so the chart is decoded too::
+
+    $ python benchmarks/bench_codec.py
+"""
+import json
+import os
+import pickle
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fsm.core import HSMERunner  # noqa: E402
+from fsm.parsers import HSMEDictsParser, HSMEStateChart  # noqa: E402
+from fsm.registry import HSMEChartRegistry  # noqa: E402
+
+from bench_send import LOOP_CHART  # noqa: E402
+from suite import CHARTS  # noqa: E402
+
+
+def bench(name, dump, load, number):
+    data = dump()
+    dump_time = min(timeit.repeat(dump, number=number, repeat=3)) / number
+    load_time = min(
+        timeit.repeat(lambda: load(data), number=number, repeat=3)
+    ) / number
+    print(
+        '{0}: {1} bytes, dump {2:.2f} usec, load {3:.2f} usec'.format(
+            name, len(data), dump_time * 1e6, load_time * 1e6,
+        )
+    )
+
+
+def load_new(data):
+    return HSMERunner(registry=HSMEChartRegistry()).load(data)
+
+
+def main(history=100, number=2000, chart_size=300, chart_number=50):
+    hsme = HSMERunner()
+    hsme.parse(LOOP_CHART)
+    hsme.start()
+    for _ in range(history):
+        hsme.send('next')
+
+    runner = HSMERunner()
+    bench('json full', hsme.dump, load_new, number)
+    bench(
+        'json compact', lambda: hsme.dump(compact=True), runner.load, number,
+    )
+    bench('binary', lambda: hsme.dump(binary=True), runner.load, number)
+    bench(
+        'pickle', lambda: pickle.dumps(hsme, pickle.HIGHEST_PROTOCOL),
+        pickle.loads, number,
+    )
+
+    for name, get_chart in sorted(CHARTS.items()):
+        chart = HSMEDictsParser(get_chart(chart_size)).parse()
+        bench(
+            'chart {0} json'.format(name),
+            lambda: json.dumps(chart.as_dict()),
+            lambda data: HSMEStateChart.as_obj(json.loads(data)),
+            chart_number,
+        )
+        bench(
+            'chart {0} binary'.format(name), chart.as_bytes,
+            HSMEStateChart.from_bytes, chart_number,
+        )
+
+
+if __name__ == '__main__':
+    main()
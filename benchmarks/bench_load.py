@@ -0,0 +1,60 @@
+# coding: utf-8
+"""Measures ``load()`` -> ``send()`` -> ``dump()`` of a full dump of a big
+chart into a process that doesn't know the chart yet, with the eager
+``HSMEStateChart`` and the lazy ``HSMELazyStateChart``::
+
+    $ python benchmarks/bench_load.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fsm.core import HSMERunner  # noqa: E402
+from fsm.parsers import HSMELazyStateChart, HSMEStateChart  # noqa: E402
+from fsm.registry import HSMEChartRegistry  # noqa: E402
+
+
+def get_chart(size):
+    chart = []
+    for i in range(size):
+        chart.append({
+            'state': 's{0}'.format(i),
+            'is_initial': i == 0,
+            'events': {
+                'next': 's{0}'.format((i + 1) % size),
+                'reset': 's0',
+            },
+        })
+    return chart
+
+
+def bench(chart_cls, dump, number, repeat):
+    class Runner(HSMERunner):
+        LAZY_STATE_CHART_CLS = chart_cls
+
+    def run():
+        hsme = Runner(registry=HSMEChartRegistry())
+        hsme.load(dump)
+        hsme.send('next')
+        hsme.dump()
+
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    print('{0}: {1:.0f} usec per load/send/dump'.format(
+        chart_cls.__name__, best / number * 1e6,
+    ))
+
+
+def main(size=300, number=100, repeat=5):
+    hsme = HSMERunner(registry=HSMEChartRegistry())
+    hsme.parse(get_chart(size))
+    hsme.start()
+    dump = hsme.dump()
+
+    for chart_cls in (HSMEStateChart, HSMELazyStateChart):
+        bench(chart_cls, dump, number, repeat)
+
+
+if __name__ == '__main__':
+    main()
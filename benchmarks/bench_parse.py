@@ -0,0 +1,75 @@
+# coding: utf-8
+"""Compares ``HSMEDictsParser`` and ``HSMEStreamParser`` on a big generated
+chart stored as a JSON-lines file, parse time and peak memory::
+
+    $ python benchmarks/bench_parse.py
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fsm.parsers import HSMEDictsParser, HSMEStreamParser  # noqa: E402
+
+
+def write_chart(path, size):
+    with open(path, 'w') as chart_file:
+        for i in range(size):
+            chart_file.write(json.dumps({
+                'state': 's{0}'.format(i),
+                'is_initial': i == 0,
+                'trigger': i % 7,
+                'events': {
+                    'next': 's{0}'.format((i + 1) % size),
+                    'back': 's{0}'.format((i - 1) % size),
+                    'reset': 's0',
+                },
+            }))
+            chart_file.write('\n')
+
+
+def parse_dicts(path):
+    with open(path) as chart_file:
+        chart = [json.loads(line) for line in chart_file]
+    return HSMEDictsParser(chart).parse()
+
+
+def parse_stream(path):
+    with open(path) as chart_file:
+        return HSMEStreamParser(chart_file).parse()
+
+
+def bench(name, parse, path):
+    started_at = time.time()
+    chart = parse(path)
+    elapsed = time.time() - started_at
+    del chart
+
+    # tracemalloc slows parsing down a lot, so memory is measured apart
+    tracemalloc.start()
+    chart = parse(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print('{0}: {1} states, {2:.2f} sec, peak memory {3:.1f} MB'.format(
+        name, len(chart.states), elapsed, peak / 2.0 ** 20,
+    ))
+
+
+def main(size=100000):
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'chart.jsonl')
+        write_chart(path, size)
+        bench('HSMEDictsParser', parse_dicts, path)
+        bench('HSMEStreamParser', parse_stream, path)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# coding: utf-8
+"""Measures ``HSMEReplayer`` throughput with different numbers of worker
+processes::
+
+    $ python benchmarks/bench_replay.py
+"""
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fsm.parsers import HSMEDictsParser  # noqa: E402
+from fsm.replay import HSMEReplayer  # noqa: E402
+
+from bench_send import LOOP_CHART  # noqa: E402
+
+
+def get_records(count, length):
+    events = ['next'] * length
+    for i in range(count):
+        yield i, events
+
+
+def main(count=20000, length=50):
+    chart = HSMEDictsParser(LOOP_CHART).parse()
+    processes = 1
+    while processes <= multiprocessing.cpu_count():
+        replayer = HSMEReplayer(chart, processes=processes, chunksize=500)
+        for _ in replayer.run(get_records(count, length)):
+            pass
+        print('{0} processes: {1!r}'.format(processes, replayer.stats))
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# coding: utf-8
+"""Measures the cost of ``HSMERunner.send()`` on a two-state loop chart::
+
+    $ python benchmarks/bench_send.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fsm.core import HSMERunner  # noqa: E402
+
+
+LOOP_CHART = [
+    {
+        'state': 'ping',
+        'is_initial': True,
+        'events': {
+            'next': 'pong',
+        },
+    },
+    {
+        'state': 'pong',
+        'events': {
+            'next': 'ping',
+        },
+    },
+]
+
+
+def bench(runner_cls, number, repeat):
+    hsme = runner_cls()
+    hsme.parse(LOOP_CHART)
+    hsme.start()
+    send = hsme.send
+
+    def run():
+        del hsme.model.history[:]
+        for _ in range(number):
+            send('next')
+
+    best = min(timeit.repeat(run, number=1, repeat=repeat))
+    print('{0}.send(): {1:.0f} ops/sec, {2:.2f} usec/op'.format(
+        runner_cls.__name__, number / best, best / number * 1e6
+    ))
+
+
+def main(number=100000, repeat=5):
+    bench(HSMERunner, number, repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# coding: utf-8
+"""Measures persist-after-transition throughput of ``HSMESQLiteStorage``
+with different batch sizes::
+
+    $ python benchmarks/bench_storage.py
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fsm.core import HSMERunner  # noqa: E402
+from fsm.storage import HSMESQLiteStorage  # noqa: E402
+
+from bench_send import LOOP_CHART  # noqa: E402
+
+
+def bench(database, batch_size, machines, transitions):
+    storage = HSMESQLiteStorage(database, batch_size=batch_size)
+    runners = []
+    for i in range(machines):
+        hsme = HSMERunner(history_limit=10)
+        hsme.parse(LOOP_CHART)
+        hsme.start()
+        runners.append(hsme)
+
+    started_at = time.time()
+    for _ in range(transitions):
+        for i, hsme in enumerate(runners):
+            hsme.send('next')
+            storage.save(i, hsme)
+    storage.close()
+    elapsed = time.time() - started_at
+
+    loaded_at = time.time()
+    storage = HSMESQLiteStorage(database)
+    storage.load_many(range(machines))
+    storage.close()
+    load_elapsed = time.time() - loaded_at
+
+    print(
+        'batch_size={0}: {1:.0f} saves/sec, '
+        'load_many {2:.0f} machines/sec'.format(
+            batch_size,
+            machines * transitions / elapsed,
+            machines / load_elapsed,
+        )
+    )
+
+
+def main(machines=1000, transitions=5):
+    directory = tempfile.mkdtemp()
+    try:
+        for batch_size in (1, 10, 100, 1000):
+            database = os.path.join(directory, '{0}.db'.format(batch_size))
+            bench(database, batch_size, machines, transitions)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+# coding: utf-8
+"""The benchmark suite, parsing, transitions, trigger chains and dump/load
+round-trips on synthetic charts of three shapes:
+
+* ``wide``, one hub state with an event to every other state and back;
+* ``deep``, a chain of states nested in a deep hierarchy of composite
+  states, every leaf inherits the events of all the levels;
+* ``triggered``, a chain of states with triggers, one event runs the whole
+  chain.
+
+``registry_hit`` parses an already registered raw chart through the
+registry, it only hashes the chart and must stay above ``parse``,
+``registry_hit_id`` passes the known chart id and skips the hashing too.
+
+Charts are generated deterministically, so the numbers of two runs are
+comparable. Every scenario reports the best of ``--repeat`` runs in ops/sec
+and the peak memory allocated per operation (measured in a separate run,
+``tracemalloc`` slows everything down). Full dumps are chart-sized, so
+they are repeated less than the transitions and the compact dumps::
+
+    $ python benchmarks/suite.py --compare benchmarks/baseline.json
+    $ python benchmarks/suite.py --size 10000 --save baseline.json
+    $ python benchmarks/suite.py --size 10000 --compare baseline.json
+
+``benchmarks/baseline.json`` is the committed baseline of the default
+``--size``, saved with ``--save``, refresh it in the same commit as the
+change that moves the numbers on purpose. Numbers depend on the machine,
+compare against a baseline saved on the same one.
+The comparison marks the scenarios slower than the baseline by more than
+``--threshold`` percent and exits with status 1 if there are any.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fsm.core import HSMERunner  # noqa: E402
+from fsm.parsers import HSMEDictsParser  # noqa: E402
+from fsm.registry import HSMEChartRegistry  # noqa: E402
+
+
+DEPTH = 20
+TRIGGER_CHAIN = 100
+
+
+def get_wide_chart(size):
+    hub_events = dict(('to_{0}'.format(i), 's{0}'.format(i))
+                      for i in range(1, size))
+    chart = [{
+        'state': 's0',
+        'is_initial': True,
+        'events': hub_events,
+    }]
+    for i in range(1, size):
+        chart.append({
+            'state': 's{0}'.format(i),
+            'events': {
+                'back': 's0',
+            },
+        })
+    return chart
+
+
+def get_deep_chart(size, depth=DEPTH):
+    chart = []
+    for level in range(depth):
+        composite = {
+            'state': 'c{0}'.format(level),
+            'initial': 'c{0}'.format(level + 1) if level + 1 < depth else 's0',
+            'events': {
+                'level_{0}'.format(level): 's0',
+            },
+        }
+        if level:
+            composite['parent'] = 'c{0}'.format(level - 1)
+        else:
+            composite['is_initial'] = True
+        chart.append(composite)
+    for i in range(size):
+        chart.append({
+            'state': 's{0}'.format(i),
+            'parent': 'c{0}'.format(depth - 1),
+            'events': {
+                'next': 's{0}'.format((i + 1) % size),
+            },
+        })
+    return chart
+
+
+def get_triggered_chart(size, chain=TRIGGER_CHAIN):
+    chart = []
+    for i in range(size):
+        state = {
+            'state': 's{0}'.format(i),
+            'is_initial': i == 0,
+            'events': {
+                'go': 's{0}'.format((i + 1) % size),
+            },
+        }
+        if (i + 1) % chain:
+            state['trigger'] = 'next'
+        chart.append(state)
+    return chart
+
+
+CHARTS = {
+    'wide': get_wide_chart,
+    'deep': get_deep_chart,
+    'triggered': get_triggered_chart,
+}
+
+# Events sent in the transition scenarios, cycled
+EVENTS = {
+    'wide': ['to_1', 'back', 'to_2', 'back'],
+    'deep': ['next', 'level_0', 'next', 'level_{0}'.format(DEPTH - 1)],
+    'triggered': ['go'],
+}
+
+
+def trigger_source(proxy, trigger_id):
+    return 'go'
+
+
+def get_runner(chart):
+    hsme = HSMERunner(
+        registry=HSMEChartRegistry(),
+        trigger_source=trigger_source,
+        history_limit=0,
+    )
+    hsme.load(chart)
+    hsme.start()
+    return hsme
+
+
+def scenario_parse(raw_chart, chart):
+    return lambda: HSMEDictsParser(raw_chart).parse(), 1
+
+
+def scenario_registry_hit(raw_chart, chart, known_id=False):
+    registry = HSMEChartRegistry()
+    registry.parse(HSMEDictsParser(raw_chart))
+    chart_id = chart.chart_id if known_id else None
+    return lambda: registry.parse(
+        HSMEDictsParser(raw_chart), chart_id=chart_id,
+    ), 1
+
+
+def scenario_send(raw_chart, chart, kind):
+    hsme = get_runner(chart)
+    events = EVENTS[kind]
+    send = hsme.send
+
+    def run():
+        for event_name in events:
+            send(event_name)
+
+    return run, len(events)
+
+
+def scenario_dump_load(raw_chart, chart, **dump_kwargs):
+    hsme = get_runner(chart)
+    registry = hsme.registry
+
+    def run():
+        HSMERunner(registry=registry).load(hsme.dump(**dump_kwargs))
+
+    return run, 1
+
+
+def scenario_full_load(raw_chart, chart):
+    dump = get_runner(chart).dump()
+
+    def run():
+        HSMERunner(registry=HSMEChartRegistry()).load(dump)
+
+    return run, 1
+
+
+def get_scenarios(kind):
+    scenarios = [
+        ('parse', scenario_parse, {}),
+        ('registry_hit', scenario_registry_hit, {}),
+        ('registry_hit_id', scenario_registry_hit, {'known_id': True}),
+        ('send', scenario_send, {'kind': kind}),
+        ('dump_load', scenario_dump_load, {}),
+        ('dump_load_compact', scenario_dump_load, {'compact': True}),
+        ('dump_load_binary', scenario_dump_load, {'binary': True}),
+        ('full_load', scenario_full_load, {}),
+    ]
+    return [
+        ('{0}.{1}'.format(kind, name), scenario, kwargs)
+        for name, scenario, kwargs in scenarios
+    ]
+
+
+def measure(run, ops, number, repeat):
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+
+    run()  # warm up lazy compilation and caches before measuring memory
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'ops_per_sec': number * ops / best,
+        'bytes_per_op': max(peak - start, 0) / float(ops),
+    }
+
+
+def get_number(name, size):
+    # Chart-sized operations (parsing, full dumps) are repeated less,
+    # to keep the run short
+    if name.endswith(('.send', '.registry_hit_id', '.dump_load_compact',
+                      '.dump_load_binary')):
+        return 2000
+    return max(1, 2000 // size)
+
+
+def run_suite(size, repeat, only=None):
+    results = {}
+    for kind in sorted(CHARTS):
+        raw_chart = CHARTS[kind](size)
+        chart = HSMEDictsParser(raw_chart).parse()
+        for name, scenario, kwargs in get_scenarios(kind):
+            if only and not any(i in name for i in only):
+                continue
+            run, ops = scenario(raw_chart, chart, **kwargs)
+            result = measure(run, ops, get_number(name, size), repeat)
+            results[name] = result
+            print('{0:<32} {1:>14.1f} ops/sec {2:>12.0f} bytes/op'.format(
+                name, result['ops_per_sec'], result['bytes_per_op'],
+            ))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the change against the baseline results.
+
+    :returns: list of the regressed scenario names.
+    """
+    regressions = []
+    print('\n{0:<32} {1:>14} {2:>14} {3:>9}'.format(
+        'scenario', 'baseline', 'current', 'change',
+    ))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['ops_per_sec']
+        after = results[name]['ops_per_sec']
+        change = (after - before) / before * 100
+        mark = ''
+        if change < -threshold:
+            regressions.append(name)
+            mark = ' REGRESSION'
+        print('{0:<32} {1:>14.1f} {2:>14.1f} {3:>+8.1f}%{4}'.format(
+            name, before, after, change, mark,
+        ))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--size', type=int, default=1000,
+                        help='number of states of every chart')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timing runs, the best one is taken')
+    parser.add_argument('--only', nargs='*',
+                        help='run the scenarios with these substrings only')
+    parser.add_argument('--save', metavar='PATH',
+                        help='save the results as the baseline file')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='compare the results with the baseline file')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='slowdown in percent reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.size, args.repeat, args.only)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump({
+                'python': platform.python_version(),
+                'size': args.size,
+                'results': results,
+            }, baseline_file, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['size'] != args.size:
+            print('Baseline of the size {0} can not be compared'.format(
+                baseline['size']
+            ))
+            return 2
+        if compare(results, baseline['results'], args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
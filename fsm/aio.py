@@ -0,0 +1,92 @@
+# coding: utf-8
+"""asyncio support, requires Python 3.5+."""
+import asyncio
+import inspect
+
+from fsm.core import HSMERunner
+
+
+async def _resolve(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+class AsyncHSMERunner(HSMERunner):
+    """``HSMERunner`` for asyncio applications. The :meth:`start` and
+    the :meth:`send` methods are coroutines and ``trigger_source`` and
+    ``action_source`` can be coroutine functions (plain callables are
+    supported as well)::
+
+        async def action_source(proxy, action_id):
+            await db.execute(...)
+
+        hsme = AsyncHSMERunner(action_source=action_source)
+        hsme.parse(RULES_CHART)
+        await hsme.start()
+        await hsme.send(True)
+
+    Transition semantics, errors, the chart model, dumps and the rest of
+    the API are the same as of ``HSMERunner``, so machines can be moved
+    between sync and async code with :meth:`dump` and :meth:`load`.
+    Events sent to the same machine concurrently are processed one by one,
+    each with its trigger chain, other machines are not blocked.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncHSMERunner, self).__init__(*args, **kwargs)
+        self._lock = None
+
+    def __getstate__(self):
+        state = super(AsyncHSMERunner, self).__getstate__()
+        state['_lock'] = None
+        return state
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def start(self, payload=None):
+        """See :meth:`HSMERunner.start`."""
+        async with self._get_lock():
+            if self.is_started():
+                return False
+
+            return await self._do_transition(self._get_start_proxy(payload))
+
+    async def send(self, event_name, payload=None):
+        """See :meth:`HSMERunner.send`."""
+        async with self._get_lock():
+            return await self._do_transition(
+                self._get_send_proxy(event_name, payload)
+            )
+
+    async def send_many(self, events, payload=None):
+        """See :meth:`HSMERunner.send_many`."""
+        async with self._get_lock():
+            transitions = self._iter_many(events, payload)
+            for hsme_proxy in transitions:
+                try:
+                    await self._do_transition(hsme_proxy)
+                except BaseException as error:
+                    transitions.throw(error)
+            return True
+
+    async def _do_transition(self, hsme_proxy):
+        if not hsme_proxy.dst:
+            return False
+
+        steps = self._iter_transition(hsme_proxy)
+        result = None
+        while True:
+            try:
+                kind, hsme_proxy, dst = steps.send(result)
+            except StopIteration:
+                return True
+            if kind == 'trigger':
+                result = await _resolve(
+                    self.trigger_source(hsme_proxy, dst.trigger)
+                )
+            elif kind == 'action':
+                await _resolve(self.action_source(hsme_proxy, dst.action))
@@ -0,0 +1,264 @@
+# coding: utf-8
+from collections import OrderedDict
+
+
+def _get_components(successors):
+    """Strongly connected components of the graph, Tarjan's algorithm
+    without recursion, so deep charts don't hit the recursion limit.
+    Components are returned in reverse topological order, every component
+    goes after all the components reachable from it.
+
+    :param successors: list of successor ids lists, indexed by node id.
+    :returns: list of lists of node ids.
+    """
+    size = len(successors)
+    indexes = [-1] * size
+    lowlinks = [0] * size
+    on_stack = [False] * size
+    stack = []
+    components = []
+    counter = 0
+
+    for root in range(size):
+        if indexes[root] != -1:
+            continue
+
+        work = [(root, 0)]
+        while work:
+            node, i = work[-1]
+            if i == 0:
+                indexes[node] = lowlinks[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+
+            edges = successors[node]
+            while i < len(edges):
+                succ = edges[i]
+                i += 1
+                if indexes[succ] == -1:
+                    work[-1] = (node, i)
+                    work.append((succ, 0))
+                    break
+                elif on_stack[succ]:
+                    lowlinks[node] = min(lowlinks[node], indexes[succ])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlinks[parent] = min(lowlinks[parent], lowlinks[node])
+                if lowlinks[node] == indexes[node]:
+                    component = []
+                    while True:
+                        succ = stack.pop()
+                        on_stack[succ] = False
+                        component.append(succ)
+                        if succ == node:
+                            break
+                    components.append(component)
+
+    return components
+
+
+class HSMEChartIndex(object):
+    """Graph analysis of ``HSMEStateChart``, compiled once per chart::
+
+        index = HSMEChartIndex.compile(chart)
+        index.can_finish('two')
+        index.can_reach('two', 'five')
+        index.trigger_loops
+        >> [('one', 'two')]
+
+    States are grouped into strongly connected components, ``components``
+    are tuples of state names in reverse topological order (a component
+    goes after all the components reachable from it), so the "can finish"
+    flags are computed in one pass over the components, and reachability
+    queries search the components DAG skipping every component ordered
+    before the destination one. The last ``REACH_MEMO_SIZE`` answers are
+    memoized.
+    Every branch of the guarded transitions counts as an edge, guards are
+    not evaluated.
+
+    ``trigger_loops`` are the cycles made of states with triggers only.
+    A trigger chain that gets into such a cycle can run forever, depending
+    on what the triggers return.
+
+    Composite states of hierarchical charts are not in the graph, the
+    machine is always in some leaf state. The queries resolve composite
+    names to their leaves (``composites``): a composite state is reached
+    if any of its leaves is, and finishes or reaches something if any of
+    its leaves does.
+
+    :param states: tuple of state names, ordered by id.
+    :param final_states: frozenset of final state names.
+    :param components: list of tuples of state names.
+    :param successors: list of successor component ids sets,
+        indexed by component id.
+    :param trigger_loops: list of tuples of state names.
+    :param composites: ``{'composite name': (leaf names)}`` mapping.
+    """
+
+    REACH_MEMO_SIZE = 1024
+
+    def __init__(
+        self,
+        states,
+        final_states,
+        components,
+        successors,
+        trigger_loops,
+        composites=None,
+    ):
+        self.states = states
+        self.final_states = final_states
+        self.components = components
+        self.successors = successors
+        self.trigger_loops = trigger_loops
+        self.composites = composites or {}
+        self.component_ids = dict(
+            (name, i)
+            for i, component in enumerate(components)
+            for name in component
+        )
+
+        finishing = []
+        for i, component in enumerate(components):
+            finishing.append(
+                any(name in final_states for name in component) or
+                any(finishing[j] for j in successors[i])
+            )
+        self.finishing = finishing
+        self._reach = OrderedDict()
+
+    def __repr__(self):
+        return 'HSMEChartIndex: {0} states, {1} components'.format(
+            len(self.states), len(self.components)
+        )
+
+    @classmethod
+    def compile(cls, chart):
+        """The ``HSMEChartIndex`` factory.
+
+        :param chart: ``HSMEStateChart`` instance.
+        :returns: ``HSMEChartIndex`` instance.
+        """
+        states = tuple(chart.states.values())
+        state_ids = dict((s.name, i) for i, s in enumerate(states))
+        successors = [set() for _ in states]
+        for states_map in chart.statechart.values():
+            for src, dst in states_map.items():
+                successors[state_ids[src.name]].add(state_ids[dst.name])
+        for src_id, src in enumerate(states):
+            for table in src.decisions.values():
+                successors[src_id].update(
+                    state_ids[dst] for dst in table.destinations
+                )
+        successors = [sorted(i) for i in successors]
+
+        components = _get_components(successors)
+        component_ids = [0] * len(states)
+        for i, component in enumerate(components):
+            for state_id in component:
+                component_ids[state_id] = i
+        component_successors = [set() for _ in components]
+        for state_id, state_successors in enumerate(successors):
+            src_id = component_ids[state_id]
+            for dst_id in state_successors:
+                if component_ids[dst_id] != src_id:
+                    component_successors[src_id].add(component_ids[dst_id])
+
+        triggered = [
+            [i for i in state_successors if states[i].trigger]
+            if states[state_id].trigger else []
+            for state_id, state_successors in enumerate(successors)
+        ]
+        trigger_loops = [
+            tuple(sorted((states[i].name for i in component), key=repr))
+            for component in _get_components(triggered)
+            if len(component) > 1 or component[0] in triggered[component[0]]
+        ]
+
+        composites = {}
+        for state in states:
+            for name in state.ancestors:
+                composites.setdefault(name, []).append(state.name)
+
+        return cls(
+            states=tuple(s.name for s in states),
+            final_states=frozenset(s.name for s in chart.final_states),
+            components=[
+                tuple(states[i].name for i in component)
+                for component in components
+            ],
+            successors=component_successors,
+            trigger_loops=trigger_loops,
+            composites=dict(
+                (name, tuple(leaves)) for name, leaves in composites.items()
+            ),
+        )
+
+    def get_component(self, state_name):
+        """The strongly connected component of the state, all the states
+        reachable from it and back.
+
+        :param state_name: state name.
+        :returns: tuple of state names.
+        """
+        return self.components[self.component_ids[state_name]]
+
+    def can_finish(self, state_name):
+        """Checks if some final state is reachable from the state.
+
+        :param state_name: state name.
+        :returns: True or False.
+        """
+        leaves = self.composites.get(state_name)
+        if leaves is not None:
+            return any(self.can_finish(i) for i in leaves)
+        return self.finishing[self.component_ids[state_name]]
+
+    def can_reach(self, src_name, dst_name):
+        """Checks if the state is reachable from the other one, every state
+        is reachable from itself.
+
+        :param src_name: source state name.
+        :param dst_name: destination state name.
+        :returns: True or False, False for unknown destination states.
+        """
+        leaves = self.composites.get(dst_name)
+        if leaves is not None:
+            return any(self.can_reach(src_name, i) for i in leaves)
+        leaves = self.composites.get(src_name)
+        if leaves is not None:
+            return any(self.can_reach(i, dst_name) for i in leaves)
+
+        dst_id = self.component_ids.get(dst_name)
+        if dst_id is None:
+            return False
+        src_id = self.component_ids[src_name]
+
+        key = (src_id, dst_id)
+        reachable = self._reach.pop(key, None)
+        if reachable is None:
+            reachable = self._search(src_id, dst_id)
+        self._reach[key] = reachable
+        while len(self._reach) > self.REACH_MEMO_SIZE:
+            self._reach.popitem(last=False)
+        return reachable
+
+    def _search(self, src_id, dst_id):
+        # Reachable components go first, the ones before dst_id are skipped
+        if src_id < dst_id:
+            return False
+        successors = self.successors
+        visited = set([src_id])
+        stack = [src_id]
+        while stack:
+            component_id = stack.pop()
+            if component_id == dst_id:
+                return True
+            for succ in successors[component_id]:
+                if succ >= dst_id and succ not in visited:
+                    visited.add(succ)
+                    stack.append(succ)
+        return False
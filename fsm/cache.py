@@ -0,0 +1,216 @@
+# coding: utf-8
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+try:
+    from time import monotonic as _monotonic
+except ImportError:  # Python 2
+    _monotonic = time.time
+
+
+HSMETriggerCacheInfo = namedtuple(
+    'HSMETriggerCacheInfo', [
+        'hits',
+        'misses',
+        'maxsize',
+        'currsize',
+    ]
+)
+
+
+def payload_key(proxy):
+    """The default cache key function, the payload itself. Unhashable
+    payloads (dicts, lists) are not cached.
+    """
+    return proxy.payload
+
+
+class HSMETriggerCache(object):
+    """Memoizes ``trigger_source`` decisions, for triggers that compute the
+    same event for the same trigger id and payload again and again (rules
+    engines, DB lookups, remote calls)::
+
+        cache = HSMETriggerCache(
+            maxsize=10000,
+            ttl=60,
+            key=lambda proxy: proxy.payload['customer_id'],
+        )
+        hsme = HSMERunner(trigger_source=trigger_source, trigger_cache=cache)
+
+    Decisions are keyed by ``(trigger id, key(proxy))``, the key function
+    gets the ``HSMEProxyObject`` of the transition and has to return some
+    hashable value, lookups with unhashable keys bypass the cache and are
+    counted as misses. The least recently used decisions are evicted when
+    ``maxsize`` is reached, decisions older than ``ttl`` seconds are not
+    used. Triggers with side effects or decisions depending on something
+    besides the key have to be :meth:`disable`-d. One cache can be shared by
+    any number of runners, it's thread-safe.
+
+    :param maxsize: max number of decisions to keep, ``None`` for no limit.
+    :param ttl: decision lifetime in seconds, ``None`` to keep forever.
+    :param key: the cache key function, ``payload_key`` by default.
+    :param disabled: iterable of trigger ids not to cache.
+    :param clock: a callable returning seconds, ``time.monotonic``
+        by default.
+    """
+
+    DEFAULT_MAXSIZE = 1024
+    MISSING = object()
+
+    def __init__(
+        self,
+        maxsize=DEFAULT_MAXSIZE,
+        ttl=None,
+        key=None,
+        disabled=None,
+        clock=None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key = key or payload_key
+        self.disabled = set(
+            self._get_trigger_key(i) for i in disabled or ()
+        )
+        self.clock = clock or _monotonic
+        self.hits = 0
+        self.misses = 0
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'HSMETriggerCache: {0} decisions'.format(len(self))
+
+    def __len__(self):
+        return len(self._decisions)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_trigger_key(trigger_id):
+        # Triggers can be declared as lists of trigger ids
+        if isinstance(trigger_id, list):
+            return tuple(trigger_id)
+        return trigger_id
+
+    def enable(self, trigger_id):
+        """Enables caching of the trigger decisions (all are enabled
+        by default).
+
+        :param trigger_id: trigger id.
+        """
+        self.disabled.discard(self._get_trigger_key(trigger_id))
+
+    def disable(self, trigger_id):
+        """Disables caching of the trigger decisions, cached ones are
+        dropped.
+
+        :param trigger_id: trigger id.
+        """
+        trigger_id = self._get_trigger_key(trigger_id)
+        self.disabled.add(trigger_id)
+        self.clear(trigger_id)
+
+    def lookup(self, proxy, trigger_id):
+        """Looks up the cached decision, counts hits and misses.
+
+        :param proxy: ``HSMEProxyObject`` of the transition.
+        :param trigger_id: trigger id.
+        :returns: ``(key, event)`` pair, the key is None if the trigger is
+            not cached, the event is ``MISSING`` if not found.
+        """
+        trigger_id = self._get_trigger_key(trigger_id)
+        if trigger_id in self.disabled:
+            return None, self.MISSING
+
+        key = (trigger_id, self.key(proxy))
+        try:
+            hash(key)
+        except TypeError:
+            with self._lock:
+                self.misses += 1
+            return None, self.MISSING
+
+        with self._lock:
+            decision = self._decisions.pop(key, None)
+            if decision is not None:
+                event, expires_at = decision
+                if expires_at is None or expires_at > self.clock():
+                    self._decisions[key] = decision
+                    self.hits += 1
+                    return key, event
+            self.misses += 1
+        return key, self.MISSING
+
+    def store(self, key, event):
+        """Caches the decision found by the :meth:`lookup`.
+
+        :param key: the key returned by the :meth:`lookup`, None to skip.
+        :param event: the trigger decision.
+        """
+        if key is None:
+            return
+
+        expires_at = self.clock() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._decisions.pop(key, None)
+            self._decisions[key] = (event, expires_at)
+            if self.maxsize is not None:
+                while len(self._decisions) > self.maxsize:
+                    self._decisions.popitem(last=False)
+
+    def call(self, trigger_source, proxy, trigger_id):
+        """Returns the cached decision or calls the ``trigger_source``
+        and caches its result.
+
+        :param trigger_source: the ``trigger_source`` callback.
+        :param proxy: ``HSMEProxyObject`` of the transition.
+        :param trigger_id: trigger id.
+        :returns: the trigger decision.
+        """
+        key, event = self.lookup(proxy, trigger_id)
+        if event is self.MISSING:
+            event = trigger_source(proxy, trigger_id)
+            self.store(key, event)
+        return event
+
+    def info(self):
+        """Cache statistics.
+
+        :returns: ``HSMETriggerCacheInfo(hits, misses, maxsize, currsize)``.
+        """
+        return HSMETriggerCacheInfo(
+            hits=self.hits,
+            misses=self.misses,
+            maxsize=self.maxsize,
+            currsize=len(self._decisions),
+        )
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+    def clear(self, trigger_id=None):
+        """Drops cached decisions, all or of one trigger only, and resets
+        the statistics if all are dropped.
+
+        :param trigger_id: trigger id, None for all.
+        """
+        with self._lock:
+            if trigger_id is None:
+                self._decisions.clear()
+                self.hits = 0
+                self.misses = 0
+                return
+
+            trigger_id = self._get_trigger_key(trigger_id)
+            for key in [k for k in self._decisions if k[0] == trigger_id]:
+                del self._decisions[key]
@@ -0,0 +1,478 @@
+# coding: utf-8
+"""Compact binary format of ``HSMEStateChart`` and ``HSMESession``.
+
+Every blob starts with the ``HSME`` magic, the format version and the kind
+(chart or session) bytes. Values are type-tagged, numbers are packed with
+``struct``, strings and containers are length-prefixed. Charts write every
+distinct name, event, trigger and action once, in the table of values,
+the states and the transitions are one packed array of indexes into that
+table and the table of states. The decoder reads straight from the bytes.
+"""
+import struct
+
+
+MAGIC = b'HSME'
+VERSION = 1
+
+KIND_CHART = 1
+KIND_SESSION = 2
+
+_HEADER = struct.Struct('<4sBB')
+_UINT = struct.Struct('<I')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+
+_INT_MIN = -2 ** 63
+_INT_MAX = 2 ** 63 - 1
+
+_FLAG_INITIAL = 1
+_FLAG_FINAL = 2
+
+# Tags as read from a bytearray, ints on both Python 2 and 3
+_TAG_NONE = ord('N')
+_TAG_TRUE = ord('T')
+_TAG_FALSE = ord('F')
+_TAG_INT = ord('i')
+_TAG_BIG_INT = ord('I')
+_TAG_FLOAT = ord('d')
+_TAG_TEXT = ord('s')
+_TAG_BYTES = ord('b')
+_TAG_LIST = ord('l')
+_TAG_TUPLE = ord('t')
+_TAG_DICT = ord('m')
+
+try:
+    _text_type = unicode
+except NameError:  # Python 3
+    _text_type = str
+
+
+class HSMECodecError(ValueError):
+    """Raised if the binary data is broken, has unknown version or kind."""
+
+
+class HSMEBinaryWriter(object):
+
+    def __init__(self, kind):
+        self.chunks = [_HEADER.pack(MAGIC, VERSION, kind)]
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+    def write_uint(self, value):
+        self.chunks.append(_UINT.pack(value))
+
+    def write_uints(self, values):
+        self.chunks.append(_UINT.pack(len(values)))
+        self.chunks.append(struct.pack('<{0}I'.format(len(values)), *values))
+
+    def write_value(self, value):
+        chunks = self.chunks
+        if value is None:
+            chunks.append(b'N')
+        elif value is True:
+            chunks.append(b'T')
+        elif value is False:
+            chunks.append(b'F')
+        elif isinstance(value, int) and _INT_MIN <= value <= _INT_MAX:
+            chunks.append(b'i')
+            chunks.append(_INT.pack(value))
+        elif isinstance(value, float):
+            chunks.append(b'd')
+            chunks.append(_FLOAT.pack(value))
+        elif isinstance(value, _text_type):
+            data = value.encode('utf8')
+            chunks.append(b's')
+            chunks.append(_UINT.pack(len(data)))
+            chunks.append(data)
+        elif isinstance(value, bytes):
+            chunks.append(b'b')
+            chunks.append(_UINT.pack(len(value)))
+            chunks.append(value)
+        elif isinstance(value, (list, tuple)):
+            chunks.append(b'l' if isinstance(value, list) else b't')
+            chunks.append(_UINT.pack(len(value)))
+            for item in value:
+                self.write_value(item)
+        elif isinstance(value, dict):
+            chunks.append(b'm')
+            chunks.append(_UINT.pack(len(value)))
+            for key, item in value.items():
+                self.write_value(key)
+                self.write_value(item)
+        elif isinstance(value, int):
+            data = str(value).encode('ascii')
+            chunks.append(b'I')
+            chunks.append(_UINT.pack(len(data)))
+            chunks.append(data)
+        else:
+            raise HSMECodecError(
+                'Unsupported value type {0}'.format(type(value))
+            )
+
+
+class HSMEBinaryReader(object):
+
+    def __init__(self, data, kind):
+        self.data = bytearray(data)
+        self.offset = _HEADER.size
+        try:
+            magic, version, data_kind = _HEADER.unpack_from(self.data, 0)
+        except struct.error:
+            raise HSMECodecError('Data is too short')
+        if magic != MAGIC:
+            raise HSMECodecError('Unknown data format')
+        if version != VERSION:
+            raise HSMECodecError('Unsupported version {0}'.format(version))
+        if data_kind != kind:
+            raise HSMECodecError('Unexpected data kind {0}'.format(data_kind))
+
+    def read_uint(self):
+        try:
+            value = _UINT.unpack_from(self.data, self.offset)[0]
+        except struct.error:
+            raise HSMECodecError('Data is too short')
+        self.offset += _UINT.size
+        return value
+
+    def read_uints(self):
+        size = self.read_uint()
+        packed = struct.Struct('<{0}I'.format(size))
+        try:
+            values = packed.unpack_from(self.data, self.offset)
+        except struct.error:
+            raise HSMECodecError('Data is too short')
+        self.offset += packed.size
+        return values
+
+    def _read_slice(self):
+        data = self.data
+        start = self.offset + _UINT.size
+        end = start + _UINT.unpack_from(data, self.offset)[0]
+        if end > len(data):
+            raise HSMECodecError('Data is too short')
+        self.offset = end
+        return data[start:end]
+
+    def read_value(self):
+        data = self.data
+        offset = self.offset
+        try:
+            tag = data[offset]
+            self.offset = offset = offset + 1
+            if tag == _TAG_TEXT:
+                return self._read_slice().decode('utf8')
+            if tag == _TAG_NONE:
+                return None
+            if tag == _TAG_INT:
+                self.offset = offset + _INT.size
+                return _INT.unpack_from(data, offset)[0]
+            if tag == _TAG_TRUE:
+                return True
+            if tag == _TAG_FALSE:
+                return False
+            if tag == _TAG_FLOAT:
+                self.offset = offset + _FLOAT.size
+                return _FLOAT.unpack_from(data, offset)[0]
+            if tag == _TAG_LIST:
+                read_value = self.read_value
+                return [read_value() for _ in range(self.read_uint())]
+            if tag == _TAG_TUPLE:
+                read_value = self.read_value
+                return tuple([read_value() for _ in range(self.read_uint())])
+            if tag == _TAG_DICT:
+                read_value = self.read_value
+                return dict(
+                    (read_value(), read_value())
+                    for _ in range(self.read_uint())
+                )
+            if tag == _TAG_BYTES:
+                return bytes(self._read_slice())
+            if tag == _TAG_BIG_INT:
+                return int(self._read_slice().decode('ascii'))
+        except (IndexError, struct.error):
+            raise HSMECodecError('Data is too short')
+        raise HSMECodecError('Unknown value tag {0!r}'.format(chr(tag)))
+
+
+class _HSMEValueTable(object):
+    # Scalars are written once, containers every time, ``True`` and ``1``
+    # are different values, the type is a part of the key.
+
+    def __init__(self):
+        self.values = []
+        self._indexes = {}
+
+    def add(self, value):
+        if isinstance(value, (list, tuple, dict)):
+            self.values.append(value)
+            return len(self.values) - 1
+        key = (value.__class__, value)
+        index = self._indexes.get(key)
+        if index is None:
+            index = self._indexes[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+
+def encode_chart(chart):
+    """``HSMEStateChart`` to bytes. The packed array has, for every
+    state, the name, trigger, action, flags and decisions indexes, the
+    ancestors count and indexes and the events count and the ``(event
+    index, destination state id)`` pairs. The initial state id and the
+    final state ids go after the states.
+
+    :param chart: ``HSMEStateChart`` instance.
+    :returns: bytes.
+    """
+    writer = HSMEBinaryWriter(KIND_CHART)
+    states = list(chart.states.values())
+    state_ids = dict((s.name, i) for i, s in enumerate(states))
+    table = _HSMEValueTable()
+    add = table.add
+
+    words = [len(states)]
+    for state in states:
+        words.append(add(state.name))
+        words.append(add(state.trigger))
+        words.append(add(state.action))
+        words.append(
+            (_FLAG_INITIAL if state.is_initial else 0) |
+            (_FLAG_FINAL if state.is_final else 0)
+        )
+        words.append(add(dict(
+            (e, decision_table.branches)
+            for e, decision_table in state.decisions.items()
+        ) if state.decisions else None))
+        words.append(len(state.ancestors))
+        words.extend(add(i) for i in state.ancestors)
+        words.append(len(state.events))
+        for event, dst in state.events.items():
+            words.append(add(event))
+            words.append(state_ids[dst])
+
+    words.append(state_ids[chart.initial_state.name])
+    words.append(len(chart.final_states))
+    words.extend(state_ids[i.name] for i in chart.final_states)
+
+    writer.write_value(chart.chart_id)
+    writer.write_value(table.values)
+    writer.write_uints(words)
+    return writer.getvalue()
+
+
+def decode_chart(data, chart_cls):
+    """Bytes produced by :func:`encode_chart` to ``HSMEStateChart``.
+
+    :param data: bytes or memoryview.
+    :param chart_cls: ``HSMEStateChart`` class.
+    :returns: ``chart_cls`` instance.
+    """
+    reader = HSMEBinaryReader(data, KIND_CHART)
+    state_cls = chart_cls.STATE_CLS
+    decision_table_cls = chart_cls.DECISION_TABLE_CLS
+
+    chart_id = reader.read_value()
+    values = reader.read_value()
+    words = reader.read_uints()
+
+    try:
+        raw_states = []
+        pos = 1
+        for _ in range(words[0]):
+            name, trigger, action, flags, decisions, size = (
+                words[pos:pos + 6]
+            )
+            pos += 6
+            ancestors = tuple([values[i] for i in words[pos:pos + size]])
+            pos += size
+            size = words[pos] * 2
+            pos += 1
+            raw_states.append((
+                values[name], values[trigger], values[action], flags,
+                values[decisions], ancestors, words[pos:pos + size],
+            ))
+            pos += size
+
+        names = [raw[0] for raw in raw_states]
+        states = []
+        for raw_state in raw_states:
+            name, trigger, action, flags, decisions, ancestors, events = (
+                raw_state
+            )
+            states.append(state_cls(
+                name=name,
+                events=dict(zip(
+                    [values[i] for i in events[0::2]],
+                    [names[i] for i in events[1::2]],
+                )),
+                trigger=trigger,
+                action=action,
+                is_initial=bool(flags & _FLAG_INITIAL),
+                is_final=bool(flags & _FLAG_FINAL),
+                ancestors=ancestors,
+                decisions=decisions and dict(
+                    (e, decision_table_cls(branches))
+                    for e, branches in decisions.items()
+                ),
+            ))
+
+        statechart = {}
+        for src, raw_state in zip(states, raw_states):
+            events = raw_state[-1]
+            for i in range(0, len(events), 2):
+                statechart.setdefault(values[events[i]], {})[src] = (
+                    states[events[i + 1]]
+                )
+
+        initial_state = states[words[pos]]
+        final_states = [
+            states[i] for i in words[pos + 2:pos + 2 + words[pos + 1]]
+        ]
+    except (IndexError, ValueError):
+        raise HSMECodecError('Broken chart data')
+
+    return chart_cls(
+        chart_id=chart_id,
+        initial_state=initial_state,
+        final_states=final_states,
+        statechart=statechart,
+        states=dict((s.name, s) for s in states),
+    )
+
+
+def _write_column(writer, values):
+    # Values are replaced with the indexes in the table of unique values,
+    # the type is a part of the key, so ``True`` and ``1`` are different.
+    table = {}
+    indexes = []
+    for value in values:
+        key = (value.__class__, value)
+        index = table.get(key)
+        if index is None:
+            index = table[key] = len(table)
+        indexes.append(index)
+
+    unique = [None] * len(table)
+    for (_, value), index in table.items():
+        unique[index] = value
+    writer.write_value(unique)
+    writer.chunks.append(struct.pack('<{0}I'.format(len(indexes)), *indexes))
+
+
+def _read_column(reader, size):
+    unique = reader.read_value()
+    packed = struct.Struct('<{0}I'.format(size))
+    indexes = packed.unpack_from(reader.data, reader.offset)
+    reader.offset += packed.size
+    return [unique[i] for i in indexes]
+
+
+def _write_timestamps(writer, values):
+    if all(v.__class__ is int for v in values):
+        if all(_INT_MIN <= v <= _INT_MAX for v in values):
+            writer.chunks.append(b'i')
+            writer.chunks.append(
+                struct.pack('<{0}q'.format(len(values)), *values)
+            )
+            return
+    elif all(v.__class__ is float for v in values):
+        writer.chunks.append(b'd')
+        writer.chunks.append(struct.pack('<{0}d'.format(len(values)), *values))
+        return
+
+    writer.chunks.append(b'l')
+    for value in values:
+        writer.write_value(value)
+
+
+def _read_timestamps(reader, size):
+    tag = reader.data[reader.offset]
+    reader.offset += 1
+    if tag == _TAG_LIST:
+        return [reader.read_value() for _ in range(size)]
+    if tag not in (_TAG_INT, _TAG_FLOAT):
+        raise HSMECodecError('Unknown value tag {0!r}'.format(chr(tag)))
+
+    packed = struct.Struct(
+        '<{0}{1}'.format(size, 'q' if tag == _TAG_INT else 'd')
+    )
+    values = packed.unpack_from(reader.data, reader.offset)
+    reader.offset += packed.size
+    return values
+
+
+def encode_session(session):
+    """``HSMESession`` runtime state to bytes, the chart is referenced
+    by id, like in the compact dump. The history is written column by
+    column, states and events as indexes in the tables of unique values,
+    timestamps as packed numbers.
+
+    :param session: ``HSMESession`` instance.
+    :returns: bytes.
+    """
+    writer = HSMEBinaryWriter(KIND_SESSION)
+    writer.write_value(session.chart_id)
+    writer.write_value(
+        session.current_state.name if session.current_state else None
+    )
+
+    history = session.history
+    writer.write_uint(len(history))
+    if history:
+        states, events, timestamps = zip(*history)
+        _write_column(writer, states)
+        _write_column(writer, events)
+        _write_timestamps(writer, timestamps)
+    return writer.getvalue()
+
+
+def decode_session(data, session_cls, chart):
+    """Bytes produced by :func:`encode_session` to ``HSMESession``.
+
+    :param data: bytes or memoryview.
+    :param session_cls: ``HSMESession`` class.
+    :param chart: ``HSMEStateChart`` instance the session refers to.
+    :returns: ``session_cls`` instance.
+    """
+    reader = HSMEBinaryReader(data, KIND_SESSION)
+    chart_id = reader.read_value()
+    if chart_id != chart.chart_id:
+        raise HSMECodecError(
+            'Session of the chart {0} expected'.format(chart.chart_id)
+        )
+
+    current_state = reader.read_value()
+    history = []
+    size = reader.read_uint()
+    if size:
+        try:
+            states = _read_column(reader, size)
+            events = _read_column(reader, size)
+            timestamps = _read_timestamps(reader, size)
+        except struct.error:
+            raise HSMECodecError('Data is too short')
+        history = list(map(
+            session_cls.HISTORY_RECORD_CLS._make,
+            zip(states, events, timestamps),
+        ))
+
+    return session_cls(
+        chart=chart,
+        current_state=(
+            chart.states[current_state]
+            if current_state is not None else None
+        ),
+        history=history,
+    )
+
+
+def get_chart_id(data):
+    """Reads the chart id of the encoded session (or chart) without
+    decoding the rest of the data.
+
+    :param data: bytes or memoryview.
+    :returns: chart id.
+    """
+    kind = _HEADER.unpack_from(data, 0)[2]
+    return HSMEBinaryReader(data, kind).read_value()
@@ -1,10 +1,17 @@
 # coding: utf-8
-import calendar
 import json
 import time
-from collections import namedtuple
-
-from fsm.parsers import HSMEStateChart, HSMEDictsParser
+from collections import deque, namedtuple
+
+from fsm import codec
+from fsm.parsers import (
+    HSMEDictsParser,
+    HSMEHistoryRecord,
+    HSMELazyStateChart,
+    HSMESession,
+    HSMEStateChart,
+)
+from fsm.registry import default_registry
 
 
 class HSMERunnerError(Exception):
@@ -25,6 +32,26 @@ class HSMEWrongTriggerError(HSMEWrongEventError):
     """
 
 
+class HSMETriggerChainError(HSMEWrongTriggerError):
+    """Raised if the chain of triggered transitions is longer than
+    ``max_trigger_steps`` or some trigger produces the same event
+    in the same state twice within the chain (the chain loops).
+    """
+
+
+def utc_timestamp():
+    """The default history clock, integer unix timestamp."""
+    return int(time.time())
+
+
+def _not_loaded(*args, **kwargs):
+    raise HSMERunnerError('Load machine first')
+
+
+def _not_started(*args, **kwargs):
+    raise HSMERunnerError('Start machine first')
+
+
 HSMEProxyObject = namedtuple(
     'HSMEProxyObject', [
         'fsm',
@@ -48,37 +75,114 @@ class HSMERunner(object):
     :param action_source: the callback, that produces some side effect
         inside related state. Something like logging, processing,
         DB reads/writes, etc.
+
+    :param registry: ``HSMEChartRegistry`` to keep parsed and loaded charts
+        in, the process-wide ``default_registry`` by default. Compact dumps
+        are resolved through it.
+
+    :param max_trigger_steps: max number of triggered transitions
+        after one event, ``MAX_TRIGGER_STEPS`` by default.
+
+    :param detect_trigger_cycles: raise ``HSMETriggerChainError`` as soon as
+        the chain of triggered transitions comes back to some state
+        with the same trigger result, True by default.
+
+    :param history_limit: transition history retention policy. ``None`` to
+        keep the full history (by default), ``0`` to keep no history at all
+        and any positive number to keep the last N records only.
+
+    :param clock: a callable producing history timestamps,
+        ``utc_timestamp`` by default. Any cheaper or more precise clock,
+        like ``time.monotonic``, can be used instead.
+
+    :param reject_trigger_loops: refuse to load charts with cycles made of
+        triggered states (see ``HSMEChartIndex.trigger_loops``), such
+        charts can run forever, False by default.
+
+    :param trigger_cache: ``HSMETriggerCache`` to memoize the
+        ``trigger_source`` decisions in, no caching by default.
+
+    :param guard_source: the callback checking the guards of the guarded
+        transitions (see ``HSMEDecisionTable``), gets the proxy object with
+        no destination and the guard id, returns True or False. Guarded
+        transitions are not available without it.
+
+    :param cache_guards: check every guard once per :meth:`send` (including
+        the triggered transitions after it), the result is reused by the
+        other decision tables, False by default.
+
+    :param metrics: ``HSMEMetrics`` to record the transition latencies and
+        the rejected events in, no instrumentation by default.
+
+    :param listeners: ``HSMEListeners`` to notify on every transition,
+        no listeners by default.
+
+    Runners can be pickled, the session is pickled in the binary format
+    (see ``fsm.codec``), ``trigger_source``, ``action_source`` and ``clock``
+    have to be picklable. The unpickled runner uses the ``default_registry``.
     """
 
     STATE_CHART_CLS = HSMEStateChart
+    LAZY_STATE_CHART_CLS = HSMELazyStateChart
+    SESSION_CLS = HSMESession
+
+    MAX_TRIGGER_STEPS = 1000
+
+    LOAD_REQUIRED = (
+        'dump',
+        'start',
+    )
+    HOOKS = (
+        ('metrics', '_iter_transition', '_iter_measured_transition'),
+        ('metrics', '_get_send_proxy', '_get_measured_send_proxy'),
+        ('listeners', '_enter', '_enter_listened'),
+    )
+    START_REQUIRED = (
+        'can_finish',
+        'can_reach',
+        'can_send',
+        'get_possible_transitions',
+        'in_state',
+        'is_finished',
+        'send',
+        'send_many',
+    )
 
     def __init__(
         self,
         trigger_source=None,
         action_source=None,
+        registry=None,
+        max_trigger_steps=None,
+        detect_trigger_cycles=True,
+        history_limit=None,
+        clock=None,
+        reject_trigger_loops=False,
+        trigger_cache=None,
+        guard_source=None,
+        cache_guards=False,
+        metrics=None,
+        listeners=None,
     ):
         self.model = None
         self.trigger_source = trigger_source
         self.action_source = action_source
-
-    def __getattribute__(self, name):
-        if name in set([
-            'dump',
-            'get_possible_transitions',
-            'history',
-            'send',
-            'start',
-        ]) and not self.is_loaded():
-            raise HSMERunnerError('Load machine first')
-
-        if name in set([
-            'can_send',
-            'in_state',
-            'is_finished',
-        ]) and not self.is_started():
-            raise HSMERunnerError('Start machine first')
-
-        return object.__getattribute__(self, name)
+        self.registry = (
+            registry if registry is not None else default_registry
+        )
+        self.max_trigger_steps = max_trigger_steps or self.MAX_TRIGGER_STEPS
+        self.detect_trigger_cycles = detect_trigger_cycles
+        self.history_limit = history_limit
+        self.clock = clock or utc_timestamp
+        self.reject_trigger_loops = reject_trigger_loops
+        self.trigger_cache = trigger_cache
+        self.guard_source = guard_source
+        self.cache_guards = cache_guards
+        self._guard_results = {}
+        self._metrics = metrics
+        self._listeners = listeners
+        self._switch_hooks()
+        self._switch_lifecycle(loaded=False, started=False)
 
     def __repr__(self):
         if self.is_loaded():
@@ -86,7 +190,34 @@ class HSMERunner(object):
         else:
             return 'HSMERunner: empty'
 
-    def load(self, model=None, deserializer=None):
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        for name in self.LOAD_REQUIRED + self.START_REQUIRED:
+            state.pop(name, None)
+        for _, name, _ in self.HOOKS:
+            state.pop(name, None)
+        state.pop('registry', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.registry = default_registry
+        model = self.model
+        if model is not None:
+            chart = self.registry.resolve(model.chart)
+            if chart is not model.chart:
+                model.chart = chart
+                if model.current_state is not None:
+                    model.current_state = chart.states[
+                        model.current_state.name
+                    ]
+        self._switch_hooks()
+        self._switch_lifecycle(
+            loaded=self.model is not None,
+            started=self.current_state is not None,
+        )
+
+    def load(self, model=None, deserializer=None, deltas=None):
         """Can be used to *load* some serialized FSM model object,
         to continue machine executing::
 
@@ -97,28 +228,111 @@ class HSMERunner(object):
             hsme_2 = HSMERunner()
             hsme_2.load(serialized_hsme)
 
-        :param model: serialized FSM model object.
+        A compiled ``HSMEStateChart`` can be loaded directly, that's cheap,
+        the chart is shared and only a fresh ``HSMESession`` is created::
+
+            chart = HSMEDictsParser(RULES_CHART).parse()
+            orders = [HSMERunner().load(chart) for _ in range(1000)]
+
+        Charts of full dumps are materialized lazily (see
+        ``HSMELazyStateChart``), states are created on the first use.
+
+        Compact dumps (see :meth:`dump`) have no transition map inside,
+        the chart is taken from the ``registry`` by its id, so it has to be
+        parsed or loaded in the current process before.
+
+        Binary dumps (see :meth:`dump`) are recognized by the header and
+        resolved through the ``registry``, like the compact ones.
+
+        Delta dumps are applied on top of the base dump, in order::
+
+            hsme_2.load(base_dump, deltas=[delta_1, delta_2])
+
+        :param model: serialized FSM model object, ``HSMEStateChart``
+            or ``HSMESession`` instance.
         :param deserializer: some callable, ``json.loads`` replacement.
+        :param deltas: a sequence of serialized delta dumps.
         :returns: HSMERunner instance with *loaded* FSM model.
         """
         self.model = None
-
-        if not isinstance(model, self.STATE_CHART_CLS):
+        self._switch_lifecycle(loaded=False, started=False)
+
+        if isinstance(model, self.STATE_CHART_CLS):
+            self.registry.add(model)
+            model = self.SESSION_CLS(model)
+        elif (
+            isinstance(model, (bytes, bytearray, memoryview)) and
+            bytes(model[:len(codec.MAGIC)]) == codec.MAGIC
+        ):
+            chart_id = codec.get_chart_id(model)
+            chart = self.registry.get(chart_id)
+            if chart is None:
+                raise HSMERunnerError(
+                    'Unknown chart {0}, parse or load '
+                    'the full model first'.format(chart_id)
+                )
+            model = self.SESSION_CLS.from_bytes(model, chart)
+        elif not isinstance(model, self.SESSION_CLS):
             deserializer = deserializer or json.loads
             model = deserializer(model)
-            model = self.STATE_CHART_CLS.as_obj(model)
+            if not isinstance(model, dict) or 'chart_id' not in model:
+                raise HSMERunnerError(
+                    'Invalid statechart format, chart_id expected'
+                )
+            if model.get('delta'):
+                raise HSMERunnerError(
+                    'Delta dump can be loaded on top of the base dump only'
+                )
+            chart = self.registry.get(model['chart_id'])
+            if chart is None:
+                if 'statechart' not in model:
+                    raise HSMERunnerError(
+                        'Unknown chart {0}, parse or load '
+                        'the full model first'.format(model['chart_id'])
+                    )
+                chart = self.registry.add(
+                    self.LAZY_STATE_CHART_CLS.as_obj(model)
+                )
+            model = self.SESSION_CLS.as_obj(model, chart=chart)
 
-        if not isinstance(model, self.STATE_CHART_CLS):
+        if not isinstance(model, self.SESSION_CLS):
             raise HSMERunnerError(
                 'Invalid statechart format, '
-                'HSMEStateChart instance expected'
+                'HSMESession instance expected'
             )
 
+        if self.reject_trigger_loops and model.chart.index.trigger_loops:
+            raise HSMERunnerError(
+                'Chart {0} has trigger loops: {1}'.format(
+                    model.chart_id,
+                    ', '.join(
+                        repr(loop) for loop in model.chart.index.trigger_loops
+                    ),
+                )
+            )
+
+        if self.history_limit:
+            model.history = deque(model.history, maxlen=self.history_limit)
+
+        for delta in deltas or ():
+            delta = (deserializer or json.loads)(delta)
+            if delta.get('chart_id') != model.chart_id:
+                raise HSMERunnerError(
+                    'Delta dump of the chart {0} expected'.format(
+                        model.chart_id
+                    )
+                )
+            model.apply_delta(delta)
+
         self.model = model
+        self._switch_lifecycle(
+            loaded=True,
+            started=model.current_state is not None,
+        )
 
         return self
 
-    def dump(self, serializer=None):
+    def dump(self, serializer=None, compact=False, delta=False, binary=False):
         """Can be used to *dump* (serialize, pickle, up to you) some loaded
         FSM model to take and reload it in the future::
 
@@ -129,13 +343,52 @@ class HSMERunner(object):
             hsme_2 = HSMERunner()
             hsme_2.load(serialized_hsme)
 
+        The ``compact`` mode writes only the chart id, the current state name
+        and the history, the transition map itself stays in the ``registry``.
+        Much smaller, but can be loaded only where the same chart is known::
+
+            serialized_hsme = hsme.dump(compact=True)
+            hsme_2 = HSMERunner()
+            hsme_2.parse(RULES_CHART)
+            hsme_2.load(serialized_hsme)
+
+        The ``delta`` mode is the compact one, but writes only the history
+        records appended since the previous dump, so the cost doesn't grow
+        with the history. Load it on top of the previous dumps::
+
+            base_dump = hsme.dump(compact=True)
+            hsme.send(True)
+            delta_dump = hsme.dump(delta=True)
+
+            hsme_2.load(base_dump, deltas=[delta_dump])
+
+        The ``binary`` mode is the compact one encoded with ``fsm.codec``
+        instead of the ``serializer``, the smallest and the fastest to load.
+
         :param serializer: some callable, ``json.dumps`` replacement.
+        :param compact: dump the runtime state only, False by default.
+        :param delta: dump the runtime state changes since the previous
+            dump only, False by default.
+        :param binary: dump the runtime state as bytes, False by default.
         :returns: JSON string (by default).
         """
         serializer = serializer or json.dumps
-        return serializer(self.model.as_dict())
+        model = self.model
+        if binary:
+            serializer = bytes
+            raw_dict = model.as_bytes()
+        elif delta:
+            raw_dict = model.as_delta_dict()
+        elif compact:
+            raw_dict = model.as_compact_dict()
+        else:
+            raw_dict = model.as_dict()
 
-    def parse(self, chart, parser=None):
+        dumped = serializer(raw_dict)
+        model.watermark = model.history[-1] if model.history else None
+        return dumped
+
+    def parse(self, chart, parser=None, chart_id=None):
         """FSM transition map initial processing and loading::
 
             RULES_CHART = [
@@ -161,16 +414,20 @@ class HSMERunner(object):
         Internal transition map representation is more verbose but more
         efficient in relationship lookups ``O(1)``, so parsing is important
         and is the first step if you create new machine from transition map
-        declaration.
+        declaration. Compiled charts are cached in the ``registry`` by the
+        parser class and the content hash, so the same chart is parsed once
+        per process. Pass the known ``chart_id`` to skip the hashing too.
 
         :param chart: transition map object, states and events definition.
         :param parser: ``HSMEDictsParser``, by default. If custom, the class
             has to implement the :meth:`parse()` method and produce proper
             internal structure, the same as in original ``HSMEDictsParser``.
+        :param chart_id: the chart id, if known (``chart_id`` of a chart
+            parsed before), the chart is not hashed then.
         :returns: HSMERunner instance with *loaded* FSM model.
         """
         parser = parser or HSMEDictsParser
-        model = parser(chart).parse()
+        model = self.registry.parse(parser(chart), chart_id=chart_id)
         return self.load(model)
 
     def is_loaded(self):
@@ -207,16 +464,7 @@ class HSMERunner(object):
         if self.is_started():
             return False
 
-        src = self.model.current_state
-        dst = self.model.initial_state
-        hsme_proxy = HSMEProxyObject(
-            fsm=self,
-            event=None,
-            src=src,
-            dst=dst,
-            payload=payload,
-        )
-        return self._do_transition(hsme_proxy)
+        return self._do_transition(self._get_start_proxy(payload))
 
     def send(self, event_name, payload=None):
         """The most important part of the Runner API. Several conditions have to
@@ -257,42 +505,51 @@ class HSMERunner(object):
         :param payload: any data, can be used inside triggers and actions
         :returns: True if transition was completed successfully
         """
-        src = self.current_state
-        if event_name not in self.model.statechart:
-            raise HSMEWrongEventError(
-                'Event {0} is unregistered'.format(
-                    repr(event_name)
-                )
-            )
-        if not self.can_send(event_name):
-            raise HSMEWrongEventError(
-                'Event {0} is inappropriate for the current state {1}'.format(
-                    repr(event_name), src.name
-                )
-            )
-        event_transition = self.model.statechart[event_name]
-        dst = src in event_transition and event_transition[src]
-        hsme_proxy = HSMEProxyObject(
-            fsm=self,
-            event=event_name,
-            payload=payload,
-            src=src,
-            dst=dst,
-        )
-        return self._do_transition(hsme_proxy)
+        return self._do_transition(self._get_send_proxy(event_name, payload))
 
-    def can_send(self, event_name):
+    def send_many(self, events, payload=None):
+        """Sends a known sequence of events, all or nothing::
+
+            hsme.in_state('one') == True
+            hsme.send_many([True, False])
+            hsme.in_state('five') == True
+
+        The whole sequence is checked against the transition map before the
+        first transition, as far as it's predictable (up to the first state
+        with a trigger). Then events are applied in one loop. If any event
+        or trigger fails (or the batch is interrupted), the current state
+        and the history are restored and the error is raised. Side effects
+        of the actions already called can't be rolled back, sure.
+
+        :param events: a sequence of events.
+        :param payload: any data, can be used inside triggers and actions.
+        :returns: True if all transitions were completed successfully.
+        """
+        transitions = self._iter_many(events, payload)
+        for hsme_proxy in transitions:
+            try:
+                self._do_transition(hsme_proxy)
+            except BaseException as error:
+                transitions.throw(error)
+        return True
+
+    def can_send(self, event_name, payload=None):
         """Checks if you can apply some event for the current state.
+        Guards of the guarded transitions are checked with the payload.
 
         :param event_name: some event name.
+        :param payload: any data, can be used inside guards.
         :returns: True if you can.
         """
-        if event_name not in self.model.statechart:
-            return False
-
-        event_transition = self.model.statechart[event_name]
-
-        return self.current_state in event_transition
+        src = self.model.current_state
+        if self._get_transition(src, event_name) is not None:
+            return True
+        if self.cache_guards:
+            self._guard_results = {}
+        return (
+            self._get_guarded_transition(src, event_name, payload)
+            is not None
+        )
 
     def get_possible_transitions(self):
         """Useful if you have started FSM model in some state and have no idea
@@ -311,12 +568,14 @@ class HSMERunner(object):
 
     def in_state(self, state_name):
         """Just an alias for the direct comparison. Checks if your current
-        state is exactly that state.
+        state is exactly that state or, in hierarchical charts, one of its
+        parent states.
 
         :param state_name: state name/id.
         :returns: True or False.
         """
-        return self.current_state.name == state_name
+        state = self.current_state
+        return state.name == state_name or state_name in state.ancestors
 
     def is_finished(self):
         """If some state has no events mapping, machine can't go somewhere from
@@ -324,15 +583,55 @@ class HSMERunner(object):
 
         :returns: True or False.
         """
-        return (
-            bool(self.model.final_states) and
-            self.current_state in self.model.final_states
+        return self.model.current_state.is_final
+
+    def can_finish(self):
+        """Checks if some final state is still reachable from the current
+        state, see ``HSMEChartIndex``.
+
+        :returns: True or False.
+        """
+        return self.model.chart.index.can_finish(self.model.current_state.name)
+
+    def can_reach(self, state_name):
+        """Checks if the state is reachable from the current state by any
+        sequence of events, see ``HSMEChartIndex``.
+
+        :param state_name: state name/id.
+        :returns: True or False.
+        """
+        return self.model.chart.index.can_reach(
+            self.model.current_state.name, state_name
         )
 
     @property
     def current_state(self):
         return self.model.current_state if self.model else None
 
+    @property
+    def metrics(self):
+        """``HSMEMetrics`` of the Runner, can be replaced or set to None
+        at any time, the hooks are switched accordingly.
+        """
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+        self._switch_hooks()
+
+    @property
+    def listeners(self):
+        """``HSMEListeners`` of the Runner, can be replaced or set to None
+        at any time, the hooks are switched accordingly.
+        """
+        return self._listeners
+
+    @listeners.setter
+    def listeners(self, listeners):
+        self._listeners = listeners
+        self._switch_hooks()
+
     @property
     def history(self):
         """Really helpful feature for debugging and testing. Draws transitions
@@ -345,7 +644,7 @@ class HSMERunner(object):
             hsme.send(False)  # go to state "five"
 
             print(hsme.history)
-            >> HSMEStateChart: db5e920ca6b236bd58ba369fbf0a320e =>
+            >> HSMESession: 7a47648977213d162770d1a6c1488de7 =>
                (one:None @1489430643) ->
                (two:True @1489430643) ->
                (five:False @1489430643)
@@ -353,42 +652,394 @@ class HSMERunner(object):
         You can see the ``(state:event @unixtimestamp)`` groups
         and actual transition flow, from left to right.
         """
-        if self.model and self.model.history:
-            chain = ' -> '.join(
-                '({0}:{1} @{2})'.format(h['state'], h['event'], h['timestamp'])
-                for h in self.model.history
+        if self.model is None:
+            raise HSMERunnerError('Load machine first')
+
+        if not self.is_started():
+            return '{0} => not started'.format(repr(self.model))
+        if not self.model.history:
+            return '{0} => ({1}, no history)'.format(
+                repr(self.model), self.model.current_state.name
             )
-            return '{0} => {1}'.format(repr(self.model), chain)
+        chain = ' -> '.join(
+            '({0}:{1} @{2})'.format(h.state, h.event, h.timestamp)
+            for h in self.model.history
+        )
+        return '{0} => {1}'.format(repr(self.model), chain)
+
+    def _get_transition(self, src, event_name):
+        """Transition lookup, the only place the Runner reads the
+        transition map from.
+
+        :returns: destination ``HSMEState`` or None.
+        """
+        event_transition = self.model.chart.statechart.get(event_name)
+        if event_transition is None:
+            return None
+        return event_transition.get(src)
+
+    def _get_guarded_transition(self, src, event_name, payload):
+        """Guarded transitions lookup, the decision table of the event is
+        evaluated with the ``guard_source``. Called only if the transition
+        map has no plain transition, so plain events cost nothing more.
+
+        :returns: destination ``HSMEState`` or None.
+        """
+        table = src.decisions.get(event_name)
+        if table is None or self.guard_source is None:
+            return None
+
+        guard_source = self.guard_source
+        hsme_proxy = HSMEProxyObject(
+            fsm=self,
+            event=event_name,
+            payload=payload,
+            src=src,
+            dst=None,
+        )
+        if self.cache_guards:
+            results = self._guard_results
+
+            def check(guard_id):
+                result = results.get(guard_id)
+                if result is None:
+                    result = results[guard_id] = bool(
+                        guard_source(hsme_proxy, guard_id)
+                    )
+                return result
         else:
-            return '{0} => not started'.format(repr(self.model))
+            def check(guard_id):
+                return guard_source(hsme_proxy, guard_id)
+
+        dst_name = table.evaluate(check)
+        if dst_name is None:
+            return None
+        return self.model.chart.states[dst_name]
+
+    def _switch_lifecycle(self, loaded, started):
+        """Methods unavailable at the current lifecycle stage are shadowed
+        by the instance attributes raising ``HSMERunnerError``. Available ones
+        are plain class methods, so there are no checks on the hot path.
+        """
+        attrs = self.__dict__
+        for name in self.LOAD_REQUIRED + self.START_REQUIRED:
+            attrs.pop(name, None)
+
+        if not loaded:
+            for name in self.LOAD_REQUIRED + self.START_REQUIRED:
+                attrs[name] = _not_loaded
+        elif not started:
+            for name in self.START_REQUIRED:
+                attrs[name] = _not_started
+
+    def _switch_hooks(self):
+        """Runners with ``metrics`` or ``listeners`` use the hooked versions
+        of the ``HOOKS`` methods, shadowing the plain ones by the instance
+        attributes, so runners without them don't pay for it.
+        """
+        attrs = self.__dict__
+        for _, name, _ in self.HOOKS:
+            attrs.pop(name, None)
+        for option, name, hooked_name in self.HOOKS:
+            if getattr(self, option, None) is not None:
+                attrs[name] = getattr(self, hooked_name)
+
+    def _get_start_proxy(self, payload):
+        if self.cache_guards:
+            self._guard_results = {}
+        hsme_proxy = HSMEProxyObject(
+            fsm=self,
+            event=None,
+            src=self.model.current_state,
+            dst=self.model.chart.initial_state,
+            payload=payload,
+        )
+        self._switch_lifecycle(loaded=True, started=True)
+        return hsme_proxy
 
-    def _do_transition(self, hsme_proxy):
-        dst = hsme_proxy.dst
-        if not dst:
-            return False
+    def _get_send_proxy(self, event_name, payload):
+        if self.cache_guards:
+            self._guard_results = {}
+        src = self.model.current_state
+        dst = self._get_transition(src, event_name)
+        if dst is None:
+            dst = self._get_guarded_transition(src, event_name, payload)
+        if dst is None:
+            if (
+                event_name not in self.model.chart.statechart and
+                event_name not in src.decisions
+            ):
+                raise HSMEWrongEventError(
+                    'Event {0} is unregistered'.format(
+                        repr(event_name)
+                    )
+                )
+            raise HSMEWrongEventError(
+                'Event {0} is inappropriate for the current state {1}'.format(
+                    repr(event_name), src.name
+                )
+            )
+        return HSMEProxyObject(
+            fsm=self,
+            event=event_name,
+            payload=payload,
+            src=src,
+            dst=dst,
+        )
 
-        self.model.current_state = dst
+    def _plan_transitions(self, events):
+        """Destination states of the events sequence, None for the events
+        after the first state with a trigger or the first guarded
+        transition, these are not predictable.
+
+        :raises: ``HSMEWrongEventError`` if some event is inappropriate.
+        """
+        if self.cache_guards:
+            self._guard_results = {}
+        planned = []
+        state = self.model.current_state
+        for i, event_name in enumerate(events):
+            if state is None:
+                planned.append(None)
+                continue
+            dst = self._get_transition(state, event_name)
+            if dst is None and event_name in state.decisions:
+                planned.append(None)
+                state = None
+                continue
+            if dst is None:
+                if self.metrics is not None:
+                    self.metrics.reject('event', event_name)
+                raise HSMEWrongEventError(
+                    'Event {0} (#{1}) is inappropriate for '
+                    'the state {2}'.format(repr(event_name), i, state.name)
+                )
+            planned.append(dst)
+            if dst.trigger and self.trigger_source:
+                state = None
+            else:
+                state = dst
+        return planned
+
+    def _get_trigger_proxy(self, hsme_proxy, trigger_event, steps, visited):
+        """Validates the event produced by the trigger of the current state,
+        ``steps`` is the number of triggered transitions in the chain so far
+        and ``visited`` is the set of ``(state, event)`` pairs seen in it.
+        """
+        src = hsme_proxy.dst
+        dst = self._get_transition(src, trigger_event)
+        if dst is None:
+            dst = self._get_guarded_transition(
+                src, trigger_event, hsme_proxy.payload,
+            )
+        if dst is None:
+            raise HSMEWrongTriggerError(
+                'Event {0} is inappropriate for '
+                'the current state {1}'.format(
+                    repr(trigger_event),
+                    repr(src),
+                )
+            )
+
+        if steps > self.max_trigger_steps:
+            raise HSMETriggerChainError(
+                'Triggered transitions limit {0} exceeded '
+                'in the state {1}'.format(
+                    self.max_trigger_steps,
+                    repr(src),
+                )
+            )
 
-        self.model.history.append({
-            'state': dst.name,
-            'event': hsme_proxy.event,
-            'timestamp': calendar.timegm(time.gmtime()),
-        })
-
-        if dst.action and self.action_source:
-            self.action_source(hsme_proxy, dst.action)
-
-        if dst.trigger and self.trigger_source:
-            trigger_event = self.trigger_source(hsme_proxy, dst.trigger)
-            if not self.can_send(trigger_event):
-                raise HSMEWrongTriggerError(
-                    'Event {0} is inappropriate for '
-                    'the current state {1}'.format(
+        if self.detect_trigger_cycles:
+            step = (src.name, trigger_event)
+            if step in visited:
+                raise HSMETriggerChainError(
+                    'Triggered transitions loop, event {0} repeated '
+                    'in the state {1}'.format(
                         repr(trigger_event),
-                        repr(self.model.current_state),
+                        repr(src),
                     )
                 )
+            visited.add(step)
 
-            return self.send(trigger_event, hsme_proxy.payload)
+        return HSMEProxyObject(
+            fsm=self,
+            event=trigger_event,
+            payload=hsme_proxy.payload,
+            src=src,
+            dst=dst,
+        )
 
-        return True
+    def _enter(self, hsme_proxy):
+        dst = hsme_proxy.dst
+        self.model.current_state = dst
+        if self.history_limit != 0:
+            self.model.history.append(HSMEHistoryRecord(
+                dst.name, hsme_proxy.event, self.clock(),
+            ))
+        return dst
+
+    def _enter_listened(self, hsme_proxy):
+        src = hsme_proxy.src
+        dst = hsme_proxy.dst
+        before, after = self.listeners.get_dispatch(
+            src.name if src is not None else None,
+            hsme_proxy.event,
+            dst.name,
+            src.ancestors if src is not None else (),
+            dst.ancestors,
+        )
+        for callback in before:
+            callback(hsme_proxy)
+        dst = type(self)._enter(self, hsme_proxy)
+        for callback in after:
+            callback(hsme_proxy)
+        return dst
+
+    def _iter_many(self, events, payload):
+        """Proxy objects of the :meth:`send_many` transitions, one by one.
+        Errors of the transitions are thrown in, the current state and
+        the history are restored then, the same if the generator is closed
+        before the end.
+        """
+        events = list(events)
+        planned = self._plan_transitions(events)
+
+        model = self.model
+        current_state = model.current_state
+        history = model.history
+        # Records are appended to the history as usual, so actions see the
+        # full one, the bounded history (a deque) may drop the old records
+        if isinstance(history, list):
+            saved_history = len(history)
+        else:
+            saved_history = list(history)
+        completed = False
+        try:
+            for event_name, dst in zip(events, planned):
+                if dst is None:
+                    yield self._get_send_proxy(event_name, payload)
+                else:
+                    yield HSMEProxyObject(
+                        fsm=self,
+                        event=event_name,
+                        payload=payload,
+                        src=model.current_state,
+                        dst=dst,
+                    )
+            completed = True
+        finally:
+            if not completed:
+                model.current_state = current_state
+                if isinstance(saved_history, list):
+                    history.clear()
+                    history.extend(saved_history)
+                else:
+                    del history[saved_history:]
+
+    def _iter_transition(self, hsme_proxy):
+        """Makes the transition and then follows the triggers, in a loop,
+        until some state without trigger is reached. The actions and the
+        triggers are not called here, ``(kind, hsme_proxy, dst)`` steps are
+        yielded to the caller instead, so the sync and async Runners share
+        the loop. The kind is ``'action'``, ``'trigger'`` (the trigger
+        result is sent back) or ``'cached'``, for the trigger decisions
+        taken from the ``trigger_cache``, nothing to call.
+        """
+        trigger_cache = self.trigger_cache
+        steps = 0
+        visited = None
+        while True:
+            dst = self._enter(hsme_proxy)
+
+            if dst.action and self.action_source:
+                yield 'action', hsme_proxy, dst
+
+            if not (dst.trigger and self.trigger_source):
+                return
+
+            if trigger_cache is None:
+                trigger_event = yield 'trigger', hsme_proxy, dst
+            else:
+                key, trigger_event = trigger_cache.lookup(
+                    hsme_proxy, dst.trigger,
+                )
+                if trigger_event is trigger_cache.MISSING:
+                    trigger_event = yield 'trigger', hsme_proxy, dst
+                    trigger_cache.store(key, trigger_event)
+                else:
+                    yield 'cached', hsme_proxy, dst
+            if visited is None:
+                visited = set()
+            steps += 1
+            try:
+                hsme_proxy = self._get_trigger_proxy(
+                    hsme_proxy, trigger_event, steps, visited,
+                )
+            except HSMEWrongTriggerError:
+                if self.metrics is not None:
+                    self.metrics.reject('trigger', trigger_event)
+                raise
+
+    def _do_transition(self, hsme_proxy):
+        """Runs the :meth:`_iter_transition` loop, calls the actions and
+        the triggers.
+        """
+        if not hsme_proxy.dst:
+            return False
+
+        steps = self._iter_transition(hsme_proxy)
+        result = None
+        while True:
+            try:
+                kind, hsme_proxy, dst = steps.send(result)
+            except StopIteration:
+                return True
+            if kind == 'trigger':
+                result = self.trigger_source(hsme_proxy, dst.trigger)
+            elif kind == 'action':
+                self.action_source(hsme_proxy, dst.action)
+
+    def _get_measured_send_proxy(self, event_name, payload):
+        try:
+            return type(self)._get_send_proxy(self, event_name, payload)
+        except HSMEWrongEventError:
+            self.metrics.reject('event', event_name)
+            raise
+
+    def _iter_measured_transition(self, hsme_proxy):
+        """The :meth:`_iter_transition` recording the latencies to the
+        ``metrics``, every step is timed until the caller comes back with
+        its result.
+        """
+        metrics = self.metrics
+        clock = metrics.clock
+        event_name = hsme_proxy.event
+        started_at = entered_at = clock()
+        steps = type(self)._iter_transition(self, hsme_proxy)
+        result = None
+        while True:
+            try:
+                kind, hsme_proxy, dst = steps.send(result)
+            except StopIteration:
+                finished_at = clock()
+                metrics.observe(
+                    'state',
+                    self.model.current_state.name,
+                    finished_at - entered_at,
+                )
+                metrics.observe('event', event_name, finished_at - started_at)
+                return
+
+            called_at = clock()
+            result = yield kind, hsme_proxy, dst
+            finished_at = clock()
+            if kind == 'action':
+                metrics.observe('action', dst.action, finished_at - called_at)
+                continue
+            if kind == 'trigger':
+                metrics.observe(
+                    'trigger', dst.trigger, finished_at - called_at,
+                )
+            metrics.observe('state', dst.name, finished_at - entered_at)
+            entered_at = finished_at
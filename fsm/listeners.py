@@ -0,0 +1,174 @@
+# coding: utf-8
+import threading
+
+ENTER = 'enter'
+EXIT = 'exit'
+TRANSITION = 'transition'
+
+KINDS = (EXIT, TRANSITION, ENTER)
+
+
+class HSMEListeners(object):
+    """Registry of the transition listeners, for auditing, logging,
+    notifications and alike::
+
+        listeners = HSMEListeners()
+        listeners.on_enter(notify_paid, state='paid')
+        listeners.on_exit(audit)
+        listeners.on_transition(log_refunds, event='refund')
+
+        hsme = HSMERunner(listeners=listeners)
+
+    Listeners get the ``HSMEProxyObject`` of the transition, like actions
+    do, they are called in order: the ``exit`` ones of the source state
+    and the ``transition`` ones before the current state is changed, the
+    ``enter`` ones of the destination state after it. Listeners without
+    the state (or the event) are called for all of them. Exceptions are
+    not caught, the same as in actions.
+
+    In hierarchical charts the ``enter`` and ``exit`` listeners of a
+    composite state are called when the machine comes to any of its leaves
+    from outside of it and leaves them for a state outside of it. Exits go
+    from the leaf up to the outermost left composite, enters from the
+    outermost entered composite down to the leaf.
+
+    Listener lists are rebuilt per state and per event on every
+    registration, the runner takes all the listeners of the transition
+    with one dict lookup, these are cached per ``(source, event,
+    destination)``. Runners without ``listeners`` don't pay anything.
+    One registry can be shared by any number of runners.
+    """
+
+    def __init__(self):
+        self._registered = []
+        self._lock = threading.Lock()
+        self._rebuild()
+
+    def __repr__(self):
+        return 'HSMEListeners: {0} listeners'.format(len(self))
+
+    def __len__(self):
+        return len(self._registered)
+
+    def __getstate__(self):
+        return {'_registered': self._registered}
+
+    def __setstate__(self, state):
+        self._registered = state['_registered']
+        self._lock = threading.Lock()
+        self._rebuild()
+
+    def on_enter(self, callback, state=None):
+        """Registers the listener called after the state is entered.
+
+        :param callback: a callable getting ``HSMEProxyObject``.
+        :param state: state name, None for all the states.
+        """
+        self._add(ENTER, callback, state)
+
+    def on_exit(self, callback, state=None):
+        """Registers the listener called before the state is left.
+
+        :param callback: a callable getting ``HSMEProxyObject``.
+        :param state: state name, None for all the states.
+        """
+        self._add(EXIT, callback, state)
+
+    def on_transition(self, callback, event=None):
+        """Registers the listener called before every transition made by
+        the event (including the triggered ones).
+
+        :param callback: a callable getting ``HSMEProxyObject``.
+        :param event: event, None for all the events.
+        """
+        self._add(TRANSITION, callback, event)
+
+    def remove(self, callback):
+        """Unregisters all the registrations of the listener.
+
+        :param callback: the registered callable.
+        """
+        with self._lock:
+            self._registered = [
+                r for r in self._registered if r[1] is not callback
+            ]
+            self._rebuild()
+
+    def clear(self):
+        """Unregisters all the listeners."""
+        with self._lock:
+            self._registered = []
+            self._rebuild()
+
+    def _add(self, kind, callback, key):
+        with self._lock:
+            self._registered = self._registered + [(kind, callback, key)]
+            self._rebuild()
+
+    def _rebuild(self):
+        defaults = dict((kind, ()) for kind in KINDS)
+        keyed = dict((kind, {}) for kind in KINDS)
+        own = dict((kind, {}) for kind in KINDS)
+        for kind, _, key in self._registered:
+            if key is not None:
+                keyed[kind][key] = own[kind][key] = ()
+
+        # Registration order is kept, the listeners for all the states
+        # (events) go to every list
+        for kind, callback, key in self._registered:
+            if key is None:
+                defaults[kind] += (callback,)
+                for other_key in keyed[kind]:
+                    keyed[kind][other_key] += (callback,)
+            else:
+                keyed[kind][key] += (callback,)
+                own[kind][key] += (callback,)
+
+        # New tables are swapped in at once, runners in other threads see
+        # either the old or the new ones
+        self._defaults = defaults
+        self._keyed = keyed
+        self._own = own
+        self._dispatch = {}
+
+    def get_dispatch(
+        self,
+        src_name,
+        event_name,
+        dst_name,
+        src_ancestors=(),
+        dst_ancestors=(),
+    ):
+        """All the listeners of the transition.
+
+        :param src_name: source state name, None for the initial transition.
+        :param event_name: event.
+        :param dst_name: destination state name.
+        :param src_ancestors: composite states of the source state,
+            the nearest first (``HSMEState.ancestors``).
+        :param dst_ancestors: composite states of the destination state.
+        :returns: ``(before, after)`` pair of tuples of callables, to call
+            before and after the current state is changed.
+        """
+        key = (src_name, event_name, dst_name, src_ancestors, dst_ancestors)
+        dispatch = self._dispatch.get(key)
+        if dispatch is None:
+            defaults = self._defaults
+            keyed = self._keyed
+            exits = (
+                keyed[EXIT].get(src_name, defaults[EXIT])
+                if src_name is not None else ()
+            )
+            enters = keyed[ENTER].get(dst_name, defaults[ENTER])
+            own = self._own
+            for name in src_ancestors:
+                if name not in dst_ancestors:
+                    exits += own[EXIT].get(name, ())
+            for name in dst_ancestors:
+                if name not in src_ancestors:
+                    enters = own[ENTER].get(name, ()) + enters
+            dispatch = self._dispatch[key] = (
+                exits + keyed[TRANSITION].get(event_name, defaults[TRANSITION]),
+                enters,
+            )
+        return dispatch
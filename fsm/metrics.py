@@ -0,0 +1,242 @@
+# coding: utf-8
+import threading
+import time
+from bisect import bisect_left
+
+try:
+    from time import perf_counter as _perf_counter
+except ImportError:  # Python 2
+    _perf_counter = time.time
+
+
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005,
+    0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0,
+)
+
+
+class HSMEHistogram(object):
+    """Latency histogram with fixed bucket upper bounds, in seconds, plus
+    the implicit ``+Inf`` bucket. Counts are kept per bucket and are
+    accumulated on export only, an observation is one bisect and two
+    additions.
+
+    :param buckets: sorted tuple of bucket upper bounds.
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def __repr__(self):
+        return 'HSMEHistogram: {0} observations'.format(self.count)
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative(self):
+        """Prometheus style buckets.
+
+        :returns: list of ``(upper bound, cumulative count)`` pairs, the last
+            bound is ``float('inf')``.
+        """
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': self.get_cumulative(),
+        }
+
+
+def _get_key(value):
+    # Triggers can be declared as lists of trigger ids
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def _escape(value):
+    return '{0}'.format(value).replace('\\', '\\\\').replace(
+        '"', '\\"'
+    ).replace('\n', '\\n')
+
+
+class HSMEMetrics(object):
+    """In-process instrumentation of the Runner transitions::
+
+        metrics = HSMEMetrics()
+        hsme = HSMERunner(trigger_source=..., metrics=metrics)
+        ...
+        metrics.snapshot()
+        metrics.as_prometheus()
+
+    Latency histograms are kept per:
+
+    * event, the whole :meth:`HSMERunner.send` including the triggered
+      transitions after it (``None`` is the :meth:`HSMERunner.start`);
+    * state, from entering the state to leaving it by its trigger or to the
+      end of the transition, so the action and the trigger are included;
+    * trigger id, the ``trigger_source`` call;
+    * action id, the ``action_source`` call.
+
+    The engine time is the event time minus the trigger and action times.
+    Events rejected by :meth:`HSMERunner.send` (``HSMEWrongEventError``)
+    and by the trigger chain (``HSMEWrongTriggerError``) are counted apart.
+
+    Runners without ``metrics`` run the plain transition code, so there is
+    no overhead at all if the instrumentation is off. One instance can be
+    shared by any number of runners, it's thread-safe.
+
+    :param buckets: sorted tuple of histogram bucket upper bounds,
+        in seconds, ``DEFAULT_BUCKETS`` by default.
+    :param clock: a callable returning seconds, ``time.perf_counter``
+        by default.
+    """
+
+    HISTOGRAM_CLS = HSMEHistogram
+    KINDS = ('event', 'state', 'trigger', 'action')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, clock=None):
+        self.buckets = tuple(buckets)
+        self.clock = clock or _perf_counter
+        self._lock = threading.Lock()
+        self.clear()
+
+    def __repr__(self):
+        return 'HSMEMetrics: {0} events'.format(
+            sum(h.count for h in self.histograms['event'].values())
+        )
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Drops all the collected data."""
+        with self._lock:
+            self.histograms = dict((kind, {}) for kind in self.KINDS)
+            self.rejected = {
+                'event': {},
+                'trigger': {},
+            }
+
+    def observe(self, kind, key, value):
+        """Records the latency.
+
+        :param kind: one of ``KINDS``.
+        :param key: event, state name, trigger id or action id.
+        :param value: seconds.
+        """
+        key = _get_key(key)
+        histograms = self.histograms[kind]
+        with self._lock:
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = self.HISTOGRAM_CLS(self.buckets)
+            histogram.observe(value)
+
+    def reject(self, kind, event_name):
+        """Counts the rejected event.
+
+        :param kind: ``event`` for sent events, ``trigger`` for the events
+            produced by triggers.
+        :param event_name: the rejected event.
+        """
+        event_name = _get_key(event_name)
+        counters = self.rejected[kind]
+        with self._lock:
+            counters[event_name] = counters.get(event_name, 0) + 1
+
+    def snapshot(self):
+        """A copy of the collected data::
+
+            {
+                'event': {True: {'count': 2, 'sum': 0.0001, 'buckets': [...]}},
+                'state': {...},
+                'trigger': {...},
+                'action': {...},
+                'rejected': {'event': {'nope': 1}, 'trigger': {}},
+            }
+
+        :returns: dict.
+        """
+        with self._lock:
+            snapshot = dict(
+                (kind, dict(
+                    (key, histogram.as_dict())
+                    for key, histogram in self.histograms[kind].items()
+                ))
+                for kind in self.KINDS
+            )
+            snapshot['rejected'] = dict(
+                (kind, dict(counters))
+                for kind, counters in self.rejected.items()
+            )
+        return snapshot
+
+    def as_prometheus(self, prefix='hsme'):
+        """The collected data in the Prometheus text exposition format,
+        ``<prefix>_<kind>_seconds`` histograms labeled by the kind and
+        ``<prefix>_rejected_total`` counters labeled by the kind and
+        the event.
+
+        :param prefix: metric names prefix.
+        :returns: text.
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for kind in self.KINDS:
+            name = '{0}_{1}_seconds'.format(prefix, kind)
+            lines.append('# TYPE {0} histogram'.format(name))
+            for key, data in sorted(snapshot[kind].items(), key=repr):
+                label = '{0}="{1}"'.format(kind, _escape(key))
+                for bound, count in data['buckets']:
+                    lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(
+                        name, label,
+                        '+Inf' if bound == float('inf') else repr(bound),
+                        count,
+                    ))
+                lines.append('{0}_sum{{{1}}} {2!r}'.format(
+                    name, label, data['sum'],
+                ))
+                lines.append('{0}_count{{{1}}} {2}'.format(
+                    name, label, data['count'],
+                ))
+
+        name = '{0}_rejected_total'.format(prefix)
+        lines.append('# TYPE {0} counter'.format(name))
+        for kind, counters in sorted(snapshot['rejected'].items()):
+            for event_name, count in sorted(counters.items(), key=repr):
+                lines.append('{0}{{kind="{1}",event="{2}"}} {3}'.format(
+                    name, kind, _escape(event_name), count,
+                ))
+        return '\n'.join(lines) + '\n'
@@ -1,6 +1,23 @@
 # coding: utf-8
 import hashlib
-import collections
+import json
+import numbers
+import time
+from collections import namedtuple
+
+try:
+    from collections.abc import Iterable
+except ImportError:  # Python 2
+    from collections import Iterable
+
+from fsm import codec
+from fsm.analysis import HSMEChartIndex
+from fsm.table import HSMETransitionTable
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
 
 
 class HSMEParserError(Exception):
@@ -11,11 +28,154 @@ class HSMEParserError(Exception):
     """
 
 
+class HSMEDecisionTable(object):
+    """Guarded transitions of one event in one state. Branches are
+    ``(guard ids, destination state name)`` pairs, the first branch with
+    all the guards passed wins, guards are checked in order, the first
+    failed one stops the branch. The branch without guards is the default
+    one, the branches after it are dropped.
+
+    ``settled`` has the destination for every branch the outcome doesn't
+    depend on anymore, when all the branches that can be reached from it
+    lead to the same state. Guards of such branches are not checked::
+
+        table = HSMEDecisionTable.compile([
+            {'guards': ['is_vip'], 'to': 'approved'},
+            {'guards': ['has_credit'], 'to': 'review'},
+            'review',
+        ])
+        table.settled
+        >> (None, 'review', 'review')
+
+    :param branches: a sequence of ``(guard ids tuple, state name)`` pairs.
+    """
+
+    def __init__(self, branches):
+        self.branches = tuple((tuple(g), dst) for g, dst in branches)
+        settled = []
+        next_settled = None
+        for guards, dst in reversed(self.branches):
+            next_settled = (
+                dst if not guards or next_settled == dst else None
+            )
+            settled.append(next_settled)
+        settled.reverse()
+        self.settled = tuple(settled)
+
+    def __repr__(self):
+        return 'HSMEDecisionTable: {0} branches'.format(len(self.branches))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, HSMEDecisionTable) and
+            self.branches == other.branches
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    @classmethod
+    def compile(cls, raw_branches, resolve=None):
+        """The ``HSMEDecisionTable`` factory.
+
+        :param raw_branches: a list of ``{'guards': [...], 'to': 'state'}``
+            dicts, plain state names are the default branches.
+        :param resolve: a callable mapping the destination state names,
+            like hierarchical chart leaves resolution.
+        :returns: ``HSMEDecisionTable`` instance.
+        :raises: ``HSMEParserError`` if some branch has no destination.
+        """
+        branches = []
+        for raw in raw_branches:
+            if isinstance(raw, dict):
+                if 'to' not in raw:
+                    raise HSMEParserError(
+                        'No destination state in the guarded '
+                        'transition {0}'.format(repr(raw))
+                    )
+                guards = []
+                for guard in raw.get('guards') or ():
+                    if guard not in guards:
+                        guards.append(guard)
+                dst = raw['to']
+            else:
+                guards, dst = [], raw
+            branches.append((guards, resolve(dst) if resolve else dst))
+            if not guards:
+                break
+        return cls(branches)
+
+    @property
+    def destinations(self):
+        return [dst for _, dst in self.branches]
+
+    def evaluate(self, check):
+        """Picks the branch.
+
+        :param check: a callable returning the guard result by guard id.
+        :returns: destination state name or None if no branch passed.
+        """
+        settled = self.settled
+        for i, (guards, dst) in enumerate(self.branches):
+            if settled[i] is not None:
+                return settled[i]
+            for guard in guards:
+                if not check(guard):
+                    break
+            else:
+                return dst
+        return None
+
+
+class _HSMEFrozenDict(dict):
+    """A dict that can't be changed after creation. Still a plain dict for
+    the lookups, JSON and the comparisons.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('{0} is read-only'.format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+
 class HSMEState(object):
     """Internal state representation object with state-related data,
     serialization/deserialization methods (:meth:`as_obj` and :meth:`as_dict`)
     and comparison logic.
+
+    States of hierarchical charts keep the names of their parent states,
+    the nearest first, in ``ancestors``, their ``events`` include the
+    inherited ones.
+
+    Guarded transitions are kept apart from the plain ``events``, in the
+    ``decisions`` mapping of events to ``HSMEDecisionTable`` instances.
+
+    States are immutable (``events`` and ``decisions`` are read-only dicts)
+    and interned, a chart has exactly one object per state name
+    (``HSMEStateChart`` makes sure of that), so states are compared and
+    hashed by identity, the cheapest way for the transition map lookups.
+    Use :meth:`is_same` to compare states of different charts.
     """
+
+    __slots__ = (
+        'name',
+        'events',
+        'trigger',
+        'action',
+        'is_initial',
+        'is_final',
+        'ancestors',
+        'decisions',
+    )
+
     def __init__(
         self,
         name,
@@ -23,28 +183,59 @@ class HSMEState(object):
         trigger=None,
         action=None,
         is_initial=False,
-        is_final=False
+        is_final=False,
+        ancestors=None,
+        decisions=None,
     ):
-        self.name = name
-        self.trigger = trigger
-        self.action = action
-        self.events = events or {}
-        self.is_initial = is_initial
-        self.is_final = is_final
-        if not self.events:
-            self.is_final = True
+        if events.__class__ is not _HSMEFrozenDict:
+            events = _HSMEFrozenDict(events or ())
+        if decisions.__class__ is not _HSMEFrozenDict:
+            decisions = _HSMEFrozenDict(decisions or ())
+        init = object.__setattr__
+        init(self, 'name', name)
+        init(self, 'events', events)
+        init(self, 'trigger', trigger)
+        init(self, 'action', action)
+        init(self, 'is_initial', is_initial)
+        init(self, 'is_final', is_final or not (events or decisions))
+        init(self, 'ancestors', tuple(ancestors or ()))
+        init(self, 'decisions', decisions)
 
     def __repr__(self):
         return 'HSMEState: {0}'.format(self.name)
 
-    def __hash__(self):
-        return hash(self.name)
+    def __setattr__(self, name, value):
+        raise AttributeError('HSMEState is immutable')
 
-    def __eq__(self, other):
+    def __delattr__(self, name):
+        raise AttributeError('HSMEState is immutable')
+
+    def __reduce__(self):
+        return self.__class__, (
+            self.name,
+            self.events,
+            self.trigger,
+            self.action,
+            self.is_initial,
+            self.is_final,
+            self.ancestors,
+            self.decisions,
+        )
+
+    def is_same(self, other):
+        """Structural comparison, for the states of different charts.
+
+        :param other: ``HSMEState`` instance.
+        :returns: True if all the state data is equal.
+        """
         return (
-            isinstance(other, self.__class__) and
+            isinstance(other, HSMEState) and
             self.name == other.name and
             self.events == other.events and
+            self.trigger == other.trigger and
+            self.action == other.action and
+            self.decisions == other.decisions and
+            self.ancestors == other.ancestors and
             self.is_initial == other.is_initial and
             self.is_final == other.is_final
         )
@@ -58,10 +249,15 @@ class HSMEState(object):
             action=raw_dict['action'],
             is_initial=raw_dict['is_initial'],
             is_final=raw_dict['is_final'],
+            ancestors=raw_dict.get('ancestors'),
+            decisions=dict(
+                (e, HSMEDecisionTable(branches))
+                for e, branches in raw_dict.get('decisions') or ()
+            ),
         )
 
     def as_dict(self):
-        return {
+        raw_dict = {
             'name': self.name,
             'events': [(e, s) for e, s in self.events.items()],
             'trigger': self.trigger,
@@ -69,53 +265,146 @@ class HSMEState(object):
             'is_initial': self.is_initial,
             'is_final': self.is_final,
         }
+        if self.ancestors:
+            raw_dict['ancestors'] = list(self.ancestors)
+        if self.decisions:
+            raw_dict['decisions'] = [
+                (e, [[list(g), dst] for g, dst in table.branches])
+                for e, table in self.decisions.items()
+            ]
+        return raw_dict
 
 
 class HSMEStateChart(object):
     """Internal FSM transition map representation. Consists of efficient
-    ``statechart`` structure, ``current_state``, ``initial_state``
-    and ``final_states`` containers, widely used in the Runner. Also, contains
+    ``statechart`` structure, ``initial_state`` and ``final_states``
+    containers, widely used in the Runner. Also, contains
     serialization/deserialization methods (:meth:`as_obj` and :meth:`as_dict`)
 
+    The chart is compiled once and treated as read-only, so one instance
+    can be shared by any number of runners. Everything that changes while
+    a machine is running lives in the ``HSMESession``.
+
+    States are interned on creation, the ``statechart`` edges, the initial
+    and the final states refer to the ``states`` objects, one per name,
+    even if the parser made a new object for every edge.
+
     :param chart_id: some id to mark FSM model.
-    :param current_state: ``HSMEState`` instance of the active transition state.
     :param initial_state: ``HSMEState`` instance of the FSM root state.
     :param final_states: a list of ``HSMEState`` instances with FSM edges.
-    :param history: a list of dicts like ``{'state': 'name', 'event': 'name'}``.
     :param statechart: transition dict structure with event-to-states mapping
         ``{'event': {HSMEState: HSMEState}}``
+    :param states: ``{'name': HSMEState}`` mapping of all declared states,
+        collected from the other arguments if omitted.
     """
 
     STATE_CLS = HSMEState
+    DECISION_TABLE_CLS = HSMEDecisionTable
+    TABLE_CLS = HSMETransitionTable
+    INDEX_CLS = HSMEChartIndex
 
     def __init__(
         self,
         chart_id=None,
-        current_state=None,
         initial_state=None,
         final_states=None,
-        history=None,
-        statechart=None
+        statechart=None,
+        states=None,
     ):
         self.chart_id = chart_id
-        self.current_state = current_state
         self.initial_state = initial_state
         self.final_states = final_states or []
-        self.history = history or []
         self.statechart = statechart or {}
+        self.states = states or self._collect_states()
+        self._intern_states()
+        self._table = None
+        self._index = None
 
     def __repr__(self):
         return 'HSMEStateChart: {0}'.format(self.chart_id)
 
+    def __reduce__(self):
+        return _load_chart_bytes, (self.__class__, self.as_bytes())
+
+    @property
+    def table(self):
+        """``HSMETransitionTable`` compiled from the chart on first access."""
+        if self._table is None:
+            self._table = self.TABLE_CLS.compile(self)
+        return self._table
+
+    @property
+    def index(self):
+        """``HSMEChartIndex`` compiled from the chart on first access."""
+        if self._index is None:
+            self._index = self.INDEX_CLS.compile(self)
+        return self._index
+
     def __eq__(self, other):
-        return (
-            isinstance(other, self.__class__) and
+        if not (
+            isinstance(other, HSMEStateChart) and
             self.chart_id == other.chart_id and
-            self.initial_state == other.initial_state and
-            self.final_states == other.final_states and
-            self.statechart == other.statechart
+            self.initial_state.name == other.initial_state.name and
+            [s.name for s in self.final_states] ==
+            [s.name for s in other.final_states] and
+            self._get_transitions() == other._get_transitions() and
+            len(self.states) == len(other.states)
+        ):
+            return False
+
+        other_states = other.states
+        for name, state in self.states.items():
+            if name not in other_states:
+                return False
+            if not state.is_same(other_states[name]):
+                return False
+        return True
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = object.__hash__
+
+    def _get_transitions(self):
+        return dict(
+            (event, dict(
+                (src.name, dst.name) for src, dst in states_map.items()
+            ))
+            for event, states_map in self.statechart.items()
         )
 
+    def _intern_states(self):
+        states = self.states
+
+        def intern(state):
+            return states.setdefault(state.name, state)
+
+        if self.initial_state is not None:
+            self.initial_state = intern(self.initial_state)
+        self.final_states = [intern(i) for i in self.final_states]
+        for event, states_map in list(self.statechart.items()):
+            for src, dst in states_map.items():
+                if states.get(src.name) is not src or (
+                    states.get(dst.name) is not dst
+                ):
+                    self.statechart[event] = dict(
+                        (intern(src), intern(dst))
+                        for src, dst in states_map.items()
+                    )
+                    break
+
+    def _collect_states(self):
+        states = {}
+        if self.initial_state is not None:
+            states[self.initial_state.name] = self.initial_state
+        for state in self.final_states:
+            states[state.name] = state
+        for states_map in self.statechart.values():
+            for src, dst in states_map.items():
+                states[src.name] = src
+                states[dst.name] = dst
+        return states
+
     @classmethod
     def as_obj(cls, raw_dict):
         """The ``HSMEStateChart`` factory.
@@ -123,27 +412,31 @@ class HSMEStateChart(object):
         :param raw_dict: dict structure produced by the :meth:`as_dict` method.
         :returns: ``HSMEStateChart`` instance.
         """
+        # States are repeated on every edge of the dump, every one
+        # is created once
+        states = {}
+
+        def get_state(raw_state):
+            state = states.get(raw_state['name'])
+            if state is None:
+                state = states[raw_state['name']] = cls.STATE_CLS.as_obj(
+                    raw_state
+                )
+            return state
+
         statechart = {}
         for event, states_pair in raw_dict['statechart']:
             src, dst = states_pair
-            statechart.setdefault(event, {}).update({
-                cls.STATE_CLS.as_obj(src): cls.STATE_CLS.as_obj(dst)
-            })
+            statechart.setdefault(event, {})[get_state(src)] = get_state(dst)
+        for raw_state in raw_dict.get('states') or ():
+            get_state(raw_state)
 
         return cls(
             chart_id=raw_dict['chart_id'],
-            current_state=(
-                cls.STATE_CLS.as_obj(raw_dict['current_state'])
-                if raw_dict['current_state']
-                else None
-            ),
-            initial_state=cls.STATE_CLS.as_obj(raw_dict['initial_state']),
-            final_states=[
-                cls.STATE_CLS.as_obj(i)
-                for i in raw_dict['final_states']
-            ],
-            history=raw_dict['history'],
+            initial_state=get_state(raw_dict['initial_state']),
+            final_states=[get_state(i) for i in raw_dict['final_states']],
             statechart=statechart,
+            states=states,
         )
 
     def as_dict(self):
@@ -152,7 +445,6 @@ class HSMEStateChart(object):
 
             {
                 'chart_id': 'dcf55c31ae9355a66319061aa4f23449',
-                'current_state': None,
                 'initial_state': {
                     'name': 'one',
                     'events': [
@@ -174,27 +466,639 @@ class HSMEStateChart(object):
                         'is_final': False
                     }, ... ))
                 ],
-                'history': [],
                 'final_states': [...]
             }
+
+        States reachable by guarded transitions only are not on any
+        ``statechart`` edge, they are written to the extra ``states`` list.
         """
         statechart = []
         for event, states_map in self.statechart.items():
             for src, dst in states_map.items():
                 statechart.append((event, (src.as_dict(), dst.as_dict())))
 
-        return {
+        raw_dict = {
             'chart_id': self.chart_id,
+            'initial_state': self.initial_state.as_dict(),
+            'final_states': [i.as_dict() for i in self.final_states],
+            'statechart': statechart,
+        }
+
+        # States reachable by guarded transitions only are not on any edge
+        written = set(self._collect_states())
+        unlinked = [
+            state.as_dict() for name, state in self.states.items()
+            if name not in written
+        ]
+        if unlinked:
+            raw_dict['states'] = unlinked
+        return raw_dict
+
+    @classmethod
+    def from_bytes(cls, data):
+        """The ``HSMEStateChart`` factory, binary version.
+
+        :param data: bytes (or memoryview) produced by the :meth:`as_bytes`.
+        :returns: ``HSMEStateChart`` instance.
+        """
+        return codec.decode_chart(data, cls)
+
+    def as_bytes(self):
+        """Binary serialization method, see ``fsm.codec``. Every state is
+        written once, transitions refer to states by index. Charts with
+        many transitions per state are dozens of times smaller and faster
+        to load than :meth:`as_dict` with JSON, with a few transitions
+        per state the load time is about the same, creating the states
+        takes most of it (``benchmarks/bench_codec.py``). Also used to
+        pickle charts.
+        """
+        return codec.encode_chart(self)
+
+
+class _HSMELazyDict(dict):
+    """A dict filled by :meth:`_materialize` on the first access to every
+    key, the set of keys is known in advance. Whole-dict reads (iteration,
+    ``items()``, comparison) fill it up first. Values are stored with
+    ``setdefault``, so concurrent readers always get the same object.
+    """
+
+    def __init__(self, chart, raw):
+        super(_HSMELazyDict, self).__init__()
+        self._chart = chart
+        self._raw = raw
+
+    def __missing__(self, key):
+        raw_key = self._get_raw_key(key)
+        if raw_key not in self._raw:
+            raise KeyError(key)
+        return self.setdefault(
+            self._get_key(raw_key), self._materialize(raw_key)
+        )
+
+    def __contains__(self, key):
+        return self._get_raw_key(key) in self._raw
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __iter__(self):
+        self._fill()
+        return dict.__iter__(self)
+
+    def __eq__(self, other):
+        self._fill()
+        if isinstance(other, _HSMELazyDict):
+            other._fill()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        self._fill()
+        return dict.keys(self)
+
+    def values(self):
+        self._fill()
+        return dict.values(self)
+
+    def items(self):
+        self._fill()
+        return dict.items(self)
+
+    def _fill(self):
+        if dict.__len__(self) < len(self._raw):
+            for raw_key in self._raw:
+                key = self._get_key(raw_key)
+                if not dict.__contains__(self, key):
+                    self.setdefault(key, self._materialize(raw_key))
+
+    def _get_key(self, raw_key):
+        return raw_key
+
+    def _get_raw_key(self, key):
+        return key
+
+    def _materialize(self, raw_key):
+        raise NotImplementedError
+
+
+class _HSMELazyStates(_HSMELazyDict):
+    # {'name': raw state dict} -> {'name': HSMEState}
+
+    def _materialize(self, name):
+        return self._chart.STATE_CLS.as_obj(self._raw[name])
+
+
+class _HSMELazyTransitions(_HSMELazyDict):
+    # {'src name': 'dst name'} -> {HSMEState: HSMEState}
+
+    def _get_key(self, src_name):
+        return self._chart.states[src_name]
+
+    def _get_raw_key(self, src):
+        return getattr(src, 'name', None)
+
+    def _materialize(self, src_name):
+        return self._chart.states[self._raw[src_name]]
+
+
+class _HSMELazyStatechart(_HSMELazyDict):
+    # {'event': {'src name': 'dst name'}} -> {'event': {HSMEState: HSMEState}}
+
+    def _materialize(self, event):
+        return _HSMELazyTransitions(self._chart, self._raw[event])
+
+
+class HSMELazyStateChart(HSMEStateChart):
+    """``HSMEStateChart`` built from the :meth:`HSMEStateChart.as_dict`
+    structure on demand. Only the name indexes are built on load, the
+    ``HSMEState`` objects and the per-event transition maps are created on
+    the first access, so loading a big chart to make a couple of transitions
+    costs time proportional to the states actually used::
+
+        chart = HSMELazyStateChart.as_obj(json.loads(serialized_chart))
+        chart.statechart[True][chart.states['one']]  # builds two states
+
+    Every state is created once, ``states``, ``statechart``,
+    ``initial_state`` and ``final_states`` share the same objects.
+    Everything that needs the whole chart (:meth:`as_bytes`, ``table``,
+    ``index``, comparison) materializes it, :meth:`as_dict` returns the raw
+    structure.
+
+    :param raw_dict: dict structure produced by the :meth:`as_dict` method.
+    """
+
+    def __init__(self, raw_dict):
+        raw_states = {}
+        raw_events = {}
+        for event, (src, dst) in raw_dict['statechart']:
+            raw_states[src['name']] = src
+            raw_states[dst['name']] = dst
+            raw_events.setdefault(event, {})[src['name']] = dst['name']
+        raw_states[raw_dict['initial_state']['name']] = (
+            raw_dict['initial_state']
+        )
+        for state in raw_dict['final_states']:
+            raw_states[state['name']] = state
+        for state in raw_dict.get('states') or ():
+            raw_states[state['name']] = state
+
+        self.chart_id = raw_dict['chart_id']
+        self.states = _HSMELazyStates(self, raw_states)
+        self.statechart = _HSMELazyStatechart(self, raw_events)
+        self._raw = raw_dict
+        self._final_states = None
+        self._table = None
+        self._index = None
+
+    def __reduce__(self):
+        return self.__class__, (self.as_dict(),)
+
+    @property
+    def initial_state(self):
+        return self.states[self._raw['initial_state']['name']]
+
+    @property
+    def final_states(self):
+        if self._final_states is None:
+            self._final_states = [
+                self.states[state['name']]
+                for state in self._raw['final_states']
+            ]
+        return self._final_states
+
+    @classmethod
+    def as_obj(cls, raw_dict):
+        """The ``HSMELazyStateChart`` factory.
+
+        :param raw_dict: dict structure produced by the :meth:`as_dict` method.
+        :returns: ``HSMELazyStateChart`` instance.
+        """
+        return cls(raw_dict)
+
+    def as_dict(self):
+        """See :meth:`HSMEStateChart.as_dict`, no states are materialized."""
+        raw_dict = self._raw
+        result = {
+            'chart_id': raw_dict['chart_id'],
+            'initial_state': raw_dict['initial_state'],
+            'final_states': raw_dict['final_states'],
+            'statechart': raw_dict['statechart'],
+        }
+        if raw_dict.get('states'):
+            result['states'] = raw_dict['states']
+        return result
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Binary charts are decoded eagerly,
+        see :meth:`HSMEStateChart.from_bytes`.
+        """
+        return HSMEStateChart.from_bytes(data)
+
+
+HSMEHistoryRecord = namedtuple(
+    'HSMEHistoryRecord', [
+        'state',
+        'event',
+        'timestamp',
+    ]
+)
+
+
+def _as_history_record(raw):
+    if isinstance(raw, dict):
+        return HSMEHistoryRecord(raw['state'], raw['event'], raw['timestamp'])
+    return HSMEHistoryRecord(*raw)
+
+
+class HSMESession(object):
+    """Per-machine runtime data: a reference to the shared ``HSMEStateChart``,
+    the current state and the transition history. Sessions are tiny, so
+    creating one for an already compiled chart costs ``O(1)``.
+
+    :param chart: ``HSMEStateChart`` instance the machine runs on.
+    :param current_state: ``HSMEState`` instance of the active transition state.
+    :param history: a list (or ``deque``) of ``HSMEHistoryRecord`` tuples
+        like ``('name', 'event', 1489430643)``.
+
+    The ``watermark`` is the last history record written by the previous
+    dump, the :meth:`as_delta_dict` method writes the records after it.
+    """
+
+    __slots__ = ('chart', 'current_state', 'history', 'watermark')
+
+    STATE_CHART_CLS = HSMEStateChart
+    HISTORY_RECORD_CLS = HSMEHistoryRecord
+
+    def __init__(self, chart, current_state=None, history=None):
+        self.chart = chart
+        self.current_state = current_state
+        self.history = history if history is not None else []
+        self.watermark = self.history[-1] if self.history else None
+
+    def __repr__(self):
+        return 'HSMESession: {0}'.format(self.chart_id)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, self.__class__) and
+            self.chart == other.chart and
+            getattr(self.current_state, 'name', None) ==
+            getattr(other.current_state, 'name', None) and
+            list(self.history) == list(other.history)
+        )
+
+    def __reduce__(self):
+        return _load_session_bytes, (
+            self.__class__, self.as_bytes(), self.chart,
+        )
+
+    @property
+    def chart_id(self):
+        return self.chart.chart_id
+
+    @classmethod
+    def as_obj(cls, raw_dict, chart=None):
+        """The ``HSMESession`` factory.
+
+        :param raw_dict: dict structure produced by the :meth:`as_dict`
+            or the :meth:`as_compact_dict` method.
+        :param chart: already compiled ``HSMEStateChart`` to attach the
+            session to. Built from ``raw_dict`` if omitted, so it's required
+            for the compact structure.
+        :returns: ``HSMESession`` instance.
+        """
+        if chart is None:
+            chart = cls.STATE_CHART_CLS.as_obj(raw_dict)
+
+        current_state = raw_dict['current_state']
+        if isinstance(current_state, dict):
+            current_state = current_state['name']
+
+        return cls(
+            chart=chart,
+            current_state=(
+                chart.states[current_state]
+                if current_state is not None else None
+            ),
+            history=[_as_history_record(h) for h in raw_dict['history']],
+        )
+
+    def as_dict(self):
+        """Full machine serialization method. Returns the
+        :meth:`HSMEStateChart.as_dict` structure extended with the
+        ``current_state`` and ``history`` keys.
+        """
+        raw_dict = self.chart.as_dict()
+        raw_dict.update({
             'current_state': (
                 self.current_state.as_dict()
                 if self.current_state else None
             ),
-            'initial_state': self.initial_state.as_dict(),
-            'final_states': [i.as_dict() for i in self.final_states],
-            'statechart': statechart,
-            'history': self.history,
+            'history': list(self.history),
+        })
+        return raw_dict
+
+    def as_compact_dict(self):
+        """State-only serialization method. The chart is referenced by id,
+        so only the data that actually changes is written::
+
+            {
+                'chart_id': 'dcf55c31ae9355a66319061aa4f23449',
+                'current_state': 'two',
+                'history': [...],
+            }
+        """
+        return {
+            'chart_id': self.chart_id,
+            'current_state': (
+                self.current_state.name
+                if self.current_state else None
+            ),
+            'history': list(self.history),
         }
 
+    @classmethod
+    def from_bytes(cls, data, chart):
+        """The ``HSMESession`` factory, binary version.
+
+        :param data: bytes (or memoryview) produced by the :meth:`as_bytes`.
+        :param chart: ``HSMEStateChart`` instance the session refers to.
+        :returns: ``HSMESession`` instance.
+        """
+        return codec.decode_session(data, cls, chart)
+
+    def as_bytes(self):
+        """Binary version of the :meth:`as_compact_dict` method,
+        see ``fsm.codec``.
+        """
+        return codec.encode_session(self)
+
+    def as_delta_dict(self):
+        """Incremental serialization method. The same as
+        :meth:`as_compact_dict`, but the history has only the records
+        appended after the ``watermark``::
+
+            {
+                'chart_id': 'dcf55c31ae9355a66319061aa4f23449',
+                'current_state': 'five',
+                'history': [['five', False, 1489430643]],
+                'delta': True,
+            }
+        """
+        history = []
+        for record in reversed(self.history):
+            if record is self.watermark:
+                break
+            history.append(record)
+        history.reverse()
+
+        return {
+            'chart_id': self.chart_id,
+            'current_state': (
+                self.current_state.name
+                if self.current_state else None
+            ),
+            'history': history,
+            'delta': True,
+        }
+
+    def apply_delta(self, raw_dict):
+        """Applies the structure produced by the :meth:`as_delta_dict` method
+        to the session restored from the previous dump.
+
+        :param raw_dict: delta dict.
+        """
+        current_state = raw_dict['current_state']
+        self.current_state = (
+            self.chart.states[current_state]
+            if current_state is not None else None
+        )
+        self.history.extend(
+            _as_history_record(h) for h in raw_dict['history']
+        )
+        self.watermark = self.history[-1] if self.history else None
+
+
+def _load_chart_bytes(chart_cls, data):
+    return chart_cls.from_bytes(data)
+
+
+def _load_session_bytes(session_cls, data, chart):
+    return session_cls.from_bytes(data, chart)
+
+
+_text_type = type(u'')
+
+
+def _encode_canonical(obj, out):
+    # Exact type checks go first, these are the usual definition values
+    cls = obj.__class__
+    if cls is _text_type:
+        out.append(u's{0}:'.format(len(obj)))
+        out.append(obj)
+    elif cls is dict:
+        items = []
+        for k, v in obj.items():
+            item = []
+            _encode_canonical(k, item)
+            _encode_canonical(v, item)
+            items.append(u''.join(item))
+        items.sort()
+        out.append(u'd{0}:'.format(len(items)))
+        out.extend(items)
+    elif cls is int:
+        out.append(u'i{0:d}'.format(obj))
+    elif obj is None:
+        out.append(u'n')
+    elif isinstance(obj, bool):
+        out.append(u'b1' if obj else u'b0')
+    elif isinstance(obj, numbers.Integral):
+        out.append(u'i{0:d}'.format(obj))
+    elif isinstance(obj, float):
+        out.append(u'f{0!r}'.format(obj))
+    elif isinstance(obj, bytes):
+        _encode_canonical(obj.decode('utf8'), out)
+    elif isinstance(obj, _text_type):
+        _encode_canonical(_text_type(obj), out)
+    elif isinstance(obj, (list, tuple)):
+        out.append(u'l{0}:'.format(len(obj)))
+        for i in obj:
+            _encode_canonical(i, out)
+    elif isinstance(obj, dict):
+        _encode_canonical(dict(obj), out)
+    else:
+        out.append(u'r{0!r}'.format(obj))
+
+
+def _canonical(obj):
+    """Deterministic text form of the state definition values. Doesn't
+    depend on dict ordering, hash seeds or ``repr`` of the containers, so it
+    is the same across processes and Python versions. Every value is
+    prefixed with its type and length, so the forms can be concatenated.
+    """
+    out = []
+    _encode_canonical(obj, out)
+    return u''.join(out)
+
+
+class HSMEChartHasher(object):
+    """Content hash of the state definitions, used as the chart id. Every
+    state definition is hashed on its own, in the canonical form, and the
+    md5 digests are summed modulo 2 ** 128, so the result doesn't depend on
+    the order of states and nothing but the sum and the count is kept.
+    Keys with empty values (``None``, ``False``, ``{}``) are ignored,
+    ``{'state': 'two'}`` and ``{'state': 'two', 'events': {}}`` are the same
+    state.
+    """
+
+    MODULO = 2 ** 128
+
+    def __init__(self):
+        self._sum = 0
+        self._count = 0
+
+    def update(self, state):
+        state = dict(
+            (k, v) for k, v in state.items()
+            if not (
+                v is None or v is False or
+                (isinstance(v, (dict, list, tuple)) and not v)
+            )
+        )
+        digest = hashlib.md5(_canonical(state).encode('utf8')).hexdigest()
+        self._sum = (self._sum + int(digest, 16)) % self.MODULO
+        self._count += 1
+
+    def hexdigest(self):
+        return hashlib.md5(
+            '{0}:{1:032x}'.format(self._count, self._sum).encode('ascii')
+        ).hexdigest()
+
+
+def _split_events(events, resolve=None):
+    """Splits the events of the state definition into the plain
+    ``{'event': 'state'}`` mapping and the ``{'event': HSMEDecisionTable}``
+    mapping of the guarded transitions (declared as lists of branches).
+    """
+    if not events:
+        return events, None
+
+    if not any(isinstance(dst, list) for dst in events.values()):
+        if resolve is None:
+            return events, None
+        return dict((e, resolve(dst)) for e, dst in events.items()), None
+
+    plain = {}
+    decisions = {}
+    for e, dst in events.items():
+        if isinstance(dst, list):
+            decisions[e] = HSMEDecisionTable.compile(dst, resolve)
+        else:
+            plain[e] = resolve(dst) if resolve else dst
+    return plain, decisions
+
+
+class _HSMEHierarchy(object):
+    """Parent/child relations of the state definitions. Composite states
+    (the ones with children) only group other states, the machine is
+    always in some leaf state. Leaves inherit the events of all their
+    ancestors, the nearest definition wins, transitions to composite states
+    lead to their ``initial`` leaves.
+    """
+
+    def __init__(self, definitions):
+        self.definitions = {}
+        self.composites = set()
+        for state in definitions:
+            if 'state' not in state:
+                raise HSMEParserError(
+                    'No state label found in definition {0}'.format(repr(state))
+                )
+            self.definitions[state['state']] = state
+
+        for name, state in self.definitions.items():
+            parent = state.get('parent')
+            if parent is None:
+                continue
+            if parent not in self.definitions:
+                raise HSMEParserError(
+                    'Unknown parent state {0} of the state {1}'.format(
+                        repr(parent), repr(name)
+                    )
+                )
+            self.composites.add(parent)
+
+        self._ancestors = {}
+        self._inherited_events = {}
+
+    def get_ancestors(self, name):
+        """Parent state names, the nearest first."""
+        ancestors = self._ancestors.get(name)
+        if ancestors is None:
+            ancestors = []
+            parent = self.definitions[name].get('parent')
+            while parent is not None:
+                if parent == name or parent in ancestors:
+                    raise HSMEParserError(
+                        'Parent states loop in the state {0}'.format(
+                            repr(name)
+                        )
+                    )
+                ancestors.append(parent)
+                parent = self.definitions[parent].get('parent')
+            ancestors = self._ancestors[name] = tuple(ancestors)
+        return ancestors
+
+    def get_leaf(self, name):
+        """The leaf state entered by the transition to the state."""
+        while name in self.composites:
+            initial = self.definitions[name].get('initial')
+            if (
+                initial not in self.definitions or
+                name not in self.get_ancestors(initial)
+            ):
+                raise HSMEParserError(
+                    'Composite state {0} has to declare one of its '
+                    'children as initial'.format(repr(name))
+                )
+            name = initial
+        return name
+
+    def get_events(self, state):
+        """Events of the state with the inherited ones, destinations are
+        not resolved to leaves yet.
+        """
+        if not self.composites:
+            return state.get('events')
+
+        parent = state.get('parent')
+        events = (
+            dict(self._get_inherited_events(parent))
+            if parent is not None else {}
+        )
+        events.update(state.get('events') or {})
+        return events
+
+    def _get_inherited_events(self, name):
+        events = self._inherited_events.get(name)
+        if events is None:
+            events = {}
+            for ancestor in reversed((name,) + self.get_ancestors(name)):
+                events.update(self.definitions[ancestor].get('events') or {})
+            self._inherited_events[name] = events
+        return events
+
 
 class HSMEDictsParser(object):
     """Standard FSM parser, ``HSMEStateChart`` fabric. Parses special raw
@@ -250,20 +1154,86 @@ class HSMEDictsParser(object):
             },
         }
 
+    States can be nested, a state with the ``parent`` becomes its child and
+    the parent becomes a composite state. The machine is always in some
+    leaf (not composite) state, a transition to the composite state leads
+    to its ``initial`` child. Leaves handle the events of all their
+    ancestors, unless they have their own transitions for the same events::
+
+        [
+            {
+                'state': 'order',
+                'is_initial': True,
+                'initial': 'new',
+                'events': {
+                    'cancel': 'cancelled',
+                },
+            },
+            {
+                'state': 'new',
+                'parent': 'order',
+                'events': {
+                    'pay': 'paid',
+                },
+            },
+            {
+                'state': 'paid',
+                'parent': 'order',
+            },
+            {
+                'state': 'cancelled',
+            },
+        ]
+
+    Inherited events are resolved at parse time, every leaf gets the full
+    events table, so the transition lookup costs the same at any depth.
+    Composite states can't have triggers or actions of their own, the
+    machine never stays in them, ``HSMEParserError`` is raised.
+
+    Guarded transitions are declared as lists of branches, the first branch
+    with all its guards passed wins, the plain state name is the default
+    branch (see ``HSMEDecisionTable``, the guards are checked by the
+    ``guard_source`` of the Runner)::
+
+        {
+            'state': 'check',
+            'events': {
+                'submit': [
+                    {'guards': ['is_vip'], 'to': 'approved'},
+                    {'guards': ['has_credit', 'is_verified'], 'to': 'review'},
+                    'rejected',
+                ],
+            },
+        }
+
     The method :meth:`parse` produces ``HSMEStateChart`` instance with
     optimized transition map structure and some helpers.
     """
 
     STATE_CLS = HSMEState
     STATE_CHART_CLS = HSMEStateChart
+    HASHER_CLS = HSMEChartHasher
 
-    def __init__(self, chart=None):
+    def __init__(self, chart=None, chart_id=None):
         self.chart = chart or []
-        if not isinstance(self.chart, collections.Iterable):
+        self.chart_id = chart_id
+        if not isinstance(self.chart, Iterable):
             raise HSMEParserError('Unexpected statechart object type')
+        if not isinstance(self.chart, (list, tuple)):
+            self.chart = list(self.chart)
 
     def get_chart_id(self, obj):
-        return hashlib.md5(repr(obj).encode('utf8')).hexdigest()
+        """Stable content hash of the raw chart, the same chart gets the same
+        id in any process, so it's a safe cache key.
+
+        :param obj: iterable of state definitions.
+        :returns: hex string.
+        """
+        hasher = self.HASHER_CLS()
+        for state in obj:
+            if isinstance(state, dict):
+                hasher.update(state)
+        return hasher.hexdigest()
 
     def parse(self):
         """Feel free to analyze this method if you want to create your own
@@ -275,28 +1245,54 @@ class HSMEDictsParser(object):
             hsme.parse(TRANSITION_MAP, parser=YourCustomParserClass)
             hsme.start()
 
-        :raises: ``HSMEParserError`` if wrong state definition or no initial
-            state was found (or several of them).
+        :raises: ``HSMEParserError`` if wrong state definition, unknown
+            destination state or no initial state was found (or several
+            of them).
         """
+        hierarchy = _HSMEHierarchy(self.chart)
+        initial_leaves = set(
+            hierarchy.get_leaf(state['state'])
+            for state in self.chart
+            if state['state'] in hierarchy.composites and
+            state.get('is_initial', False)
+        )
         states_map = {}
         initial_states = []
         final_states = []
         for state in self.chart:
-            if 'state' not in state:
-                raise HSMEParserError(
-                    'No state label found in definition {0}'.format(repr(state))
-                )
             state_id = state['state']
+            if state_id in hierarchy.composites:
+                for key in ('trigger', 'action'):
+                    if state.get(key) is not None:
+                        raise HSMEParserError(
+                            'Composite state {0} can not have the {1}, '
+                            'declare it in the leaf states'.format(
+                                repr(state_id), key
+                            )
+                        )
+                if state.get('is_initial', False):
+                    initial_states.append(hierarchy.get_leaf(state_id))
+                continue
+
+            events, decisions = _split_events(
+                hierarchy.get_events(state),
+                hierarchy.get_leaf if hierarchy.composites else None,
+            )
             state_inst = self.STATE_CLS(
                 name=state_id,
-                is_initial=state.get('is_initial', False),
-                events=state.get('events'),
+                is_initial=(
+                    state.get('is_initial', False) or
+                    state_id in initial_leaves
+                ),
+                events=events,
                 trigger=state.get('trigger'),
                 action=state.get('action'),
+                ancestors=hierarchy.get_ancestors(state_id),
+                decisions=decisions,
             )
             states_map[state_id] = state_inst
-            if state_inst.is_initial:
-                initial_states.append(state_inst)
+            if state.get('is_initial', False):
+                initial_states.append(state_id)
             if state_inst.is_final:
                 final_states.append(state_inst)
 
@@ -310,20 +1306,233 @@ class HSMEDictsParser(object):
                 'Initial state ambiguity, you can have only one entry point'
             )
 
-        initial_state = initial_states[0]
+        initial_state = states_map[initial_states[0]]
 
         events_map = {}
         for state_inst in states_map.values():
             for e, dst in state_inst.events.items():
+                if dst not in states_map:
+                    raise HSMEParserError(
+                        'Unknown destination state {0} of the event {1} '
+                        'in the state {2}'.format(
+                            repr(dst), repr(e), repr(state_inst.name)
+                        )
+                    )
                 events_map.setdefault(e, {}).update({
                     state_inst: states_map[dst]
                 })
+            for e, table in state_inst.decisions.items():
+                for dst in table.destinations:
+                    if dst not in states_map:
+                        raise HSMEParserError(
+                            'Unknown destination state {0} of the guarded '
+                            'event {1} in the state {2}'.format(
+                                repr(dst), repr(e), repr(state_inst.name)
+                            )
+                        )
 
         model = self.STATE_CHART_CLS(
-            chart_id=self.get_chart_id(events_map),
+            chart_id=self.chart_id or self.get_chart_id(self.chart),
             initial_state=initial_state,
             final_states=final_states,
             statechart=events_map,
+            states=states_map,
         )
 
         return model
+
+
+class HSMEParserStats(object):
+    """Counters of the :meth:`HSMEStreamParser.parse` run."""
+
+    def __init__(self):
+        self.states = 0
+        self.transitions = 0
+        self.elapsed = 0.0
+        self.peak_memory = None
+
+    def __repr__(self):
+        return (
+            'HSMEParserStats: {0} states, {1} transitions, {2:.3f} sec, '
+            'peak memory {3}'.format(
+                self.states, self.transitions, self.elapsed,
+                self.peak_memory,
+            )
+        )
+
+
+class HSMEStreamParser(object):
+    """``HSMEStateChart`` fabric for big generated charts. Consumes state
+    definitions one by one from any iterable, like a generator or a file
+    of JSON lines, so the raw chart is never kept in memory as a whole::
+
+        with open('chart.jsonl') as chart_file:
+            hsme.parse(chart_file, parser=HSMEStreamParser)
+
+    Definitions are the same as of ``HSMEDictsParser``, lines are decoded
+    with the ``deserializer``, blank lines are skipped. Destinations can
+    refer to states defined later, they are resolved as soon as the state
+    shows up. The chart id is the same as ``HSMEDictsParser`` produces for
+    the same states, it is computed along the way.
+
+    Counters of the last :meth:`parse` run are kept in the ``stats``
+    attribute, ``HSMEParserStats``. The peak memory is measured with
+    ``tracemalloc`` if ``trace_memory`` is set (it slows parsing down).
+
+    :param chart: iterable of state definitions (dicts or JSON strings).
+    :param deserializer: some callable, ``json.loads`` replacement.
+    :param trace_memory: measure the peak memory, False by default.
+    """
+
+    STATE_CLS = HSMEState
+    STATE_CHART_CLS = HSMEStateChart
+    HASHER_CLS = HSMEChartHasher
+
+    def __init__(self, chart=None, deserializer=None, trace_memory=False):
+        self.chart = chart if chart is not None else []
+        if not isinstance(self.chart, Iterable):
+            raise HSMEParserError('Unexpected statechart object type')
+        self.deserializer = deserializer or json.loads
+        self.trace_memory = trace_memory
+        self.stats = HSMEParserStats()
+
+    def iter_states(self):
+        """State definitions of the ``chart``, decoded if needed.
+
+        :returns: generator of dicts.
+        """
+        for state in self.chart:
+            if isinstance(state, (bytes, type(u''))):
+                if not state.strip():
+                    continue
+                state = self.deserializer(state)
+            if not isinstance(state, dict):
+                raise HSMEParserError(
+                    'Unexpected state definition {0}'.format(repr(state))
+                )
+            yield state
+
+    def parse(self):
+        """See :meth:`HSMEDictsParser.parse`.
+
+        :raises: ``HSMEParserError`` if wrong state definition, unknown
+            destination state or no initial state was found (or several
+            of them).
+        """
+        stats = self.stats = HSMEParserStats()
+        trace_memory = self.trace_memory and tracemalloc is not None
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif trace_memory and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        memory = tracemalloc.get_traced_memory()[0] if trace_memory else 0
+        started_at = time.time()
+
+        try:
+            chart = self._parse(stats)
+            if trace_memory:
+                stats.peak_memory = (
+                    tracemalloc.get_traced_memory()[1] - memory
+                )
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            stats.elapsed = time.time() - started_at
+
+        return chart
+
+    def _parse(self, stats):
+        hasher = self.HASHER_CLS()
+        states_map = {}
+        events_map = {}
+        # Transitions to the states not defined yet,
+        # {'dst name': [('event', src HSMEState), ...]}
+        pending = {}
+        # Guarded transitions to the states not defined yet, checked only,
+        # {'dst name': [src HSMEState, ...]}
+        pending_guarded = {}
+        initial_state = None
+        final_states = []
+
+        for state in self.iter_states():
+            if 'state' not in state:
+                raise HSMEParserError(
+                    'No state label found in definition {0}'.format(repr(state))
+                )
+            if 'parent' in state or 'initial' in state:
+                raise HSMEParserError(
+                    'Nested state {0}, use HSMEDictsParser, nested states '
+                    'are not supported by the stream parser'.format(
+                        repr(state['state'])
+                    )
+                )
+            hasher.update(state)
+            events, decisions = _split_events(state.get('events'))
+            state_inst = self.STATE_CLS(
+                name=state['state'],
+                is_initial=state.get('is_initial', False),
+                events=events,
+                trigger=state.get('trigger'),
+                action=state.get('action'),
+                decisions=decisions,
+            )
+            state_id = state_inst.name
+            states_map[state_id] = state_inst
+            stats.states += 1
+
+            if state_inst.is_initial:
+                if initial_state is not None:
+                    raise HSMEParserError(
+                        'Initial state ambiguity, '
+                        'you can have only one entry point'
+                    )
+                initial_state = state_inst
+            if state_inst.is_final:
+                final_states.append(state_inst)
+
+            for e, src in pending.pop(state_id, ()):
+                events_map.setdefault(e, {})[src] = state_inst
+            for e, dst in state_inst.events.items():
+                stats.transitions += 1
+                if dst in states_map:
+                    events_map.setdefault(e, {})[state_inst] = states_map[dst]
+                else:
+                    pending.setdefault(dst, []).append((e, state_inst))
+
+            pending_guarded.pop(state_id, None)
+            for table in state_inst.decisions.values():
+                stats.transitions += len(table.branches)
+                for dst in table.destinations:
+                    if dst not in states_map:
+                        pending_guarded.setdefault(dst, []).append(state_inst)
+
+        if pending or pending_guarded:
+            sources = {}
+            for dst, transitions in pending.items():
+                sources.setdefault(dst, []).extend(s for _, s in transitions)
+            for dst, guarded_sources in pending_guarded.items():
+                sources.setdefault(dst, []).extend(guarded_sources)
+            missing = sorted(sources, key=repr)
+            sources = sorted(set(
+                src.name for dst in missing for src in sources[dst]
+            ), key=repr)
+            raise HSMEParserError(
+                'Unknown destination states {0} referred from {1}'.format(
+                    ', '.join(repr(i) for i in missing[:10]),
+                    ', '.join(repr(i) for i in sources[:10]),
+                )
+            )
+
+        if initial_state is None:
+            raise HSMEParserError(
+                'No initial state found, mark you entry point state'
+            )
+
+        return self.STATE_CHART_CLS(
+            chart_id=hasher.hexdigest(),
+            initial_state=initial_state,
+            final_states=final_states,
+            statechart=events_map,
+            states=states_map,
+        )
@@ -0,0 +1,266 @@
+# coding: utf-8
+from array import array
+from collections import namedtuple
+
+from fsm.parsers import HSMESession
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+HSMEStepResult = namedtuple(
+    'HSMEStepResult', [
+        'accepted',
+        'rejected',
+        'actions',
+        'triggers',
+    ]
+)
+
+
+class HSMEPopulation(object):
+    """Many independent machines of the same chart, stepped all at once.
+    Current states are kept as the state ids of the chart's
+    ``HSMETransitionTable`` in one integer array, one item per machine::
+
+        population = HSMEPopulation(chart, 10000)
+        population.start()
+        result = population.step([True] * 10000)
+
+    The :meth:`step` method applies an array of events, one event per
+    machine, with a single vectorized table lookup if NumPy is installed
+    (a plain loop over the ``array`` otherwise) and returns
+    ``HSMEStepResult(accepted, rejected, actions, triggers)``:
+
+    * ``accepted`` - indices of the machines that made the transition.
+    * ``rejected`` - indices of the machines the event is inappropriate for,
+      the ``HSMEWrongEventError`` case of ``HSMERunner``.
+    * ``actions`` and ``triggers`` - ``(machines, ids)`` pairs, indices of the
+      accepted machines whose new state has an action (trigger) and the list
+      (the object array with NumPy) of these action (trigger) ids, in the
+      same order. Empty ids (``None``, ``0``) are skipped, the same as
+      ``HSMERunner`` does.
+
+    Actions and triggers are not called, it's up to the caller to process
+    them in bulk and send the trigger events with the next :meth:`step`.
+    History is not tracked.
+
+    :param chart: ``HSMEStateChart`` instance.
+    :param size: number of machines.
+    :param use_numpy: use NumPy arrays, by default if NumPy is installed.
+    """
+
+    NOT_STARTED = -1
+    NO_EVENT = -1
+    UNKNOWN_EVENT = -2
+
+    def __init__(self, chart, size, use_numpy=None):
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy and numpy is None:
+            raise ImportError('NumPy is not installed')
+
+        self.chart = chart
+        self.table = chart.table
+        self.size = size
+        self.use_numpy = use_numpy
+
+        states = self.table.states
+        self._actions = [s.action for s in states]
+        self._triggers = [s.trigger for s in states]
+
+        if use_numpy:
+            # Filled item by item, ids can be lists (multiple triggers)
+            self._action_ids = numpy.empty(len(states), dtype=object)
+            self._trigger_ids = numpy.empty(len(states), dtype=object)
+            for i, state in enumerate(states):
+                self._action_ids[i] = state.action
+                self._trigger_ids[i] = state.trigger
+            self.states = numpy.full(
+                size, self.NOT_STARTED, dtype=numpy.int32
+            )
+            self._table = numpy.array(
+                self.table.table, dtype=numpy.int32,
+            ).reshape(len(states), self.table.width)
+            self._has_action = numpy.array(
+                [bool(a) for a in self._actions], dtype=bool,
+            )
+            self._has_trigger = numpy.array(
+                [bool(t) for t in self._triggers], dtype=bool,
+            )
+        else:
+            self.states = array('i', [self.NOT_STARTED]) * size
+
+    def __repr__(self):
+        return 'HSMEPopulation: {0} x {1}'.format(
+            self.chart.chart_id, self.size
+        )
+
+    def __len__(self):
+        return self.size
+
+    def start(self):
+        """Puts every not started machine into the initial state.
+
+        :returns: ``HSMEStepResult`` instance.
+        """
+        initial_id = self.table.state_ids[self.chart.initial_state.name]
+        if self.use_numpy:
+            machines = numpy.flatnonzero(self.states == self.NOT_STARTED)
+            self.states[machines] = initial_id
+            return self._get_result(
+                machines, numpy.empty(0, dtype=numpy.intp)
+            )
+
+        states = self.states
+        machines = [i for i in range(self.size) if states[i] < 0]
+        for i in machines:
+            states[i] = initial_id
+        return self._get_result(machines, [])
+
+    def encode_events(self, events):
+        """Converts events to event ids, ``None`` becomes ``NO_EVENT``
+        (the machine is skipped) and unregistered events become
+        ``UNKNOWN_EVENT`` (the machine rejects it).
+
+        :param events: a sequence of events, one per machine.
+        :returns: event ids array.
+        """
+        event_ids = self.table.event_ids
+        unknown = self.UNKNOWN_EVENT
+        encoded = [
+            self.NO_EVENT if e is None else event_ids.get(e, unknown)
+            for e in events
+        ]
+        if self.use_numpy:
+            return numpy.array(encoded, dtype=numpy.int32)
+        return array('i', encoded)
+
+    def step(self, events):
+        """Applies one event to every machine.
+
+        :param events: a sequence of events, one per machine, ``None`` to
+            leave the machine untouched.
+        :returns: ``HSMEStepResult`` instance.
+        """
+        return self.step_ids(self.encode_events(events))
+
+    def step_ids(self, event_ids):
+        """The same as :meth:`step`, for already encoded events.
+
+        :param event_ids: event ids array, see :meth:`encode_events`.
+        :returns: ``HSMEStepResult`` instance.
+        """
+        if len(event_ids) != self.size:
+            raise ValueError(
+                'Expected {0} events, got {1}'.format(
+                    self.size, len(event_ids)
+                )
+            )
+        if self.use_numpy:
+            return self._step_numpy(numpy.asarray(event_ids))
+        return self._step_array(event_ids)
+
+    def _step_numpy(self, event_ids):
+        states = self.states
+        active = event_ids != self.NO_EVENT
+        valid = active & (event_ids >= 0) & (states >= 0)
+
+        dst = numpy.full(
+            self.size, self.table.NO_TRANSITION, dtype=numpy.int32
+        )
+        dst[valid] = self._table[states[valid], event_ids[valid]]
+        valid &= dst >= 0
+
+        accepted = numpy.flatnonzero(valid)
+        rejected = numpy.flatnonzero(active & ~valid)
+        states[accepted] = dst[accepted]
+        return self._get_result(accepted, rejected)
+
+    def _step_array(self, event_ids):
+        states = self.states
+        table = self.table.table
+        width = self.table.width
+        accepted = []
+        rejected = []
+        for i, event_id in enumerate(event_ids):
+            if event_id == self.NO_EVENT:
+                continue
+            src_id = states[i]
+            if event_id < 0 or src_id < 0:
+                rejected.append(i)
+                continue
+            dst_id = table[src_id * width + event_id]
+            if dst_id < 0:
+                rejected.append(i)
+                continue
+            states[i] = dst_id
+            accepted.append(i)
+        return self._get_result(accepted, rejected)
+
+    def _get_result(self, accepted, rejected):
+        states = self.states
+        if self.use_numpy:
+            dst = states[accepted]
+            has_action = self._has_action[dst]
+            has_trigger = self._has_trigger[dst]
+            return HSMEStepResult(
+                accepted=accepted,
+                rejected=rejected,
+                actions=(
+                    accepted[has_action],
+                    self._action_ids[dst[has_action]],
+                ),
+                triggers=(
+                    accepted[has_trigger],
+                    self._trigger_ids[dst[has_trigger]],
+                ),
+            )
+
+        actions = self._actions
+        triggers = self._triggers
+        action_machines = [i for i in accepted if actions[states[i]]]
+        trigger_machines = [i for i in accepted if triggers[states[i]]]
+        return HSMEStepResult(
+            accepted=accepted,
+            rejected=rejected,
+            actions=(
+                action_machines,
+                [actions[states[i]] for i in action_machines],
+            ),
+            triggers=(
+                trigger_machines,
+                [triggers[states[i]] for i in trigger_machines],
+            ),
+        )
+
+    def get_state(self, index):
+        """Current state of the machine.
+
+        :param index: machine index.
+        :returns: ``HSMEState`` instance or None if not started.
+        """
+        state_id = self.states[index]
+        return self.table.states[state_id] if state_id >= 0 else None
+
+    def get_session(self, index):
+        """Exports the machine as a standalone ``HSMESession``, to continue
+        with ``HSMERunner`` (``HSMERunner().load(population.get_session(i))``).
+
+        :param index: machine index.
+        :returns: ``HSMESession`` instance.
+        """
+        return HSMESession(self.chart, current_state=self.get_state(index))
+
+    def count(self, state_name):
+        """Number of machines in the state.
+
+        :param state_name: state name/id.
+        :returns: int.
+        """
+        state_id = self.table.state_ids[state_name]
+        if self.use_numpy:
+            return int(numpy.count_nonzero(self.states == state_id))
+        return self.states.count(state_id)
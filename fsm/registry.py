@@ -0,0 +1,175 @@
+# coding: utf-8
+import threading
+from collections import OrderedDict, namedtuple
+
+
+HSMERegistryInfo = namedtuple(
+    'HSMERegistryInfo', [
+        'hits',
+        'misses',
+        'maxsize',
+        'currsize',
+    ]
+)
+
+
+class HSMEChartRegistry(object):
+    """Storage of compiled ``HSMEStateChart`` instances keyed by the chart id.
+    Runners look up every chart they parse or load here first, so the same
+    raw chart is parsed once per process, and compact dumps, which reference
+    the chart by id only, can be resolved back to the shared chart::
+
+        registry = HSMEChartRegistry(maxsize=32)
+        hsme = HSMERunner(registry=registry)
+        hsme.parse(RULES_CHART)
+        registry.get(hsme.model.chart_id) is hsme.model.chart
+
+    Least recently used charts are evicted when ``maxsize`` is reached.
+    Runners keep working with evicted charts, but compact dumps referencing
+    them can't be loaded until the chart is parsed or loaded again.
+
+    Parsed charts are cached per parser class, so charts built by custom
+    parsers (with custom state classes, for example) never replace the
+    default ones. Charts without id (built directly) are never registered.
+
+    :param maxsize: max number of charts to keep, ``None`` for no limit.
+    """
+
+    DEFAULT_MAXSIZE = 256
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._charts = OrderedDict()
+        self._parsed = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return 'HSMEChartRegistry: {0} charts'.format(len(self))
+
+    def __len__(self):
+        return len(self._charts)
+
+    def __contains__(self, chart_id):
+        return chart_id in self._charts
+
+    def add(self, chart):
+        """Registers the compiled chart under its ``chart_id``, in place of
+        the registered one with the same id and state class. Charts without
+        id are not registered.
+
+        :param chart: ``HSMEStateChart`` instance.
+        :returns: ``chart``.
+        """
+        if chart.chart_id is None:
+            return chart
+        with self._lock:
+            registered = self._charts.get(chart.chart_id)
+            if registered is None or self._is_same_kind(registered, chart):
+                registered = chart
+            self._put(self._charts, chart.chart_id, registered)
+        return chart
+
+    def resolve(self, chart):
+        """The registered chart with the same id and state class as the
+        chart, the chart itself is registered if there is none. Used to
+        share one chart among the deserialized copies.
+
+        :param chart: ``HSMEStateChart`` instance.
+        :returns: ``HSMEStateChart`` instance.
+        """
+        if chart.chart_id is None:
+            return chart
+        with self._lock:
+            registered = self._charts.get(chart.chart_id)
+            if registered is None:
+                registered = chart
+            self._put(self._charts, chart.chart_id, registered)
+        if self._is_same_kind(registered, chart):
+            return registered
+        return chart
+
+    @staticmethod
+    def _is_same_kind(registered, chart):
+        return type(registered.initial_state) is type(chart.initial_state)
+
+    def get(self, chart_id, default=None):
+        """Looks up the compiled chart, counts hits and misses.
+
+        :param chart_id: the chart id.
+        :returns: ``HSMEStateChart`` instance or ``default`` if unknown.
+        """
+        with self._lock:
+            chart = self._charts.pop(chart_id, None)
+            if chart is None:
+                self.misses += 1
+                return default
+            self._charts[chart_id] = chart
+            self.hits += 1
+        return chart
+
+    def parse(self, parser, chart_id=None):
+        """Returns the compiled chart for the raw chart of the ``parser``,
+        the chart is parsed only if it's not parsed by the same parser
+        class yet::
+
+            chart = registry.parse(HSMEDictsParser(RULES_CHART))
+
+        :param parser: ``HSMEDictsParser`` instance.
+        :param chart_id: the chart id, if known, the raw chart is not
+            hashed then (the fastest way to get the registered chart).
+        :returns: ``HSMEStateChart`` instance.
+        """
+        if chart_id is None:
+            if not hasattr(parser, 'get_chart_id'):
+                return self.add(parser.parse())
+            chart_id = parser.get_chart_id(parser.chart)
+
+        key = (parser.__class__, chart_id)
+        with self._lock:
+            chart = self._parsed.pop(key, None)
+            if chart is not None:
+                self._parsed[key] = chart
+                if chart_id not in self._charts:
+                    self._put(self._charts, chart_id, chart)
+                self.hits += 1
+                return chart
+            self.misses += 1
+
+        if getattr(parser, 'chart_id', False) is None:
+            parser.chart_id = chart_id
+        chart = parser.parse()
+        self.add(chart)
+        with self._lock:
+            self._put(self._parsed, key, chart)
+        return chart
+
+    def _put(self, cache, key, value):
+        cache.pop(key, None)
+        cache[key] = value
+        if self.maxsize is not None:
+            while len(cache) > self.maxsize:
+                cache.popitem(last=False)
+
+    def info(self):
+        """Cache statistics.
+
+        :returns: ``HSMERegistryInfo(hits, misses, maxsize, currsize)``.
+        """
+        return HSMERegistryInfo(
+            hits=self.hits,
+            misses=self.misses,
+            maxsize=self.maxsize,
+            currsize=len(self._charts),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._charts.clear()
+            self._parsed.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+default_registry = HSMEChartRegistry()
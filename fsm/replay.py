@@ -0,0 +1,167 @@
+# coding: utf-8
+import multiprocessing
+import time
+from collections import namedtuple
+from itertools import islice
+
+from fsm.core import HSMERunner, HSMEWrongEventError
+
+
+HSMEReplayResult = namedtuple(
+    'HSMEReplayResult', [
+        'machine_id',
+        'state',
+        'history',
+        'rejected',
+    ]
+)
+
+
+class HSMEReplayStats(object):
+    """Counters of the replay run, updated while results are streamed."""
+
+    def __init__(self):
+        self.records = 0
+        self.events = 0
+        self.rejected = 0
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return (
+            'HSMEReplayStats: {0} records, {1} events, {2} rejected, '
+            '{3:.0f} events/sec'.format(
+                self.records, self.events, self.rejected, self.events_per_sec
+            )
+        )
+
+    @property
+    def events_per_sec(self):
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def records_per_sec(self):
+        return self.records / self.elapsed if self.elapsed else 0.0
+
+
+_worker_chart = None
+_worker_runner = None
+
+
+def _init_worker(chart, runner_cls, runner_kwargs):
+    global _worker_chart, _worker_runner
+    _worker_chart = chart
+    _worker_runner = runner_cls(**runner_kwargs)
+
+
+def _replay_chunk(chunk):
+    chart = _worker_chart
+    runner = _worker_runner
+    results = []
+    events_count = 0
+    for machine_id, events in chunk:
+        runner.load(chart)
+        runner.start()
+        rejected = []
+        for i, event_name in enumerate(events):
+            try:
+                runner.send(event_name)
+            except HSMEWrongEventError:
+                rejected.append((i, event_name))
+            events_count += 1
+        results.append(HSMEReplayResult(
+            machine_id=machine_id,
+            state=runner.model.current_state.name,
+            history=list(runner.model.history),
+            rejected=rejected,
+        ))
+    return results, events_count
+
+
+def _get_chunks(records, chunksize):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+class HSMEReplayer(object):
+    """Offline replay of stored event logs, rebuilds the final state of many
+    machines of the same chart on all CPU cores. Records are
+    ``(machine_id, events)`` pairs, they are split into chunks and sent to
+    the process pool, the compiled chart is sent to every worker once::
+
+        replayer = HSMEReplayer(chart, processes=8)
+        for result in replayer.run(read_event_logs()):
+            save(result.machine_id, result.state, result.history)
+        print(replayer.stats)
+
+    Every machine is started and then all its events are sent one by one,
+    inappropriate events are skipped and reported in the ``rejected`` list
+    of ``(index, event)`` pairs. Results are ``HSMEReplayResult`` tuples,
+    streamed in the order of completion, not in the order of records.
+
+    :param chart: ``HSMEStateChart`` instance.
+    :param processes: number of worker processes, all CPU cores by default,
+        ``1`` to replay in the current process.
+    :param chunksize: number of records sent to the worker at once.
+    :param runner_cls: ``HSMERunner`` class used by the workers.
+    :param runner_kwargs: ``runner_cls`` arguments like ``trigger_source``
+        or ``history_limit``, have to be picklable.
+    """
+
+    def __init__(
+        self,
+        chart,
+        processes=None,
+        chunksize=256,
+        runner_cls=HSMERunner,
+        runner_kwargs=None,
+    ):
+        self.chart = chart
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunksize = chunksize
+        self.runner_cls = runner_cls
+        self.runner_kwargs = runner_kwargs or {}
+        self.stats = HSMEReplayStats()
+
+    def run(self, records):
+        """Replays the records.
+
+        :param records: iterable of ``(machine_id, events)`` pairs.
+        :returns: generator of ``HSMEReplayResult`` tuples.
+        """
+        self.stats = HSMEReplayStats()
+        chunks = _get_chunks(records, self.chunksize)
+        initargs = (self.chart, self.runner_cls, self.runner_kwargs)
+        started_at = time.time()
+
+        if self.processes == 1:
+            _init_worker(*initargs)
+            for chunk in chunks:
+                for result in self._collect(_replay_chunk(chunk), started_at):
+                    yield result
+            return
+
+        pool = multiprocessing.Pool(
+            self.processes,
+            initializer=_init_worker,
+            initargs=initargs,
+        )
+        try:
+            for chunk_result in pool.imap_unordered(_replay_chunk, chunks):
+                for result in self._collect(chunk_result, started_at):
+                    yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _collect(self, chunk_result, started_at):
+        results, events_count = chunk_result
+        stats = self.stats
+        stats.records += len(results)
+        stats.events += events_count
+        stats.rejected += sum(len(r.rejected) for r in results)
+        stats.elapsed = time.time() - started_at
+        return results
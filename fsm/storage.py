@@ -0,0 +1,216 @@
+# coding: utf-8
+import json
+import sqlite3
+
+from fsm.core import HSMERunner, HSMERunnerError
+
+
+class HSMEStorage(object):
+    """Persistence layer interface for machine snapshots. Machines are saved
+    as compact dumps (see :meth:`HSMERunner.dump`) keyed by some machine id,
+    the charts they reference are saved once, next to them, so any process
+    can load the machine back::
+
+        storage.save(order.id, hsme)
+        ...
+        hsme = storage.load(order.id)
+
+    Implementations may buffer writes, :meth:`flush` has to be called to
+    be sure everything is written.
+    """
+
+    def save(self, machine_id, runner):
+        """Saves (or schedules saving of) the machine snapshot.
+
+        :param machine_id: some machine id.
+        :param runner: loaded ``HSMERunner`` instance.
+        """
+        raise NotImplementedError
+
+    def load(self, machine_id, runner=None):
+        """Loads the machine snapshot.
+
+        :param machine_id: some machine id.
+        :param runner: ``HSMERunner`` instance to load the snapshot into,
+            a new one by default.
+        :returns: loaded runner.
+        :raises: ``KeyError`` if no such machine saved.
+        """
+        raise NotImplementedError
+
+    def load_many(self, machine_ids, runner_factory=HSMERunner):
+        """Loads many machines at once.
+
+        :param machine_ids: iterable of machine ids.
+        :param runner_factory: a callable returning new ``HSMERunner``.
+        :returns: ``{machine_id: runner}`` dict, unknown ids are skipped.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        """Writes all buffered snapshots."""
+
+    def close(self):
+        """Flushes and releases the resources."""
+        self.flush()
+
+
+class HSMESQLiteStorage(HSMEStorage):
+    """``HSMEStorage`` reference implementation on top of SQLite. Snapshots
+    are buffered and written with one transaction per ``batch_size``
+    machines (the latest snapshot of the machine wins), the connection is
+    opened once and reused::
+
+        storage = HSMESQLiteStorage('machines.db', batch_size=500)
+        for order_id, event in events:
+            hsme = storage.load(order_id)
+            hsme.send(event)
+            storage.save(order_id, hsme)
+        storage.close()
+
+    Buffered snapshots are visible to :meth:`load` and :meth:`load_many`
+    of the same storage instance. The storage is not thread-safe, use one
+    instance per thread.
+
+    :param database: SQLite database path or ``sqlite3.Connection``.
+    :param batch_size: number of buffered snapshots to write at once,
+        ``1`` to write every snapshot immediately.
+    :param serializer: some callable, ``json.dumps`` replacement.
+    :param deserializer: some callable, ``json.loads`` replacement.
+    """
+
+    SCHEMA = (
+        'create table if not exists hsme_charts ('
+        'chart_id text primary key, chart text not null)',
+        'create table if not exists hsme_machines ('
+        'machine_id primary key, chart_id text not null, '
+        'snapshot text not null)',
+    )
+    MAX_VARIABLES = 500
+
+    def __init__(
+        self,
+        database=':memory:',
+        batch_size=100,
+        serializer=None,
+        deserializer=None,
+    ):
+        if isinstance(database, sqlite3.Connection):
+            self.connection = database
+        else:
+            self.connection = sqlite3.connect(database)
+        self.batch_size = batch_size
+        self.serializer = serializer or json.dumps
+        self.deserializer = deserializer or json.loads
+        self._pending = {}
+        self._pending_charts = {}
+        self._saved_charts = set()
+
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+
+    def __repr__(self):
+        return 'HSMESQLiteStorage: {0} pending'.format(len(self._pending))
+
+    def save(self, machine_id, runner):
+        chart = runner.model.chart
+        if chart.chart_id not in self._saved_charts:
+            self._pending_charts[chart.chart_id] = chart
+        self._pending[machine_id] = (
+            chart.chart_id,
+            runner.dump(serializer=self.serializer, compact=True),
+        )
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not (self._pending or self._pending_charts):
+            return
+
+        with self.connection:
+            if self._pending_charts:
+                self.connection.executemany(
+                    'insert or ignore into hsme_charts values (?, ?)',
+                    [
+                        (chart_id, self.serializer(chart.as_dict()))
+                        for chart_id, chart in self._pending_charts.items()
+                    ]
+                )
+            self.connection.executemany(
+                'insert or replace into hsme_machines values (?, ?, ?)',
+                [
+                    (machine_id, chart_id, snapshot)
+                    for machine_id, (chart_id, snapshot)
+                    in self._pending.items()
+                ]
+            )
+
+        self._saved_charts.update(self._pending_charts)
+        self._pending_charts.clear()
+        self._pending.clear()
+
+    def load(self, machine_id, runner=None):
+        runner = runner if runner is not None else HSMERunner()
+        if machine_id in self._pending:
+            chart_id, snapshot = self._pending[machine_id]
+        else:
+            row = self.connection.execute(
+                'select chart_id, snapshot from hsme_machines '
+                'where machine_id = ?',
+                (machine_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(machine_id)
+            chart_id, snapshot = row
+
+        return self._load_snapshot(runner, chart_id, snapshot)
+
+    def load_many(self, machine_ids, runner_factory=HSMERunner):
+        machine_ids = list(machine_ids)
+        rows = [
+            (machine_id,) + self._pending[machine_id]
+            for machine_id in machine_ids
+            if machine_id in self._pending
+        ]
+        stored_ids = [i for i in machine_ids if i not in self._pending]
+        for offset in range(0, len(stored_ids), self.MAX_VARIABLES):
+            chunk = stored_ids[offset:offset + self.MAX_VARIABLES]
+            rows.extend(self.connection.execute(
+                'select machine_id, chart_id, snapshot from hsme_machines '
+                'where machine_id in ({0})'.format(','.join('?' * len(chunk))),
+                chunk
+            ))
+
+        return dict(
+            (
+                machine_id,
+                self._load_snapshot(runner_factory(), chart_id, snapshot),
+            )
+            for machine_id, chart_id, snapshot in rows
+        )
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def _load_snapshot(self, runner, chart_id, snapshot):
+        if chart_id not in runner.registry:
+            runner.registry.add(self._get_chart(runner, chart_id))
+        return runner.load(snapshot, deserializer=self.deserializer)
+
+    def _get_chart(self, runner, chart_id):
+        chart = self._pending_charts.get(chart_id)
+        if chart is not None:
+            return chart
+
+        row = self.connection.execute(
+            'select chart from hsme_charts where chart_id = ?',
+            (chart_id,)
+        ).fetchone()
+        if row is None:
+            raise HSMERunnerError('Unknown chart {0}'.format(chart_id))
+        self._saved_charts.add(chart_id)
+        return runner.LAZY_STATE_CHART_CLS.as_obj(
+            self.deserializer(row[0])
+        )
@@ -0,0 +1,87 @@
+# coding: utf-8
+from array import array
+
+
+class HSMETransitionTable(object):
+    """Integer encoded, dense transition map compiled from ``HSMEStateChart``.
+    Every state and every event gets an id (its index in the ``states`` and
+    ``events`` tuples) and the destination state id of each transition is
+    stored in a flat array, one row per state::
+
+        table = HSMETransitionTable.compile(chart)
+        src_id = table.state_ids['one']
+        event_id = table.event_ids[True]
+        table.states[table.lookup(src_id, event_id)].name == 'two'
+
+    Cells without transition are marked with ``NO_TRANSITION``. The array
+    item size depends on the number of states, a chart with hundreds of
+    states takes two bytes per cell.
+
+    :param states: tuple of ``HSMEState`` instances, ordered by id.
+    :param events: tuple of events, ordered by id.
+    :param table: ``array`` of destination state ids.
+    """
+
+    NO_TRANSITION = -1
+
+    def __init__(self, states, events, table):
+        self.states = states
+        self.events = events
+        self.table = table
+        self.width = len(events)
+        self.state_ids = dict((s.name, i) for i, s in enumerate(states))
+        self.event_ids = dict((e, i) for i, e in enumerate(events))
+
+    def __repr__(self):
+        return 'HSMETransitionTable: {0}x{1}'.format(
+            len(self.states), self.width
+        )
+
+    @staticmethod
+    def get_typecode(size):
+        for typecode in ('b', 'h', 'i', 'l'):
+            if size <= 2 ** (array(typecode).itemsize * 8 - 1) - 1:
+                return typecode
+        raise ValueError('Too many states: {0}'.format(size))
+
+    @classmethod
+    def compile(cls, chart):
+        """The ``HSMETransitionTable`` factory.
+
+        :param chart: ``HSMEStateChart`` instance.
+        :returns: ``HSMETransitionTable`` instance.
+        """
+        states = tuple(chart.states.values())
+        events = tuple(chart.statechart)
+        state_ids = dict((s.name, i) for i, s in enumerate(states))
+
+        width = len(events)
+        table = array(
+            cls.get_typecode(len(states)),
+            [cls.NO_TRANSITION],
+        ) * (len(states) * width)
+        for event_id, event in enumerate(events):
+            for src, dst in chart.statechart[event].items():
+                table[state_ids[src.name] * width + event_id] = (
+                    state_ids[dst.name]
+                )
+
+        return cls(states, events, table)
+
+    def lookup(self, state_id, event_id):
+        """Destination state id of the transition.
+
+        :param state_id: source state id.
+        :param event_id: event id.
+        :returns: state id or ``NO_TRANSITION``.
+        """
+        return self.table[state_id * self.width + event_id]
+
+    def get_row(self, state_id):
+        """All transitions of the state, indexed by event id.
+
+        :param state_id: state id.
+        :returns: ``array`` of destination state ids.
+        """
+        offset = state_id * self.width
+        return self.table[offset:offset + self.width]
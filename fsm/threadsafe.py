@@ -0,0 +1,137 @@
+# coding: utf-8
+import threading
+from collections import deque
+
+from fsm.core import HSMERunner
+
+try:
+    from threading import get_ident
+except ImportError:  # Python 2
+    from thread import get_ident
+
+
+class _HSMELetter(object):
+    __slots__ = ('method', 'args', 'done', 'result', 'error', 'followups')
+
+    def __init__(self, method, args):
+        self.method = method
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followups = []
+
+    def deliver(self, runner):
+        try:
+            self.result = self.method(runner, *self.args)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def get(self):
+        # Letters posted while delivering this one are waited for as well,
+        # their errors are raised from here, the first one.
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        for letter in self.followups:
+            letter.get()
+        return self.result
+
+
+class HSMEThreadSafeRunner(HSMERunner):
+    """``HSMERunner`` that can be driven from several threads. Every call
+    that changes the machine (:meth:`start`, :meth:`send`,
+    :meth:`send_many`, :meth:`load`) or reads it as a whole (:meth:`dump`)
+    is put into the per-machine mailbox and the mailbox is processed
+    strictly one call at a time, each to completion, including the trigger
+    chain. There is no dedicated
+    thread, the mailbox is processed by the calling thread that got the
+    machine lock first, the others wait for their results::
+
+        hsme = HSMEThreadSafeRunner(trigger_source=trigger_source)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+
+        with ThreadPoolExecutor(8) as pool:
+            pool.map(hsme.send, events)
+
+    The lock is per machine, different machines are processed in parallel.
+    Events sent to the machine from its own triggers or actions are queued
+    and processed after the current transition, ``send`` returns None
+    for them. Their errors are raised from the call that caused them, once
+    they are processed (the result of that call is lost then). Avoid
+    waiting on other
+    machines from actions, two machines sending to each other from
+    different threads can deadlock.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(HSMEThreadSafeRunner, self).__init__(*args, **kwargs)
+        self._mailbox = deque()
+        self._lock = threading.Lock()
+        self._owner = None
+        self._delivering = None
+
+    def __getstate__(self):
+        state = super(HSMEThreadSafeRunner, self).__getstate__()
+        for name in ('_mailbox', '_lock', '_owner', '_delivering'):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        super(HSMEThreadSafeRunner, self).__setstate__(state)
+        self._mailbox = deque()
+        self._lock = threading.Lock()
+        self._owner = None
+        self._delivering = None
+
+    def load(self, model=None, deserializer=None, deltas=None):
+        """See :meth:`HSMERunner.load`."""
+        return self._post(HSMERunner.load, (model, deserializer, deltas))
+
+    def dump(self, serializer=None, compact=False, delta=False, binary=False):
+        """See :meth:`HSMERunner.dump`."""
+        return self._post(
+            HSMERunner.dump, (serializer, compact, delta, binary)
+        )
+
+    def start(self, payload=None):
+        """See :meth:`HSMERunner.start`."""
+        return self._post(HSMERunner.start, (payload,))
+
+    def send(self, event_name, payload=None):
+        """See :meth:`HSMERunner.send`."""
+        return self._post(HSMERunner.send, (event_name, payload))
+
+    def send_many(self, events, payload=None):
+        """See :meth:`HSMERunner.send_many`."""
+        return self._post(HSMERunner.send_many, (events, payload))
+
+    def _post(self, method, args):
+        letter = _HSMELetter(method, args)
+        self._mailbox.append(letter)
+        if self._owner == get_ident():
+            self._delivering.followups.append(letter)
+            return None
+
+        self._process_mailbox()
+        return letter.get()
+
+    def _process_mailbox(self):
+        # The owner re-checks the mailbox after the lock release, so a letter
+        # posted while the lock was busy is never left behind.
+        mailbox = self._mailbox
+        while mailbox:
+            if not self._lock.acquire(False):
+                return
+            try:
+                self._owner = get_ident()
+                while mailbox:
+                    self._delivering = mailbox.popleft()
+                    self._delivering.deliver(self)
+            finally:
+                self._owner = None
+                self._delivering = None
+                self._lock.release()
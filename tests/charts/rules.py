@@ -98,6 +98,21 @@ BROKEN_RULES_CHART = [
 ]
 
 
+MISSING_DESTINATION_RULES_CHART = [
+    {
+        'state': 'one',
+        'is_initial': True,
+        'events': {
+            True: 'two',
+            False: 'seven',
+        },
+    },
+    {
+        'state': 'two',
+    },
+]
+
+
 MULTIPLE_TRIGGERS_RULES_CHART = [
     {
         'state': 'one',
@@ -115,3 +130,141 @@ MULTIPLE_TRIGGERS_RULES_CHART = [
         'state': 'three',
     },
 ]
+
+
+LOOP_TRIGGERS_RULES_CHART = [
+    {
+        'state': 'one',
+        'is_initial': True,
+        'trigger': 1,
+        'events': {
+            True: 'two',
+        },
+    },
+    {
+        'state': 'two',
+        'trigger': 1,
+        'events': {
+            True: 'one',
+            False: 'three',
+        },
+    },
+    {
+        'state': 'three',
+    },
+]
+
+
+def get_chain_rules_chart(length):
+    chart = [
+        {
+            'state': i,
+            'trigger': 1,
+            'events': {
+                True: i + 1,
+            },
+        }
+        for i in range(length)
+    ]
+    chart[0]['is_initial'] = True
+    chart.append({'state': length})
+    return chart
+
+
+PING_PONG_RULES_CHART = [
+    {
+        'state': 'ping',
+        'is_initial': True,
+        'events': {
+            'next': 'pong',
+        },
+    },
+    {
+        'state': 'pong',
+        'action': 1,
+        'events': {
+            'next': 'ping',
+        },
+    },
+]
+
+
+HIERARCHICAL_RULES_CHART = [
+    {
+        'state': 'order',
+        'is_initial': True,
+        'initial': 'new',
+        'events': {
+            'cancel': 'cancelled',
+            'reset': 'order',
+        },
+    },
+    {
+        'state': 'new',
+        'parent': 'order',
+        'events': {
+            'pay': 'payment',
+        },
+    },
+    {
+        'state': 'payment',
+        'parent': 'order',
+        'initial': 'pending',
+        'events': {
+            'refund': 'new',
+        },
+    },
+    {
+        'state': 'pending',
+        'parent': 'payment',
+        'events': {
+            'confirm': 'paid',
+        },
+    },
+    {
+        'state': 'paid',
+        'parent': 'payment',
+        'events': {
+            'cancel': 'refunded',
+        },
+    },
+    {
+        'state': 'cancelled',
+    },
+    {
+        'state': 'refunded',
+    },
+]
+
+
+GUARDED_RULES_CHART = [
+    {
+        'state': 'check',
+        'is_initial': True,
+        'events': {
+            'submit': [
+                {'guards': ['is_vip'], 'to': 'approved'},
+                {'guards': ['has_credit', 'is_verified'], 'to': 'review'},
+                {'guards': ['is_verified'], 'to': 'rejected'},
+                'rejected',
+            ],
+            'skip': 'approved',
+        },
+    },
+    {
+        'state': 'review',
+        'trigger': 'review',
+        'events': {
+            'auto': [
+                {'guards': ['is_vip'], 'to': 'approved'},
+                'rejected',
+            ],
+        },
+    },
+    {
+        'state': 'approved',
+    },
+    {
+        'state': 'rejected',
+    },
+]
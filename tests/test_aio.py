@@ -0,0 +1,177 @@
+# coding: utf-8
+import asyncio
+
+import pytest
+
+from fsm.aio import AsyncHSMERunner
+from fsm.cache import HSMETriggerCache
+from fsm.metrics import HSMEMetrics
+from fsm.core import (
+    HSMERunner,
+    HSMERunnerError,
+    HSMEWrongEventError,
+    HSMEWrongTriggerError,
+)
+from .charts.rules import RULES_CHART
+from .test_process import TRIGGERS_MAP
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def async_trigger_source(proxy, trigger_id):
+    await asyncio.sleep(0)
+    return TRIGGERS_MAP[trigger_id](proxy)
+
+
+class TestAsyncHSMERunner(object):
+
+    def test_transition_flow(self):
+        async def flow():
+            hsme = AsyncHSMERunner()
+            with pytest.raises(HSMERunnerError):
+                await hsme.start()
+
+            hsme.parse(RULES_CHART)
+            with pytest.raises(HSMERunnerError):
+                await hsme.send(True)
+
+            assert await hsme.start()
+            assert not await hsme.start()
+            assert await hsme.send(True)
+            assert hsme.in_state('two')
+
+            with pytest.raises(HSMEWrongEventError):
+                await hsme.send('wrong_event')
+
+        run(flow())
+
+    def test_triggers_and_actions_flow(self):
+        actions = []
+
+        async def action_source(proxy, action_id):
+            await asyncio.sleep(0)
+            actions.append((proxy.dst.name, action_id))
+
+        async def flow():
+            hsme = AsyncHSMERunner(
+                trigger_source=async_trigger_source,
+                action_source=action_source,
+            )
+            hsme.parse(RULES_CHART)
+            await hsme.start()
+            return hsme
+
+        hsme = run(flow())
+        assert hsme.in_state('five')
+        assert actions == [('five', 2)]
+        assert [h.state for h in hsme.model.history] == ['one', 'two', 'five']
+
+    def test_trigger_cache(self):
+        calls = []
+
+        async def trigger_source(proxy, trigger_id):
+            calls.append(trigger_id)
+            return await async_trigger_source(proxy, trigger_id)
+
+        async def flow():
+            cache = HSMETriggerCache()
+            for _ in range(3):
+                hsme = AsyncHSMERunner(
+                    trigger_source=trigger_source,
+                    trigger_cache=cache,
+                )
+                hsme.parse(RULES_CHART)
+                await hsme.start()
+            return hsme, cache
+
+        hsme, cache = run(flow())
+        assert hsme.in_state('five')
+        assert calls == [1, 2]
+        assert cache.info().hits == 4
+
+    def test_metrics(self):
+        metrics = HSMEMetrics()
+        hsme = AsyncHSMERunner(
+            trigger_source=async_trigger_source,
+            metrics=metrics,
+        )
+        hsme.parse(RULES_CHART)
+        run(hsme.start())
+        assert hsme.in_state('five')
+
+        with pytest.raises(HSMEWrongEventError):
+            run(hsme.send('nope'))
+        snapshot = metrics.snapshot()
+        assert sorted(snapshot['state']) == ['five', 'one', 'two']
+        assert sorted(snapshot['trigger']) == [1, 2]
+        assert snapshot['rejected']['event'] == {'nope': 1}
+
+    def test_wrong_triggers_flow(self):
+        hsme = AsyncHSMERunner(trigger_source=lambda proxy, i: 'wrong_event')
+        hsme.parse(RULES_CHART)
+
+        with pytest.raises(HSMEWrongTriggerError):
+            run(hsme.start())
+
+    def test_concurrent_machines(self):
+        async def flow():
+            machines = [
+                AsyncHSMERunner(trigger_source=async_trigger_source)
+                for _ in range(100)
+            ]
+            for hsme in machines:
+                hsme.parse(RULES_CHART)
+            await asyncio.gather(*[hsme.start() for hsme in machines])
+            return machines
+
+        machines = run(flow())
+        assert all(hsme.in_state('five') for hsme in machines)
+        assert len(set(id(hsme.model.chart) for hsme in machines)) == 1
+
+    def test_send_many_flow(self):
+        hsme = AsyncHSMERunner()
+        hsme.parse(RULES_CHART)
+        run(hsme.start())
+
+        with pytest.raises(HSMEWrongEventError):
+            run(hsme.send_many([False, True, True]))
+        assert hsme.in_state('one')
+
+        assert run(hsme.send_many([False, True]))
+        assert hsme.in_state('six')
+        assert len(hsme.model.history) == 3
+
+    def test_send_many_cancelled(self):
+        async def action_source(proxy, action_id):
+            await asyncio.sleep(1)
+
+        hsme = AsyncHSMERunner(action_source=action_source)
+        hsme.parse(RULES_CHART)
+
+        async def flow():
+            await hsme.start()
+            await asyncio.wait_for(hsme.send_many([False, True]), 0.01)
+
+        with pytest.raises(asyncio.TimeoutError):
+            run(flow())
+        assert hsme.in_state('one')
+        assert [h.state for h in hsme.model.history] == ['one']
+
+    def test_sync_interop(self):
+        hsme = HSMERunner()
+        hsme.parse(RULES_CHART)
+        hsme.start()
+
+        async_hsme = AsyncHSMERunner().load(hsme.dump())
+        run(async_hsme.send(False))
+        assert async_hsme.in_state('three')
+
+        hsme.load(async_hsme.dump())
+        hsme.send(True)
+        assert hsme.in_state('six')
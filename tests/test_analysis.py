@@ -0,0 +1,122 @@
+# coding: utf-8
+import pytest
+
+from fsm.analysis import HSMEChartIndex
+from fsm.core import HSMERunner, HSMERunnerError
+from fsm.parsers import HSMEDictsParser
+from fsm.registry import HSMEChartRegistry
+from .charts.rules import (
+    HIERARCHICAL_RULES_CHART,
+    LOOP_TRIGGERS_RULES_CHART,
+    PING_PONG_RULES_CHART,
+    RULES_CHART,
+    get_chain_rules_chart,
+)
+
+
+class TestHSMEChartIndex(object):
+
+    def test_acyclic_chart(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        index = chart.index
+        assert isinstance(index, HSMEChartIndex)
+        assert chart.index is index
+
+        assert len(index.components) == 6
+        assert index.components[-1] == ('one',)
+        assert index.final_states == frozenset(['four', 'five', 'six'])
+        assert index.trigger_loops == []
+        assert all(index.can_finish(name) for name in index.states)
+
+        assert index.can_reach('one', 'six')
+        assert index.can_reach('two', 'two')
+        assert not index.can_reach('two', 'six')
+        assert not index.can_reach('six', 'one')
+        assert not index.can_reach('one', 'seven')
+
+    def test_cycles(self):
+        index = HSMEChartIndex.compile(
+            HSMEDictsParser(LOOP_TRIGGERS_RULES_CHART).parse()
+        )
+        assert index.get_component('one') == index.get_component('two')
+        assert sorted(index.get_component('one')) == ['one', 'two']
+        assert index.trigger_loops == [('one', 'two')]
+        assert index.can_reach('two', 'one')
+        assert index.can_finish('one')
+
+        index = HSMEChartIndex.compile(
+            HSMEDictsParser(PING_PONG_RULES_CHART).parse()
+        )
+        assert len(index.components) == 1
+        assert index.trigger_loops == []
+        assert not index.can_finish('ping')
+
+    def test_deep_chart(self):
+        index = HSMEDictsParser(get_chain_rules_chart(5000)).parse().index
+        assert len(index.components) == 5001
+        assert index.trigger_loops == []
+        assert index.can_reach(0, 5000)
+        assert not index.can_reach(5000, 0)
+
+        index.REACH_MEMO_SIZE = 2
+        assert index.can_reach(10, 20)
+        assert not index.can_reach(20, 10)
+        assert index.can_reach(10, 20)
+        assert len(index._reach) == 2
+
+    def test_composite_states(self):
+        index = HSMEDictsParser(HIERARCHICAL_RULES_CHART).parse().index
+        assert set(index.composites) == set(['order', 'payment'])
+        assert set(index.composites['payment']) == set(['pending', 'paid'])
+
+        assert index.can_reach('new', 'payment')
+        assert index.can_reach('paid', 'payment')
+        assert not index.can_reach('cancelled', 'payment')
+        assert index.can_reach('payment', 'refunded')
+        assert index.can_reach('payment', 'order')
+        assert not index.can_reach('order', 'nowhere')
+        assert index.can_finish('payment')
+        assert index.can_finish('order')
+
+
+class TestHSMERunnerAnalysis(object):
+
+    def test_queries(self):
+        hsme = HSMERunner(registry=HSMEChartRegistry()).parse(RULES_CHART)
+        with pytest.raises(HSMERunnerError):
+            hsme.can_reach('six')
+
+        hsme.start()
+        assert hsme.can_reach('six')
+        assert hsme.can_finish()
+        assert not hsme.is_finished()
+
+        hsme.send(True)
+        assert not hsme.can_reach('six')
+        hsme.send(False)
+        assert hsme.is_finished()
+
+    def test_composite_queries(self):
+        hsme = HSMERunner(registry=HSMEChartRegistry())
+        hsme.parse(HIERARCHICAL_RULES_CHART)
+        hsme.start()
+        assert hsme.in_state('order')
+        assert hsme.can_reach('payment')
+
+        hsme.send('pay')
+        assert hsme.in_state('payment')
+        assert hsme.can_reach('payment')
+
+        hsme.send('cancel')
+        assert not hsme.in_state('payment')
+        assert not hsme.can_reach('payment')
+
+    def test_reject_trigger_loops(self):
+        hsme = HSMERunner(
+            registry=HSMEChartRegistry(),
+            reject_trigger_loops=True,
+        )
+        hsme.parse(PING_PONG_RULES_CHART)
+        with pytest.raises(HSMERunnerError):
+            hsme.parse(LOOP_TRIGGERS_RULES_CHART)
+        assert not hsme.is_loaded()
@@ -0,0 +1,105 @@
+# coding: utf-8
+import pickle
+
+from fsm.cache import HSMETriggerCache
+from fsm.core import HSMERunner
+from .charts.rules import MULTIPLE_TRIGGERS_RULES_CHART, RULES_CHART
+from .test_process import TRIGGERS_MAP
+
+
+class CountingTriggerSource(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, proxy, trigger_id):
+        self.calls.append(trigger_id)
+        if isinstance(trigger_id, list):
+            return False
+        return TRIGGERS_MAP[trigger_id](proxy)
+
+
+class TestHSMETriggerCache(object):
+
+    def run_machines(self, cache, count=10, chart=RULES_CHART, payload=None):
+        trigger_source = CountingTriggerSource()
+        for _ in range(count):
+            hsme = HSMERunner(
+                trigger_source=trigger_source,
+                trigger_cache=cache,
+            )
+            hsme.parse(chart)
+            hsme.start(payload)
+        return hsme, trigger_source
+
+    def test_cached_chain(self):
+        cache = HSMETriggerCache()
+        hsme, trigger_source = self.run_machines(cache)
+
+        assert hsme.in_state('five')
+        assert trigger_source.calls == [1, 2]
+        assert cache.info().hits == 18
+        assert cache.info().misses == 2
+        assert cache.info().currsize == 2
+        assert cache.hit_rate == 0.9
+
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.info().hits == 0
+
+    def test_keys(self):
+        cache = HSMETriggerCache(key=lambda proxy: proxy.payload['user_id'])
+        _, trigger_source = self.run_machines(cache, payload={'user_id': 1})
+        self.run_machines(cache, payload={'user_id': 2})
+        assert len(cache) == 4
+        assert trigger_source.calls == [1, 2]
+
+        cache = HSMETriggerCache()
+        _, trigger_source = self.run_machines(
+            cache, chart=MULTIPLE_TRIGGERS_RULES_CHART,
+        )
+        assert trigger_source.calls == [[2, 1]]
+
+    def test_unhashable_payload(self):
+        cache = HSMETriggerCache()
+        hsme, trigger_source = self.run_machines(
+            cache, count=3, payload={'user_id': 1},
+        )
+        assert hsme.in_state('five')
+        assert trigger_source.calls == [1, 2, 1, 2, 1, 2]
+        assert len(cache) == 0
+        assert cache.info().misses == 6
+
+    def test_disabled(self):
+        cache = HSMETriggerCache(disabled=[1])
+        _, trigger_source = self.run_machines(cache, count=3)
+        assert trigger_source.calls == [1, 2, 1, 1]
+
+        cache.disable(2)
+        assert len(cache) == 0
+        cache.enable(1)
+        _, trigger_source = self.run_machines(cache, count=3)
+        assert trigger_source.calls == [1, 2, 2, 2]
+
+    def test_eviction(self):
+        now = [0]
+        cache = HSMETriggerCache(maxsize=1, ttl=10, clock=lambda: now[0])
+        _, trigger_source = self.run_machines(cache, count=2)
+        assert len(cache) == 1
+        assert trigger_source.calls == [1, 2, 1, 2]
+
+        cache = HSMETriggerCache(ttl=10, clock=lambda: now[0])
+        _, trigger_source = self.run_machines(cache, count=2)
+        assert trigger_source.calls == [1, 2]
+        now[0] = 10
+        _, trigger_source = self.run_machines(cache, count=1)
+        assert trigger_source.calls == [1, 2]
+        assert cache.info().misses == 4
+
+    def test_pickle(self):
+        cache = HSMETriggerCache()
+        self.run_machines(cache, count=1)
+        cache = pickle.loads(pickle.dumps(cache))
+        assert len(cache) == 2
+        _, trigger_source = self.run_machines(cache, count=1)
+        assert trigger_source.calls == []
@@ -0,0 +1,94 @@
+# coding: utf-8
+import pickle
+
+import pytest
+
+from fsm import codec
+from fsm.core import HSMERunner, HSMERunnerError
+from fsm.parsers import HSMEDictsParser, HSMESession, HSMEStateChart
+from fsm.registry import HSMEChartRegistry
+from .charts.rules import RULES_CHART, SIMPLE_RULES_CHART
+
+
+class TestHSMECodec(object):
+
+    def test_chart(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        data = chart.as_bytes()
+
+        assert data.startswith(codec.MAGIC)
+        assert codec.get_chart_id(data) == chart.chart_id
+
+        decoded_chart = HSMEStateChart.from_bytes(data)
+        assert decoded_chart == chart
+        assert decoded_chart.chart_id == chart.chart_id
+        assert decoded_chart.as_dict() == chart.as_dict()
+        one = decoded_chart.states['one']
+        assert decoded_chart.statechart[True][one] is (
+            decoded_chart.states['two']
+        )
+
+    def test_session(self):
+        hsme = HSMERunner().parse(RULES_CHART)
+        hsme.start()
+        hsme.send(True)
+        data = hsme.model.as_bytes()
+
+        session = HSMESession.from_bytes(data, hsme.model.chart)
+        assert session == hsme.model
+        assert session.history[0].state == 'one'
+        assert session.current_state is hsme.model.chart.states['two']
+
+        other_chart = HSMEDictsParser(SIMPLE_RULES_CHART).parse()
+        with pytest.raises(codec.HSMECodecError):
+            HSMESession.from_bytes(data, other_chart)
+
+    def test_broken_data(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        data = chart.as_bytes()
+
+        with pytest.raises(codec.HSMECodecError):
+            HSMEStateChart.from_bytes(b'JSON' + data[4:])
+        with pytest.raises(codec.HSMECodecError):
+            HSMEStateChart.from_bytes(data[:4] + b'\xff' + data[5:])
+        with pytest.raises(codec.HSMECodecError):
+            HSMEStateChart.from_bytes(data[:len(data) // 2])
+        with pytest.raises(codec.HSMECodecError):
+            HSMEStateChart.from_bytes(data[:-4] + b'\xff' * 4)
+        with pytest.raises(codec.HSMECodecError):
+            HSMESession.from_bytes(data, chart)
+
+    def test_binary_dump(self):
+        registry = HSMEChartRegistry()
+        hsme = HSMERunner(registry=registry).parse(RULES_CHART)
+        hsme.start()
+        hsme.send(True)
+        data = hsme.dump(binary=True)
+        assert len(data) < len(hsme.dump(compact=True))
+
+        hsme_2 = HSMERunner(registry=registry).load(data)
+        assert hsme_2.model == hsme.model
+        assert hsme_2.model.chart is hsme.model.chart
+        assert hsme_2.current_state.name == 'two'
+
+        with pytest.raises(HSMERunnerError):
+            HSMERunner(registry=HSMEChartRegistry()).load(data)
+
+    def test_pickle(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        assert pickle.loads(pickle.dumps(chart)) == chart
+
+        hsme = HSMERunner().load(chart)
+        hsme.start()
+        hsme.send(True)
+        assert pickle.loads(pickle.dumps(hsme.model)) == hsme.model
+
+        hsme_2 = pickle.loads(pickle.dumps(hsme, pickle.HIGHEST_PROTOCOL))
+        assert hsme_2.model == hsme.model
+        assert hsme_2.model.chart is hsme.model.chart
+        assert hsme_2.send(False)
+        assert hsme_2.current_state.name == 'five'
+
+        hsme_3 = pickle.loads(pickle.dumps(HSMERunner()))
+        with pytest.raises(HSMERunnerError):
+            hsme_3.start()
@@ -0,0 +1,142 @@
+# coding: utf-8
+import pickle
+
+import pytest
+
+from fsm.core import HSMERunner, HSMEWrongEventError
+from fsm.listeners import HSMEListeners
+from .charts.rules import HIERARCHICAL_RULES_CHART, RULES_CHART
+from .test_process import event_trigger_source
+
+
+class Recorder(object):
+
+    def __init__(self, calls, name):
+        self.calls = calls
+        self.name = name
+
+    def __call__(self, proxy):
+        self.calls.append((
+            self.name,
+            proxy.src.name if proxy.src else None,
+            proxy.event,
+            proxy.dst.name,
+            proxy.fsm.current_state.name if proxy.fsm.current_state else None,
+        ))
+
+
+class TestHSMEListeners(object):
+
+    def test_dispatch(self):
+        calls = []
+        listeners = HSMEListeners()
+        listeners.on_exit(Recorder(calls, 'exit'))
+        listeners.on_enter(Recorder(calls, 'enter_two'), state='two')
+        listeners.on_transition(Recorder(calls, 'false'), event=False)
+        listeners.on_enter(Recorder(calls, 'enter'))
+        assert len(listeners) == 4
+
+        hsme = HSMERunner(
+            trigger_source=event_trigger_source,
+            listeners=listeners,
+        )
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        assert calls == [
+            ('enter', None, None, 'one', 'one'),
+            ('exit', 'one', True, 'two', 'one'),
+            ('enter_two', 'one', True, 'two', 'two'),
+            ('enter', 'one', True, 'two', 'two'),
+            ('exit', 'two', False, 'five', 'two'),
+            ('false', 'two', False, 'five', 'two'),
+            ('enter', 'two', False, 'five', 'five'),
+        ]
+
+    def test_remove(self):
+        calls = []
+        recorder = Recorder(calls, 'enter')
+        listeners = HSMEListeners()
+        listeners.on_enter(recorder)
+        listeners.on_enter(recorder, state='two')
+
+        hsme = HSMERunner(listeners=listeners)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        hsme.send(True)
+        assert [c[3] for c in calls] == ['one', 'two', 'two']
+
+        listeners.remove(recorder)
+        assert len(listeners) == 0
+        hsme.send(False)
+        assert len(calls) == 3
+
+    def test_failed_listener(self):
+        def fail(proxy):
+            raise ValueError(proxy.event)
+
+        listeners = HSMEListeners()
+        listeners.on_exit(fail, state='one')
+        hsme = HSMERunner(listeners=listeners)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        with pytest.raises(ValueError):
+            hsme.send(True)
+        assert hsme.in_state('one')
+        with pytest.raises(HSMEWrongEventError):
+            hsme.send('nope')
+
+    def test_no_listeners(self):
+        hsme = HSMERunner()
+        assert '_enter' not in hsme.__dict__
+
+        hsme = HSMERunner(listeners=HSMEListeners())
+        hsme.parse(RULES_CHART)
+        hsme_2 = pickle.loads(pickle.dumps(hsme))
+        assert isinstance(hsme_2.listeners, HSMEListeners)
+        assert '_enter' in hsme_2.__dict__
+        hsme_2.start()
+        assert hsme_2.in_state('one')
+
+    def test_switch(self):
+        calls = []
+        listeners = HSMEListeners()
+        listeners.on_enter(Recorder(calls, 'enter'))
+        hsme = HSMERunner()
+        hsme.parse(RULES_CHART)
+        hsme.listeners = listeners
+        hsme.start()
+        assert calls == [('enter', None, None, 'one', 'one')]
+
+        hsme.listeners = None
+        assert '_enter' not in hsme.__dict__
+        hsme.send(True)
+        assert len(calls) == 1
+
+    def test_composite_states(self):
+        calls = []
+        listeners = HSMEListeners()
+        listeners.on_enter(Recorder(calls, 'enter_order'), state='order')
+        listeners.on_enter(Recorder(calls, 'enter_payment'), state='payment')
+        listeners.on_enter(Recorder(calls, 'enter_paid'), state='paid')
+        listeners.on_exit(Recorder(calls, 'exit_payment'), state='payment')
+        listeners.on_exit(Recorder(calls, 'exit_order'), state='order')
+        hsme = HSMERunner(listeners=listeners)
+        hsme.parse(HIERARCHICAL_RULES_CHART)
+
+        hsme.start()
+        assert calls == [('enter_order', None, None, 'new', 'new')]
+
+        del calls[:]
+        hsme.send('pay')
+        assert calls == [('enter_payment', 'new', 'pay', 'pending', 'pending')]
+
+        del calls[:]
+        hsme.send('confirm')
+        assert calls == [('enter_paid', 'pending', 'confirm', 'paid', 'paid')]
+
+        del calls[:]
+        hsme.send('cancel')
+        assert calls == [
+            ('exit_payment', 'paid', 'cancel', 'refunded', 'paid'),
+            ('exit_order', 'paid', 'cancel', 'refunded', 'paid'),
+        ]
@@ -0,0 +1,139 @@
+# coding: utf-8
+import pickle
+
+import pytest
+
+from fsm.cache import HSMETriggerCache
+from fsm.core import HSMERunner, HSMEWrongEventError, HSMEWrongTriggerError
+from fsm.metrics import HSMEHistogram, HSMEMetrics
+from .charts.rules import RULES_CHART
+from .test_process import event_trigger_source
+
+
+def null_action_source(proxy, action_id):
+    return None
+
+
+class StepClock(object):
+
+    def __init__(self, step=0.001):
+        self.step = step
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+class TestHSMEMetrics(object):
+
+    def test_histogram(self):
+        histogram = HSMEHistogram(buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        assert histogram.count == 4
+        assert histogram.sum == pytest.approx(3.65)
+        assert histogram.get_cumulative() == [
+            (0.1, 2), (1.0, 3), (float('inf'), 4),
+        ]
+
+    def test_runner(self):
+        metrics = HSMEMetrics(clock=StepClock())
+        hsme = HSMERunner(
+            trigger_source=event_trigger_source,
+            action_source=null_action_source,
+            metrics=metrics,
+        )
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        assert hsme.in_state('five')
+
+        snapshot = metrics.snapshot()
+        assert snapshot['event'][None]['count'] == 1
+        assert sorted(snapshot['state']) == ['five', 'one', 'two']
+        assert sorted(snapshot['trigger']) == [1, 2]
+        assert sorted(snapshot['action']) == [2]
+        assert snapshot['event'][None]['sum'] == pytest.approx(
+            sum(data['sum'] for data in snapshot['state'].values())
+        )
+
+        with pytest.raises(HSMEWrongEventError):
+            hsme.send('nope')
+        assert metrics.snapshot()['rejected']['event'] == {'nope': 1}
+
+        text = metrics.as_prometheus()
+        assert '# TYPE hsme_event_seconds histogram' in text
+        assert 'hsme_state_seconds_count{state="one"} 1' in text
+        assert 'hsme_trigger_seconds_bucket{trigger="1",le="+Inf"} 1' in text
+        assert 'hsme_rejected_total{kind="event",event="nope"} 1' in text
+
+        hsme_2 = pickle.loads(pickle.dumps(hsme))
+        assert hsme_2.metrics.snapshot() == metrics.snapshot()
+        hsme_2.load(hsme.model.chart)
+        hsme_2.start()
+        assert hsme_2.metrics.snapshot()['event'][None]['count'] == 2
+
+        metrics.clear()
+        assert metrics.snapshot()['state'] == {}
+
+    def test_trigger_cache(self):
+        metrics = HSMEMetrics(clock=StepClock())
+        cache = HSMETriggerCache()
+        for _ in range(2):
+            hsme = HSMERunner(
+                trigger_source=event_trigger_source,
+                trigger_cache=cache,
+                metrics=metrics,
+            )
+            hsme.parse(RULES_CHART)
+            hsme.start()
+
+        snapshot = metrics.snapshot()
+        assert snapshot['trigger'][1]['count'] == 1
+        assert snapshot['state']['two']['count'] == 2
+        assert snapshot['event'][None]['sum'] == pytest.approx(
+            sum(data['sum'] for data in snapshot['state'].values())
+        )
+
+    def test_wrong_trigger(self):
+        metrics = HSMEMetrics()
+        hsme = HSMERunner(
+            trigger_source=lambda proxy, trigger_id: 'wrong_event',
+            metrics=metrics,
+        )
+        hsme.parse(RULES_CHART)
+        with pytest.raises(HSMEWrongTriggerError):
+            hsme.start()
+        assert metrics.snapshot()['rejected'] == {
+            'event': {},
+            'trigger': {'wrong_event': 1},
+        }
+
+    def test_disabled(self):
+        hsme = HSMERunner(trigger_source=event_trigger_source)
+        assert '_iter_transition' not in hsme.__dict__
+        assert '_get_send_proxy' not in hsme.__dict__
+
+    def test_send_many_rejected(self):
+        metrics = HSMEMetrics()
+        hsme = HSMERunner(metrics=metrics)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        with pytest.raises(HSMEWrongEventError):
+            hsme.send_many([True, 'nope'])
+        assert hsme.in_state('one')
+        assert metrics.snapshot()['rejected']['event'] == {'nope': 1}
+
+    def test_switch(self):
+        metrics = HSMEMetrics()
+        hsme = HSMERunner()
+        hsme.parse(RULES_CHART)
+        hsme.metrics = metrics
+        assert '_iter_transition' in hsme.__dict__
+        hsme.start()
+        assert metrics.snapshot()['event'][None]['count'] == 1
+
+        hsme.metrics = None
+        assert '_iter_transition' not in hsme.__dict__
+        hsme.send(True)
+        assert 'two' not in metrics.snapshot()['state']
@@ -1,14 +1,28 @@
 # coding: utf-8
+import io
+import json
+import pickle
+
 import pytest
 
+from fsm.core import HSMERunner
 from fsm.parsers import (
+    HSMEDecisionTable,
     HSMEDictsParser,
+    HSMELazyStateChart,
     HSMEParserError,
+    HSMEState,
     HSMEStateChart,
+    HSMEStreamParser,
 )
+from fsm.registry import HSMEChartRegistry
 from .charts.rules import (
     BROKEN_RULES_CHART,
+    GUARDED_RULES_CHART,
+    HIERARCHICAL_RULES_CHART,
+    MISSING_DESTINATION_RULES_CHART,
     NO_INITIAL_RULES_CHART,
+    PING_PONG_RULES_CHART,
     RULES_CHART,
     SIMPLE_RULES_CHART,
     TWO_INITIAL_RULES_CHART,
@@ -22,7 +36,7 @@ class TestHSMEDictParser(object):
         model = parser.parse()
         assert isinstance(model, parser.STATE_CHART_CLS)
         assert isinstance(model.initial_state, parser.STATE_CLS)
-        assert model.current_state is None
+        assert not hasattr(model, 'current_state')
         for state in model.final_states:
             assert isinstance(state, parser.STATE_CLS)
 
@@ -48,6 +62,11 @@ class TestHSMEDictParser(object):
         with pytest.raises(HSMEParserError):
             HSMEDictsParser(42)
 
+    def test_missing_destination_chart(self):
+        parser = HSMEDictsParser(MISSING_DESTINATION_RULES_CHART)
+        with pytest.raises(HSMEParserError):
+            parser.parse()
+
     def test_serialization(self):
         parser_1 = HSMEDictsParser(SIMPLE_RULES_CHART)
         model_1 = parser_1.parse()
@@ -57,3 +76,269 @@ class TestHSMEDictParser(object):
         model_2 = parser_2.parse()
 
         assert HSMEStateChart.as_obj(internal_struct) == model_2
+
+    def test_hierarchical_chart(self):
+        model = HSMEDictsParser(HIERARCHICAL_RULES_CHART).parse()
+
+        assert sorted(model.states) == [
+            'cancelled', 'new', 'paid', 'pending', 'refunded',
+        ]
+        assert model.initial_state is model.states['new']
+        assert model.initial_state.is_initial
+        assert model.states['new'].events == {
+            'pay': 'pending',
+            'cancel': 'cancelled',
+            'reset': 'new',
+        }
+        assert model.states['paid'].ancestors == ('payment', 'order')
+        assert model.states['paid'].events == {
+            'cancel': 'refunded',
+            'refund': 'new',
+            'reset': 'new',
+        }
+        assert model.statechart['refund'][model.states['pending']] is (
+            model.states['new']
+        )
+        assert not model.states['paid'].is_final
+
+        assert HSMEStateChart.as_obj(model.as_dict()) == model
+        decoded = HSMEStateChart.from_bytes(model.as_bytes())
+        assert decoded.states['paid'].ancestors == ('payment', 'order')
+
+    @pytest.mark.parametrize('changes', [
+        {'new': {'parent': 'nope'}},
+        {'order': {'parent': 'paid'}},
+        {'order': {'initial': None}},
+        {'payment': {'initial': 'new'}},
+        {'payment': {'trigger': 1}},
+        {'order': {'action': 1}},
+    ])
+    def test_invalid_hierarchical_chart(self, changes):
+        chart = [
+            dict(state, **changes.get(state['state'], {}))
+            for state in HIERARCHICAL_RULES_CHART
+        ]
+        with pytest.raises(HSMEParserError):
+            HSMEDictsParser(chart).parse()
+        with pytest.raises(HSMEParserError):
+            HSMEStreamParser(iter(chart)).parse()
+
+    def test_interned_states(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        loaded = HSMEStateChart.as_obj(chart.as_dict())
+        two = loaded.states['two']
+        assert loaded.statechart[True][loaded.states['one']] is two
+        assert loaded.statechart[True][two] is loaded.states['four']
+        assert two in loaded.statechart[False]
+        assert two != chart.states['two']
+        assert two.is_same(chart.states['two'])
+        assert not two.is_same(chart.states['three'])
+
+        with pytest.raises(AttributeError):
+            two.name = 'three'
+        with pytest.raises(AttributeError):
+            two.extra = 1
+        assert pickle.loads(pickle.dumps(two)).is_same(two)
+        with pytest.raises(TypeError):
+            two.events[True] = 'three'
+        with pytest.raises(TypeError):
+            two.decisions.update({})
+        assert json.loads(json.dumps(two.events)) == {
+            'true': 'four', 'false': 'five',
+        }
+        assert pickle.loads(pickle.dumps(two.events)) == two.events
+
+        # A new object for every edge, interned by the chart
+        edges = {}
+        for event, states_map in chart.statechart.items():
+            edges[event] = dict(
+                (HSMEState(**src.as_dict()), HSMEState(**dst.as_dict()))
+                for src, dst in states_map.items()
+            )
+        per_edge = HSMEStateChart(
+            chart_id=chart.chart_id,
+            initial_state=HSMEState(**chart.initial_state.as_dict()),
+            final_states=[
+                HSMEState(**i.as_dict()) for i in chart.final_states
+            ],
+            statechart=edges,
+        )
+        one = per_edge.states['one']
+        assert per_edge.initial_state is one
+        two = per_edge.statechart[True][one]
+        assert two is per_edge.states['two']
+        assert per_edge.statechart[True][two] is per_edge.states['four']
+        assert per_edge == chart
+
+    def test_guarded_chart(self):
+        chart = HSMEDictsParser(GUARDED_RULES_CHART).parse()
+        check = chart.states['check']
+        assert check.events == {'skip': 'approved'}
+        assert check.decisions['submit'].destinations == [
+            'approved', 'review', 'rejected', 'rejected',
+        ]
+        assert 'submit' not in chart.statechart
+        assert not check.is_final
+        assert chart.index.can_reach('check', 'review')
+
+        assert HSMEStateChart.as_obj(chart.as_dict()) == chart
+        assert HSMEStateChart.from_bytes(chart.as_bytes()) == chart
+        assert pickle.loads(pickle.dumps(chart)) == chart
+        streamed = HSMEStreamParser(iter(GUARDED_RULES_CHART)).parse()
+        assert streamed == chart
+        lazy_chart = HSMELazyStateChart.as_obj(chart.as_dict())
+        assert lazy_chart.states['review'].is_same(chart.states['review'])
+        assert lazy_chart == chart
+
+        broken = [
+            dict(GUARDED_RULES_CHART[1], events={'auto': [{'guards': [1]}]}),
+        ]
+        with pytest.raises(HSMEParserError):
+            HSMEDictsParser(GUARDED_RULES_CHART[:1] + broken).parse()
+        broken = [dict(GUARDED_RULES_CHART[1], events={'auto': ['nope']})]
+        with pytest.raises(HSMEParserError):
+            HSMEDictsParser(GUARDED_RULES_CHART[:1] + broken).parse()
+        with pytest.raises(HSMEParserError):
+            HSMEStreamParser(iter(GUARDED_RULES_CHART[:1] + broken)).parse()
+
+    def test_decision_table(self):
+        table = HSMEDecisionTable.compile([
+            {'guards': ['a', 'b', 'a'], 'to': 'one'},
+            {'guards': ['c'], 'to': 'two'},
+            {'guards': ['d'], 'to': 'two'},
+            'two',
+            {'guards': ['e'], 'to': 'three'},
+        ])
+        assert table.branches == (
+            (('a', 'b'), 'one'),
+            (('c',), 'two'),
+            (('d',), 'two'),
+            ((), 'two'),
+        )
+        assert table.settled == (None, 'two', 'two', 'two')
+
+        checked = []
+
+        def check(guard_id):
+            checked.append(guard_id)
+            return guard_id != 'a'
+
+        assert table.evaluate(check) == 'two'
+        assert checked == ['a']
+        assert table.evaluate(lambda guard_id: True) == 'one'
+
+        table = HSMEDecisionTable.compile([{'guards': ['a'], 'to': 'one'}])
+        assert table.evaluate(lambda guard_id: False) is None
+
+
+class TestHSMEStreamParser(object):
+
+    def test_real_chart(self):
+        expected = HSMEDictsParser(RULES_CHART).parse()
+        parser = HSMEStreamParser(iter(RULES_CHART))
+        assert parser.parse() == expected
+
+        parser = HSMEStreamParser(iter(reversed(RULES_CHART)))
+        model = parser.parse()
+        assert model.chart_id == expected.chart_id
+        assert model._get_transitions() == expected._get_transitions()
+        assert sorted(model.states) == sorted(expected.states)
+        for name, state in model.states.items():
+            assert state.is_same(expected.states[name])
+        assert parser.stats.states == 6
+        assert parser.stats.transitions == 6
+        assert parser.stats.peak_memory is None
+
+    def test_json_lines(self):
+        chart_file = io.StringIO(u'\n'.join(
+            [json.dumps(state) for state in PING_PONG_RULES_CHART] + [u'']
+        ))
+        parser = HSMEStreamParser(chart_file, trace_memory=True)
+        hsme = HSMERunner(registry=HSMEChartRegistry())
+        hsme.parse(chart_file, parser=lambda chart: parser)
+        hsme.start()
+        hsme.send('next')
+
+        assert hsme.in_state('pong')
+        assert hsme.model.chart_id == (
+            HSMEDictsParser(PING_PONG_RULES_CHART).parse().chart_id
+        )
+        if parser.stats.peak_memory is not None:
+            assert parser.stats.peak_memory > 0
+
+    @pytest.mark.parametrize('chart', [
+        NO_INITIAL_RULES_CHART,
+        TWO_INITIAL_RULES_CHART,
+        BROKEN_RULES_CHART,
+        MISSING_DESTINATION_RULES_CHART,
+        [42],
+    ])
+    def test_invalid_chart(self, chart):
+        with pytest.raises(HSMEParserError):
+            HSMEStreamParser(iter(chart)).parse()
+
+
+class TestHSMELazyStateChart(object):
+
+    def get_chart(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        raw_dict = json.loads(json.dumps(chart.as_dict()))
+        return chart, HSMELazyStateChart.as_obj(raw_dict)
+
+    def test_lazy_states(self):
+        _, chart = self.get_chart()
+        assert dict.__len__(chart.states) == 0
+        assert len(chart.states) == 6
+        assert 'six' in chart.states
+        assert 'seven' not in chart.states
+        assert chart.states.get('seven') is None
+
+        one = chart.initial_state
+        two = chart.statechart[True][one]
+        assert two is chart.states['two']
+        assert one is chart.states['one']
+        assert chart.statechart.get(True).get(two) is chart.states['four']
+        assert chart.statechart.get('nope') is None
+        assert dict.__len__(chart.states) == 3
+
+        assert chart.final_states[0] is chart.states['four']
+        assert sorted(chart.states) == sorted(
+            ['one', 'two', 'three', 'four', 'five', 'six']
+        )
+        assert dict.__len__(chart.states) == 6
+
+    def test_same_chart(self):
+        eager_chart, chart = self.get_chart()
+        assert chart.as_dict() == json.loads(json.dumps(eager_chart.as_dict()))
+        assert dict.__len__(chart.states) == 0
+
+        assert chart == eager_chart
+        assert eager_chart == chart
+        assert chart.table.width == eager_chart.table.width
+        assert HSMEStateChart.from_bytes(chart.as_bytes()) == eager_chart
+
+        _, chart = self.get_chart()
+        assert pickle.loads(pickle.dumps(chart)) == eager_chart
+
+    def test_runner(self):
+        eager_chart = HSMEDictsParser(RULES_CHART).parse()
+        dump = HSMERunner(registry=HSMEChartRegistry()).load(
+            eager_chart
+        ).dump()
+
+        hsme = HSMERunner(registry=HSMEChartRegistry()).load(dump)
+        chart = hsme.model.chart
+        assert isinstance(chart, HSMELazyStateChart)
+
+        hsme.start()
+        hsme.send(False)
+        assert hsme.current_state is chart.states['three']
+        assert not hsme.is_finished()
+        hsme.send(True)
+        assert hsme.is_finished()
+        assert json.loads(hsme.dump())['statechart'] == (
+            json.loads(dump)['statechart']
+        )
+        assert chart.table.states[
+            chart.table.state_ids['three']
+        ] is chart.states['three']
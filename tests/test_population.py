@@ -0,0 +1,89 @@
+# coding: utf-8
+import pytest
+
+from fsm.core import HSMERunner
+from fsm.parsers import HSMEDictsParser
+from fsm.population import HSMEPopulation, numpy
+from .charts.rules import RULES_CHART
+
+
+@pytest.fixture(params=[False, True], ids=['array', 'numpy'])
+def use_numpy(request):
+    if request.param and numpy is None:
+        pytest.skip('NumPy is not installed')
+    return request.param
+
+
+class TestHSMEPopulation(object):
+
+    @pytest.fixture(autouse=True)
+    def setup_backend(self, use_numpy):
+        self.use_numpy = use_numpy
+
+    def get_population(self, size):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        return HSMEPopulation(chart, size, use_numpy=self.use_numpy)
+
+    def test_start(self):
+        population = self.get_population(3)
+        assert population.get_state(0) is None
+
+        result = population.start()
+        assert list(result.accepted) == [0, 1, 2]
+        assert list(result.triggers[0]) == [0, 1, 2]
+        assert list(result.triggers[1]) == [1, 1, 1]
+        assert population.count('one') == 3
+
+        result = population.start()
+        assert list(result.accepted) == []
+
+    def test_step(self):
+        population = self.get_population(4)
+        result = population.step([True, None, None, None])
+        assert list(result.rejected) == [0]
+
+        population.start()
+        result = population.step([True, False, 'invalid_event', None])
+        assert list(result.accepted) == [0, 1]
+        assert list(result.rejected) == [2]
+        assert population.get_state(0).name == 'two'
+        assert population.get_state(1).name == 'three'
+        assert population.get_state(2).name == 'one'
+        assert list(result.triggers[0]) == [0, 1]
+        assert list(result.triggers[1]) == [2, 3]
+
+        result = population.step([False, True, None, None])
+        assert list(result.accepted) == [0, 1]
+        assert list(result.actions[0]) == [0, 1]
+        assert list(result.actions[1]) == [2, 3]
+        assert population.count('five') == 1
+        assert population.count('six') == 1
+
+        result = population.step([True, True, None, None])
+        assert list(result.rejected) == [0, 1]
+
+        with pytest.raises(ValueError):
+            population.step([True])
+
+    def test_empty_ids(self):
+        chart = HSMEDictsParser([
+            dict(state, action=0) if state.get('action') else state
+            for state in RULES_CHART
+        ]).parse()
+        population = HSMEPopulation(chart, 2, use_numpy=self.use_numpy)
+        population.start()
+        population.step([True, False])
+        result = population.step([False, True])
+        assert list(result.accepted) == [0, 1]
+        assert list(result.actions[0]) == []
+        assert list(result.actions[1]) == []
+
+    def test_session_export(self):
+        population = self.get_population(2)
+        population.start()
+        population.step([False, None])
+
+        hsme = HSMERunner().load(population.get_session(0))
+        assert hsme.in_state('three')
+        hsme.send(True)
+        assert hsme.in_state('six')
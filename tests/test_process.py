@@ -1,16 +1,30 @@
 # coding: utf-8
+import json
 import pytest
 import sqlite3
 
 from fsm.core import (
     HSMERunner,
     HSMERunnerError,
+    HSMETriggerChainError,
+    HSMEWrongEventError,
     HSMEWrongTriggerError,
 )
+from fsm.parsers import (
+    HSMEDictsParser,
+    HSMELazyStateChart,
+    HSMESession,
+    HSMEStateChart,
+)
+from fsm.registry import HSMEChartRegistry
 from .charts.rules import (
+    GUARDED_RULES_CHART,
+    HIERARCHICAL_RULES_CHART,
+    LOOP_TRIGGERS_RULES_CHART,
     RULES_CHART,
     SIMPLE_RULES_CHART,
     MULTIPLE_TRIGGERS_RULES_CHART,
+    get_chain_rules_chart,
 )
 
 
@@ -98,6 +112,31 @@ class TestHSMERunner(object):
         assert hsme.is_started()
         assert hsme.in_state('one')
 
+    def test_lifecycle_switch(self):
+        hsme = HSMERunner()
+        with pytest.raises(HSMERunnerError):
+            hsme.history
+
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        hsme.send(True)
+        serialized_hsme = hsme.dump()
+
+        hsme.parse(SIMPLE_RULES_CHART)
+        with pytest.raises(HSMERunnerError):
+            hsme.send(True)
+        with pytest.raises(HSMERunnerError):
+            hsme.is_finished()
+
+        hsme.load(serialized_hsme)
+        assert hsme.in_state('two')
+        assert hsme.can_send(False)
+
+        with pytest.raises(HSMERunnerError):
+            hsme.load('{}')
+        with pytest.raises(HSMERunnerError):
+            hsme.dump()
+
     def test_transition_flow(self):
         hsme = HSMERunner()
         hsme.parse(RULES_CHART)
@@ -112,6 +151,69 @@ class TestHSMERunner(object):
         hsme.send(True)
         assert hsme.in_state('two')
 
+    def test_send_many_flow(self):
+        hsme = HSMERunner()
+        hsme.parse(RULES_CHART)
+        hsme.start()
+
+        assert hsme.send_many([False, True])
+        assert hsme.in_state('six')
+        assert [h.state for h in hsme.model.history] == [
+            'one', 'three', 'six',
+        ]
+
+    def test_send_many_validation(self):
+        actions = []
+        hsme = HSMERunner(
+            action_source=lambda proxy, action_id: actions.append(action_id),
+        )
+        hsme.parse(RULES_CHART)
+        hsme.start()
+
+        with pytest.raises(HSMEWrongEventError):
+            hsme.send_many([True, True, True])
+        assert hsme.in_state('one')
+        assert len(hsme.model.history) == 1
+        assert not actions
+
+    def test_send_many_rollback(self):
+        def trigger_source(proxy, trigger_id):
+            return {2: False, 3: 'wrong_event'}[trigger_id]
+
+        hsme = HSMERunner(trigger_source=trigger_source, history_limit=3)
+        hsme.parse(RULES_CHART)
+        chart = hsme.model.chart
+        hsme.load(HSMESession(chart, current_state=chart.states['one']))
+
+        with pytest.raises(HSMEWrongTriggerError):
+            hsme.send_many([False])
+        assert hsme.in_state('one')
+        assert len(hsme.model.history) == 0
+
+        assert hsme.send_many([True])
+        assert hsme.in_state('five')
+        assert [h.state for h in hsme.model.history] == ['two', 'five']
+
+    def test_send_many_interrupted(self):
+        class Interrupted(BaseException):
+            pass
+
+        seen = []
+
+        def action_source(proxy, action_id):
+            seen.append([h.state for h in proxy.fsm.model.history])
+            raise Interrupted()
+
+        hsme = HSMERunner(action_source=action_source)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+
+        with pytest.raises(Interrupted):
+            hsme.send_many([False, True])
+        assert seen == [['one', 'three', 'six']]
+        assert hsme.in_state('one')
+        assert [h.state for h in hsme.model.history] == ['one']
+
     def test_runner_reload(self):
         hsme = HSMERunner()
         hsme.parse(RULES_CHART)
@@ -122,6 +224,139 @@ class TestHSMERunner(object):
 
         assert model_1 != model_2
 
+    def test_shared_chart_flow(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        hsme_1 = HSMERunner().load(chart)
+        hsme_2 = HSMERunner().load(chart)
+        assert hsme_1.model.chart is hsme_2.model.chart
+
+        hsme_1.start()
+        hsme_1.send(False)
+        assert hsme_1.in_state('three')
+        assert not hsme_2.is_started()
+
+        hsme_2.start()
+        hsme_2.send(True)
+        assert hsme_2.in_state('two')
+        assert hsme_1.in_state('three')
+        assert len(hsme_1.model.history) == 2
+
+    def test_hierarchical_flow(self):
+        hsme = HSMERunner(registry=HSMEChartRegistry())
+        hsme.parse(HIERARCHICAL_RULES_CHART)
+        hsme.start()
+        assert hsme.in_state('new')
+        assert hsme.in_state('order')
+        assert not hsme.in_state('payment')
+
+        hsme.send('pay')
+        assert hsme.in_state('pending')
+        assert hsme.in_state('payment')
+        hsme.send('confirm')
+        hsme.send('refund')
+        assert hsme.in_state('new')
+        hsme.send('pay')
+        hsme.send('confirm')
+        hsme.send('cancel')
+        assert hsme.in_state('refunded')
+        assert hsme.is_finished()
+
+        hsme_2 = HSMERunner(registry=HSMEChartRegistry()).load(hsme.dump())
+        assert not hsme_2.can_send('reset')
+        assert hsme_2.in_state('refunded')
+
+        hsme.load(hsme.model.chart)
+        hsme.start()
+        hsme.send('pay')
+        hsme_2.load(hsme.dump())
+        assert hsme_2.in_state('payment')
+        hsme_2.send('cancel')
+        assert hsme_2.in_state('cancelled')
+
+    @pytest.mark.parametrize('cache_guards', [False, True])
+    def test_guarded_flow(self, cache_guards):
+        checked = []
+
+        def guard_source(proxy, guard_id):
+            assert proxy.dst is None
+            checked.append(guard_id)
+            return guard_id in proxy.payload
+
+        hsme = HSMERunner(
+            registry=HSMEChartRegistry(),
+            trigger_source=lambda proxy, trigger_id: 'auto',
+            guard_source=guard_source,
+            cache_guards=cache_guards,
+        )
+        hsme.parse(GUARDED_RULES_CHART)
+        hsme.start()
+        assert hsme.can_send('submit', payload={'is_vip'})
+        assert not hsme.can_send('nope')
+
+        # The last branches lead to the same state, is_verified is skipped
+        del checked[:]
+        hsme.send('submit', payload=set())
+        assert hsme.in_state('rejected')
+        assert checked == ['is_vip', 'has_credit']
+
+        del checked[:]
+        hsme.load(hsme.model.chart)
+        hsme.start()
+        # is_vip is checked again by the triggered state, once if cached
+        hsme.send('submit', payload={'has_credit', 'is_verified'})
+        assert hsme.in_state('rejected')
+        assert checked == (
+            ['is_vip', 'has_credit', 'is_verified'] +
+            ([] if cache_guards else ['is_vip'])
+        )
+        assert [h.state for h in hsme.model.history] == [
+            'check', 'review', 'rejected',
+        ]
+
+        hsme.load(hsme.model.chart)
+        hsme.start()
+        hsme.send_many(['submit'], payload={'is_vip'})
+        assert hsme.in_state('approved')
+
+        hsme.load(hsme.model.chart)
+        hsme.start()
+        with pytest.raises(HSMEWrongEventError):
+            hsme.send_many(['skip', 'submit'], payload={'is_vip'})
+
+        hsme_2 = HSMERunner(registry=HSMEChartRegistry())
+        hsme_2.load(hsme.dump())
+        hsme_2.start()
+        with pytest.raises(HSMEWrongEventError):
+            hsme_2.send('submit', payload={'is_vip'})
+
+    def test_guarded_full_dump(self):
+        def guard_source(proxy, guard_id):
+            return guard_id in proxy.payload
+
+        hsme = HSMERunner(registry=HSMEChartRegistry())
+        hsme.parse(GUARDED_RULES_CHART)
+        dump = hsme.dump()
+        assert [s['name'] for s in json.loads(dump)['states']] == ['review']
+
+        for chart in (
+            HSMEStateChart.as_obj(json.loads(dump)),
+            HSMELazyStateChart.as_obj(json.loads(dump)),
+        ):
+            assert chart.states['review'].decisions
+            assert HSMEStateChart.as_obj(chart.as_dict()) == chart
+
+        hsme_2 = HSMERunner(
+            registry=HSMEChartRegistry(),
+            trigger_source=lambda proxy, trigger_id: 'auto',
+            guard_source=guard_source,
+        )
+        hsme_2.load(dump)
+        hsme_2.start()
+        hsme_2.send('submit', payload={'has_credit', 'is_verified'})
+        assert [h.state for h in hsme_2.model.history] == [
+            'check', 'review', 'rejected',
+        ]
+
     def test_dump_load_flow(self):
         hsme = HSMERunner()
         hsme.parse(RULES_CHART)
@@ -141,6 +376,73 @@ class TestHSMERunner(object):
 
         assert hsme_2.in_state('three')
 
+    def test_compact_dump_load_flow(self):
+        registry = HSMEChartRegistry()
+        hsme = HSMERunner(registry=registry)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        hsme.send(False)
+
+        serialized_hsme = hsme.dump(compact=True)
+        assert len(serialized_hsme) < len(hsme.dump()) / 5
+
+        hsme_2 = HSMERunner(registry=registry)
+        hsme_2.load(serialized_hsme)
+        assert hsme_2.model.chart is hsme.model.chart
+        assert hsme_2.in_state('three')
+        assert hsme_2.model == hsme.model
+
+        hsme_3 = HSMERunner(registry=HSMEChartRegistry())
+        with pytest.raises(HSMERunnerError):
+            hsme_3.load(serialized_hsme)
+
+        hsme_3.load(hsme.dump())
+        hsme_3.load(serialized_hsme)
+        assert hsme_3.in_state('three')
+
+    def test_delta_dump_load_flow(self):
+        hsme = HSMERunner()
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        base_dump = hsme.dump(compact=True)
+
+        hsme.send(True)
+        delta_1 = hsme.dump(delta=True)
+        assert len(json.loads(delta_1)['history']) == 1
+
+        hsme.send(False)
+        delta_2 = hsme.dump(delta=True)
+        delta_3 = hsme.dump(delta=True)
+        assert json.loads(delta_3)['history'] == []
+
+        hsme_2 = HSMERunner()
+        hsme_2.load(base_dump, deltas=[delta_1, delta_2, delta_3])
+        assert hsme_2.in_state('five')
+        assert hsme_2.model == hsme.model
+
+        hsme_2.load(base_dump, deltas=[delta_1])
+        assert hsme_2.in_state('two')
+
+        with pytest.raises(HSMERunnerError):
+            hsme_2.load(delta_1)
+
+        hsme_3 = HSMERunner()
+        hsme_3.parse(SIMPLE_RULES_CHART)
+        with pytest.raises(HSMERunnerError):
+            hsme_3.load(hsme_3.dump(compact=True), deltas=[delta_1])
+
+    def test_delta_dump_history_limit(self):
+        hsme = HSMERunner(history_limit=2)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        hsme.dump(delta=True)
+
+        hsme.send(True)
+        assert len(json.loads(hsme.dump(delta=True))['history']) == 1
+
+        hsme.send(False)
+        assert len(json.loads(hsme.dump(delta=True))['history']) == 1
+
     def test_triggers_flow(self):
         hsme = HSMERunner(trigger_source=event_trigger_source)
         hsme.parse(RULES_CHART)
@@ -154,8 +456,47 @@ class TestHSMERunner(object):
             {'state': 'five', 'event': False},
         ]
         for i, rec in enumerate(hsme.model.history):
-            assert rec['state'] == should_be_history[i]['state']
-            assert rec['event'] == should_be_history[i]['event']
+            assert rec.state == should_be_history[i]['state']
+            assert rec.event == should_be_history[i]['event']
+
+    def test_history_limit_flow(self):
+        hsme = HSMERunner(history_limit=0)
+        hsme.parse(RULES_CHART)
+        assert hsme.history.endswith('not started')
+        hsme.start()
+        hsme.send(True)
+        assert len(hsme.model.history) == 0
+        assert hsme.history.endswith('(two, no history)')
+
+        hsme = HSMERunner(history_limit=2, clock=lambda: 42)
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        hsme.send(True)
+        hsme.send(False)
+        assert [tuple(h) for h in hsme.model.history] == [
+            ('two', True, 42),
+            ('five', False, 42),
+        ]
+
+        hsme_2 = HSMERunner(history_limit=1)
+        hsme_2.load(hsme.dump())
+        assert hsme_2.model.history[0].state == 'five'
+
+        hsme_3 = HSMERunner()
+        hsme_3.load(hsme.dump(compact=True))
+        assert hsme_3.model == hsme.model
+
+    def test_legacy_history_load(self):
+        hsme = HSMERunner()
+        hsme.parse(RULES_CHART)
+        hsme.start()
+        legacy_dump = json.loads(hsme.dump())
+        legacy_dump['history'] = [
+            {'state': 'one', 'event': None, 'timestamp': 1489430643},
+        ]
+
+        hsme.load(json.dumps(legacy_dump))
+        assert hsme.model.history[0].timestamp == 1489430643
 
     def test_wrong_triggers_flow(self):
         hsme = HSMERunner(trigger_source=lambda proxy, i: 'wrong_event')
@@ -164,6 +505,44 @@ class TestHSMERunner(object):
         with pytest.raises(HSMEWrongTriggerError):
             hsme.start()
 
+    def test_long_triggers_chain_flow(self):
+        hsme = HSMERunner(trigger_source=event_trigger_source)
+        hsme.parse(get_chain_rules_chart(5000))
+
+        with pytest.raises(HSMETriggerChainError):
+            hsme.start()
+        assert hsme.in_state(1000)
+
+        hsme = HSMERunner(
+            trigger_source=event_trigger_source,
+            max_trigger_steps=10000,
+        )
+        hsme.parse(get_chain_rules_chart(5000))
+        hsme.start()
+        assert hsme.in_state(5000)
+        assert len(hsme.model.history) == 5001
+
+    def test_triggers_loop_flow(self):
+        hsme = HSMERunner(trigger_source=event_trigger_source)
+        hsme.parse(LOOP_TRIGGERS_RULES_CHART)
+
+        with pytest.raises(HSMETriggerChainError):
+            hsme.start()
+        assert [h.state for h in hsme.model.history] == [
+            'one', 'two', 'one',
+        ]
+
+        hsme = HSMERunner(
+            trigger_source=event_trigger_source,
+            detect_trigger_cycles=False,
+            max_trigger_steps=50,
+        )
+        hsme.parse(LOOP_TRIGGERS_RULES_CHART)
+
+        with pytest.raises(HSMETriggerChainError):
+            hsme.start()
+        assert len(hsme.model.history) == 51
+
     def test_multiple_triggers_flow(self):
         hsme = HSMERunner(
             trigger_source=multiple_event_trigger_source,
@@ -178,8 +557,8 @@ class TestHSMERunner(object):
             {'state': 'three', 'event': True},
         ]
         for i, rec in enumerate(hsme.model.history):
-            assert rec['state'] == should_be_history[i]['state']
-            assert rec['event'] == should_be_history[i]['event']
+            assert rec.state == should_be_history[i]['state']
+            assert rec.event == should_be_history[i]['event']
 
     def test_actions_flow(self):
         hsme = HSMERunner(
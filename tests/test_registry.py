@@ -0,0 +1,129 @@
+# coding: utf-8
+from fsm.core import HSMERunner
+from fsm.parsers import HSMEDictsParser, HSMEState, HSMEStateChart
+from fsm.registry import HSMEChartRegistry
+from .charts.rules import (
+    RULES_CHART,
+    SIMPLE_RULES_CHART,
+    MULTIPLE_TRIGGERS_RULES_CHART,
+)
+
+
+class TestHSMEChartRegistry(object):
+
+    def test_stable_chart_id(self):
+        chart_id = HSMEDictsParser(RULES_CHART).parse().chart_id
+        assert chart_id == '1b92ad4a9276621c2e9da8429a4f30f6'
+
+        reordered_chart = [
+            dict(reversed(list(state.items())))
+            for state in reversed(RULES_CHART)
+        ]
+        assert HSMEDictsParser(reordered_chart).parse().chart_id == chart_id
+
+        changed_chart = [dict(state) for state in RULES_CHART]
+        changed_chart[-1]['action'] = 4
+        assert HSMEDictsParser(changed_chart).parse().chart_id != chart_id
+
+    def test_parse_cache(self):
+        registry = HSMEChartRegistry()
+        hsme_1 = HSMERunner(registry=registry).parse(RULES_CHART)
+        hsme_2 = HSMERunner(registry=registry).parse(list(RULES_CHART))
+
+        assert hsme_1.model.chart is hsme_2.model.chart
+        assert registry.info().hits == 1
+        assert registry.info().misses == 1
+
+    def test_parse_cache_no_rehash(self, monkeypatch):
+        registry = HSMEChartRegistry()
+        chart = HSMERunner(registry=registry).parse(RULES_CHART).model.chart
+
+        def get_chart_id(obj):
+            raise AssertionError('the chart is hashed again')
+
+        monkeypatch.setattr(HSMEDictsParser, 'get_chart_id', get_chart_id)
+        hsme = HSMERunner(registry=registry).parse(
+            list(RULES_CHART), chart_id=chart.chart_id,
+        )
+        assert hsme.model.chart is chart
+        assert registry.info().hits == 1
+
+    def test_parse_changed_chart(self):
+        registry = HSMEChartRegistry()
+        raw_chart = [dict(state) for state in SIMPLE_RULES_CHART]
+        hsme = HSMERunner(registry=registry).parse(raw_chart)
+        hsme.start()
+        assert not hsme.can_send('go2')
+
+        raw_chart[0]['events'] = dict(raw_chart[0]['events'], go2='two')
+        hsme = HSMERunner(registry=registry).parse(raw_chart)
+        hsme.start()
+        assert hsme.can_send('go2')
+
+    def test_load_charts_without_id(self):
+        registry = HSMEChartRegistry()
+        charts = []
+        for raw_chart in (RULES_CHART, SIMPLE_RULES_CHART):
+            chart = HSMEDictsParser(raw_chart).parse()
+            charts.append(HSMEStateChart(
+                initial_state=chart.initial_state,
+                final_states=chart.final_states,
+                statechart=chart.statechart,
+            ))
+
+        for chart in charts:
+            hsme = HSMERunner(registry=registry).load(chart)
+            assert hsme.model.chart is chart
+        assert len(registry) == 0
+
+    def test_parse_cache_per_parser(self):
+        class CustomState(HSMEState):
+            __slots__ = ()
+
+        class CustomParser(HSMEDictsParser):
+            STATE_CLS = CustomState
+
+        registry = HSMEChartRegistry()
+        chart = HSMERunner(registry=registry).parse(RULES_CHART).model.chart
+        custom_chart = HSMERunner(registry=registry).parse(
+            RULES_CHART, parser=CustomParser,
+        ).model.chart
+
+        assert custom_chart is not chart
+        assert all(
+            isinstance(state, CustomState)
+            for state in custom_chart.states.values()
+        )
+        assert HSMERunner(registry=registry).parse(
+            RULES_CHART, parser=CustomParser,
+        ).model.chart is custom_chart
+        assert registry.info().misses == 2
+        assert registry.get(chart.chart_id) is chart
+
+    def test_load_cache(self):
+        registry = HSMEChartRegistry()
+        hsme_1 = HSMERunner(registry=registry).parse(RULES_CHART)
+        hsme_2 = HSMERunner(registry=registry).load(hsme_1.dump())
+
+        assert hsme_1.model.chart is hsme_2.model.chart
+
+    def test_lru_eviction(self):
+        registry = HSMEChartRegistry(maxsize=2)
+        charts = [
+            HSMEDictsParser(chart).parse()
+            for chart in (
+                RULES_CHART,
+                SIMPLE_RULES_CHART,
+                MULTIPLE_TRIGGERS_RULES_CHART,
+            )
+        ]
+        registry.add(charts[0])
+        registry.add(charts[1])
+        assert registry.get(charts[0].chart_id) is charts[0]
+
+        registry.add(charts[2])
+        assert len(registry) == 2
+        assert charts[0].chart_id in registry
+        assert charts[1].chart_id not in registry
+        assert registry.get(charts[1].chart_id) is None
+        assert registry.info() == (1, 1, 2, 2)
@@ -0,0 +1,53 @@
+# coding: utf-8
+import pytest
+
+from fsm.parsers import HSMEDictsParser
+from fsm.replay import HSMEReplayer
+from .charts.rules import RULES_CHART
+from .test_process import event_trigger_source
+
+
+def get_records(count):
+    for i in range(count):
+        if i % 3 == 0:
+            yield i, [True, False]
+        elif i % 3 == 1:
+            yield i, [False, True]
+        else:
+            yield i, [False, 'wrong_event', False]
+
+
+class TestHSMEReplayer(object):
+
+    @pytest.mark.parametrize('processes', [1, 2])
+    def test_replay(self, processes):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        replayer = HSMEReplayer(chart, processes=processes, chunksize=7)
+        results = sorted(replayer.run(get_records(100)))
+
+        assert [r.machine_id for r in results] == list(range(100))
+        assert results[0].state == 'five'
+        assert [h.state for h in results[0].history] == ['one', 'two', 'five']
+        assert results[1].state == 'six'
+        assert results[2].state == 'six'
+        assert results[2].rejected == [(1, 'wrong_event')]
+
+        assert replayer.stats.records == 100
+        assert replayer.stats.events == 233
+        assert replayer.stats.rejected == 33
+        assert replayer.stats.events_per_sec > 0
+
+    def test_replay_with_triggers(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        replayer = HSMEReplayer(
+            chart,
+            processes=2,
+            runner_kwargs={'trigger_source': event_trigger_source},
+        )
+        results = list(replayer.run([('a', []), ('b', [True])]))
+
+        assert sorted((r.machine_id, r.state) for r in results) == [
+            ('a', 'five'),
+            ('b', 'five'),
+        ]
+        assert replayer.stats.rejected == 1
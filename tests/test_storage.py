@@ -0,0 +1,60 @@
+# coding: utf-8
+import pytest
+
+from fsm.core import HSMERunner
+from fsm.registry import HSMEChartRegistry
+from fsm.storage import HSMESQLiteStorage
+from .charts.rules import RULES_CHART, SIMPLE_RULES_CHART
+
+
+class TestHSMESQLiteStorage(object):
+
+    def get_runner(self, chart, *events):
+        hsme = HSMERunner(registry=HSMEChartRegistry())
+        hsme.parse(chart)
+        hsme.start()
+        for event in events:
+            hsme.send(event)
+        return hsme
+
+    def test_save_load(self, tmpdir):
+        database = str(tmpdir.join('machines.db'))
+        storage = HSMESQLiteStorage(database, batch_size=2)
+
+        storage.save(1, self.get_runner(RULES_CHART, True))
+        assert storage.load(1).in_state('two')
+        assert not storage.connection.execute(
+            'select * from hsme_machines'
+        ).fetchall()
+
+        storage.save(2, self.get_runner(SIMPLE_RULES_CHART, False))
+        assert len(storage.connection.execute(
+            'select * from hsme_machines'
+        ).fetchall()) == 2
+
+        storage.save(1, self.get_runner(RULES_CHART, False, True))
+        storage.close()
+
+        storage = HSMESQLiteStorage(database)
+        hsme = storage.load(1, HSMERunner(registry=HSMEChartRegistry()))
+        assert hsme.in_state('six')
+        assert len(hsme.model.history) == 3
+
+        with pytest.raises(KeyError):
+            storage.load(3)
+
+    def test_load_many(self):
+        storage = HSMESQLiteStorage(batch_size=10)
+        storage.MAX_VARIABLES = 3
+        for i in range(12):
+            storage.save(i, self.get_runner(RULES_CHART, bool(i % 2)))
+
+        registry = HSMEChartRegistry()
+        runners = storage.load_many(
+            list(range(15)),
+            lambda: HSMERunner(registry=registry),
+        )
+        assert sorted(runners) == list(range(12))
+        assert runners[4].in_state('three')
+        assert runners[11].in_state('two')
+        assert len(set(id(r.model.chart) for r in runners.values())) == 1
@@ -0,0 +1,33 @@
+# coding: utf-8
+from fsm.parsers import HSMEDictsParser
+from fsm.table import HSMETransitionTable
+from .charts.rules import RULES_CHART
+
+
+class TestHSMETransitionTable(object):
+
+    def test_compile(self):
+        chart = HSMEDictsParser(RULES_CHART).parse()
+        table = HSMETransitionTable.compile(chart)
+
+        assert len(table.states) == 6
+        assert set(table.events) == set([True, False])
+        assert table.table.typecode == 'b'
+        assert len(table.table) == 12
+
+        for event, transitions in chart.statechart.items():
+            for src, dst in transitions.items():
+                dst_id = table.lookup(
+                    table.state_ids[src.name],
+                    table.event_ids[event],
+                )
+                assert table.states[dst_id] is dst
+
+        four_id = table.state_ids['four']
+        assert list(table.get_row(four_id)) == [table.NO_TRANSITION] * 2
+        assert chart.table is chart.table
+
+    def test_typecode(self):
+        assert HSMETransitionTable.get_typecode(100) == 'b'
+        assert HSMETransitionTable.get_typecode(300) == 'h'
+        assert HSMETransitionTable.get_typecode(40000) == 'i'
@@ -0,0 +1,84 @@
+# coding: utf-8
+import threading
+
+import pytest
+
+from fsm.core import HSMEWrongEventError
+from fsm.threadsafe import HSMEThreadSafeRunner
+from .charts.rules import PING_PONG_RULES_CHART, RULES_CHART
+
+
+class TestHSMEThreadSafeRunner(object):
+
+    def test_concurrent_send(self):
+        active = []
+        overlaps = []
+
+        def action_source(proxy, action_id):
+            active.append(proxy)
+            if len(active) > 1:
+                overlaps.append(proxy)
+            active.pop()
+
+        hsme = HSMEThreadSafeRunner(action_source=action_source)
+        hsme.parse(PING_PONG_RULES_CHART)
+        hsme.start()
+
+        def worker():
+            for _ in range(500):
+                hsme.send('next')
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(hsme.model.history) == 4001
+        assert hsme.in_state('ping')
+        assert not overlaps
+        assert not hsme._mailbox
+
+    def test_reentrant_send(self):
+        def action_source(proxy, action_id):
+            assert proxy.fsm.send('next') is None
+            assert proxy.fsm.in_state('pong')
+
+        hsme = HSMEThreadSafeRunner(action_source=action_source)
+        hsme.parse(PING_PONG_RULES_CHART)
+        hsme.start()
+
+        assert hsme.send('next')
+        assert hsme.in_state('ping')
+        assert [h.state for h in hsme.model.history] == [
+            'ping', 'pong', 'ping',
+        ]
+
+    def test_reentrant_errors(self):
+        def action_source(proxy, action_id):
+            if proxy.dst.name == 'pong':
+                proxy.fsm.send('wrong_event')
+
+        hsme = HSMEThreadSafeRunner(action_source=action_source)
+        hsme.parse(PING_PONG_RULES_CHART)
+        hsme.start()
+
+        with pytest.raises(HSMEWrongEventError):
+            hsme.send('next')
+        assert hsme.in_state('pong')
+        assert not hsme._mailbox
+
+        assert hsme.send('next')
+        assert hsme.in_state('ping')
+
+    def test_errors(self):
+        hsme = HSMEThreadSafeRunner()
+        hsme.parse(RULES_CHART)
+        hsme.start()
+
+        with pytest.raises(HSMEWrongEventError):
+            hsme.send('wrong_event')
+
+        hsme.send(True)
+        assert hsme.in_state('two')
+        assert hsme.load(hsme.dump()) is hsme